@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# Micro-benchmark of the scraper extractors (see mopidy_youtube/extractors.py)
+# on the recorded pages in tests/fixtures/pages. Every extractor reads the
+# page layout it was written for: the JSON extractor the current pages, the
+# regex extractor the older markup in tests/fixtures/pages/legacy, which holds
+# the same videos and playlists. Prints the CPU time every extractor needs per
+# page and per item found. Run from the source directory, with Mopidy-YouTube
+# installed (or PYTHONPATH=.), eg.
+#
+#   python benchmarks/extractors.py
+#   python benchmarks/extractors.py --scale 10   # pages 10 times as large
+#
+# A case in which an extractor finds nothing measures nothing, so the script
+# fails if there is one.
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import os
+import sys
+import time
+
+from mopidy_youtube.extractors import extractors
+
+pages = os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'fixtures', 'pages')
+
+# directory of the pages every extractor reads, in 'pages'
+layouts = {
+    'json': '',
+    'regex': 'legacy',
+}
+
+# (page, extractor method, extra arguments)
+cases = [
+    ('search.html', 'search', ()),
+    ('watch.html', 'video', ('C0DPdy98e4c',)),
+    ('playlist.html', 'playlist', ('PLOxORm4jpOQfMU7bpfGCzDyLropIYEHuR',)),
+    ('playlist.html', 'playlistitems', ()),
+]
+
+
+def cpu_time(f, rounds):
+    start = time.clock()
+    for i in range(rounds):
+        f()
+    return (time.clock() - start) / rounds
+
+
+def read_page(name, layout, scale):
+    path = os.path.join(pages, layout, name)
+    with io.open(path, encoding='utf-8') as f:
+        return f.read() * scale
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--scale', type=int, default=1,
+                        help='repeat the body of every page this many times')
+    args = parser.parse_args()
+
+    empty = []
+    print('%-16s %-14s %8s %6s %12s %12s' % (
+        'page', 'method', 'parser', 'items', 'ms/page', 'ms/item'))
+    for page, method, extra in cases:
+        for name, extractor in sorted(extractors.items()):
+            text = read_page(page, layouts[name], args.scale)
+
+            def run():
+                return list(getattr(extractor, method)(text, *extra))
+
+            items = len(run())
+            ms = cpu_time(run, args.rounds) * 1000
+            if items:
+                print('%-16s %-14s %8s %6d %12.3f %12.3f' % (
+                    page, method, name, items, ms, ms / items))
+            else:
+                print('%-16s %-14s %8s %6d %12.3f %12s' % (
+                    page, method, name, items, ms, 'no items!'))
+                empty.append('%s %s on %s' % (name, method, page))
+
+    if empty:
+        sys.exit('extractors found nothing: ' + ', '.join(empty))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+
+# End-to-end benchmark of YouTubeLibraryProvider.search/lookup and
+# YouTubePlaybackProvider.translate_uri, offline. Requests to the API and to
+# www.youtube.com are answered from the recorded cassettes in tests/fixtures
+# where they match (search for 'chvrches', the 60 videos playlist), and from
+# synthetic fixtures otherwise: 1000 videos playlists, search results and
+# scraper pages of --page-kb KiB. Every response takes --latency ms, every
+# youtube_dl resolution --resolve-ms ms, so the numbers depend on the code,
+# not on the network.
+#
+# Every scenario runs with every --threads value (threads_max), with the API
+# and/or the scraper, and
+#  - cold: the in-memory caches are emptied before every call
+#  - warm: the same call again, with the caches filled by the previous one
+#  - throughput: --clients threads making calls at once, for different
+#    videos/playlists/searches (so mostly cold)
+#
+# Results are written as JSON, so they can be compared between commits. Run
+# from the source directory, with Mopidy-YouTube installed (or PYTHONPATH=.),
+# eg.
+#
+#   python benchmarks/run.py --output before.json
+#   python benchmarks/run.py --output after.json --compare before.json
+#   python benchmarks/run.py --scenarios search,lookup_video --threads 2
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from urlparse import parse_qs, urlparse
+
+import mock
+
+from mopidy import config as mopidy_config
+
+from vcr.persisters.filesystem import FilesystemPersister
+from vcr.serializers import yamlserializer
+
+from mopidy_youtube import Extension, youtube
+from mopidy_youtube.backend import YouTubeBackend
+
+fixtures = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures')
+
+cassettes = ['youtube_search.yaml', 'youtube_playlist.yaml']
+
+recorded_query = 'chvrches'
+recorded_playlist = 'PLOxORm4jpOQfMU7bpfGCzDyLropIYEHuR'
+
+
+def video_id(n):
+    return 'bv%09d' % n
+
+
+def playlist_id(n):
+    return 'PLbench%027d' % n
+
+
+class Response(object):
+    def __init__(self, url, text, status_code=200):
+        self.url = url
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        content = self.text.encode('utf-8')
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+# Stands in for the requests sessions of API and scrAPI. Answers from the
+# cassettes if a recorded request matches (same endpoint, same parameters
+# apart from the key and the requested fields), from synthetic fixtures
+# otherwise.
+#
+class Network(object):
+    ignored = ('key', 'fields', 'part', 'maxResults')
+
+    def __init__(self, latency, page_kb, playlist_size, search_results):
+        self.latency = latency
+        self.playlist_size = playlist_size
+        self.search_results = search_results
+        self.recorded = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        for cassette in cassettes:
+            requests, responses = FilesystemPersister.load_cassette(
+                os.path.join(fixtures, cassette), yamlserializer)
+            for request, response in zip(requests, responses):
+                self.recorded[self.key(request.uri)] = \
+                    response['body']['string'].decode('utf-8')
+
+        # scraper pages are padded with a script in front of their data,
+        # like the real ones
+        def page(name):
+            with io.open(os.path.join(fixtures, 'pages', name),
+                         encoding='utf-8') as f:
+                return f.read()
+        self.padding = '<script>var padding = "%s";</script>' % (
+            'x' * (page_kb * 1024))
+        self.search_page = self.padding + page('search.html')
+        self.watch_page = page('watch.html')
+        self.playlist_page = self.padding + page('playlist.html')
+
+    def key(self, url, params=None):
+        url = urlparse(url)
+        query = parse_qs(url.query)
+        query.update(params or {})
+        return url.path, tuple(sorted(
+            (k, unicode(v[0] if isinstance(v, list) else v))
+            for k, v in query.items()
+            if k not in self.ignored and v not in (None, '')))
+
+    def get(self, url, params=None, stream=False):
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+
+        text = self.recorded.get(self.key(url, params))
+        if text is None:
+            path = urlparse(url).path.rsplit('/', 1)[-1]
+            text = getattr(self, 'synthetic_' + path)(params or {})
+        return Response(url, text)
+
+    # API
+
+    def video_item(self, id, n=0):
+        return {
+            'id': id,
+            'snippet': {
+                'title': 'Video %s' % id,
+                'channelTitle': 'Channel %d' % (n % 7),
+                'thumbnails': {'high': {
+                    'url': 'https://i.ytimg.com/vi/%s/hqdefault.jpg' % id}},
+            },
+            'contentDetails': {'duration': 'PT%dM%dS' % (n % 9 + 1, n % 60)},
+        }
+
+    def synthetic_search(self, params):
+        n = abs(hash(params['q'])) % 10 ** 6 * 100
+        items = []
+        for i in range(self.search_results):
+            if i % 5 == 4:
+                id = {'kind': 'youtube#playlist', 'playlistId': playlist_id(
+                    n + i)}
+            else:
+                id = {'kind': 'youtube#video', 'videoId': video_id(n + i)}
+            item = self.video_item(None, i)
+            item['id'] = id
+            items.append(item)
+        return json.dumps({'items': items})
+
+    def synthetic_videos(self, params):
+        return json.dumps({'items': [
+            self.video_item(id, n)
+            for n, id in enumerate(params['id'].split(','))
+        ]})
+
+    def synthetic_playlists(self, params):
+        return json.dumps({'items': [{
+            'id': id,
+            'snippet': {'title': 'Playlist %s' % id, 'channelTitle': 'bench'},
+            'contentDetails': {'itemCount': self.playlist_size},
+        } for id in params['id'].split(',')]})
+
+    def playlist_video_ids(self, id):
+        n = abs(hash(id)) % 10 ** 5 * 10000
+        return [video_id(n + i) for i in range(self.playlist_size)]
+
+    def synthetic_playlistItems(self, params):
+        ids = self.playlist_video_ids(params['playlistId'])
+        start = int(params.get('pageToken') or 0)
+        end = start + int(params['maxResults'])
+        return json.dumps({
+            'items': [{'snippet': {
+                'title': 'Video %s' % id,
+                'resourceId': {'videoId': id},
+            }} for id in ids[start:end]],
+            'nextPageToken': unicode(end) if end < len(ids) else None,
+        })
+
+    # scraper
+
+    def synthetic_results(self, params):
+        return self.search_page
+
+    def synthetic_watch(self, params):
+        return self.watch_page
+
+    def synthetic_playlist(self, params):
+        if not params['list'].startswith('PLbench'):
+            return self.playlist_page   # recorded, or found by search
+        data = {
+            'header': {'playlistHeaderRenderer': {
+                'title': {'simpleText': 'Playlist %s' % params['list']},
+                'ownerText': {'simpleText': 'bench'},
+                'numVideosText': {
+                    'simpleText': '%d videos' % self.playlist_size},
+            }},
+            'contents': [{'playlistVideoRenderer': {
+                'videoId': id,
+                'title': {'simpleText': 'Video %s' % id},
+            }} for id in self.playlist_video_ids(params['list'])],
+        }
+        return '%s<script>var ytInitialData = %s;</script>' % (
+            self.padding, json.dumps(data))
+
+
+# Stands in for youtube_dl.YoutubeDL
+#
+class YoutubeDL(object):
+    resolve = 0.3
+
+    def __init__(self, params):
+        pass
+
+    def get_info_extractor(self, key):
+        return mock.Mock()
+
+    def extract_info(self, url, **kwargs):
+        time.sleep(self.resolve)
+        return {'url': 'https://example.com/%s?expire=%d' % (
+            url[-11:], time.time() + 6 * 3600)}
+
+
+def wait_idle(timeout=60):
+    deadline = time.time() + timeout
+    while youtube.ThreadPool.threads_active or youtube.Batcher.waiting:
+        if time.time() > deadline:
+            raise RuntimeError('background jobs still running')
+        time.sleep(0.001)
+
+
+def empty_caches():
+    youtube.ThreadPool.cancel(youtube.ThreadPool.PREFETCH)
+    wait_idle()
+    with youtube.EntityStore.lock:
+        youtube.EntityStore.lru.clear()
+        youtube.EntityStore.alive.clear()
+        youtube.EntityStore.stamps = weakref.WeakKeyDictionary()
+        youtube.EntityStore.size = 0
+    with youtube.SearchCache.lock:
+        youtube.SearchCache.cache = None
+    with youtube.AudioUrlCache.lock:
+        youtube.AudioUrlCache.queued.clear()
+    gc.collect()
+
+
+def make_backend(args, api, threads, tmp):
+    ext = Extension()
+    overrides = [
+        ('core', 'cache_dir', tmp),
+        ('core', 'data_dir', tmp),
+        ('youtube', 'api_enabled', 'true' if api else 'false'),
+        ('youtube', 'api_quota', '0'),     # don't fall back to the scraper
+        ('youtube', 'threads_max', unicode(threads)),
+        ('youtube', 'threads_lookup', unicode(threads)),
+        ('youtube', 'threads_playback', unicode(threads)),
+        ('youtube', 'threads_prefetch', unicode(max(1, threads // 2))),
+        ('youtube', 'playlist_max_videos', unicode(args.playlist_size)),
+        ('youtube', 'cache_max_entries', '0'),   # no disk cache
+        ('youtube', 'resolve_ahead', '0'),
+        ('youtube', 'search_deadline', args.search_deadline),
+    ]
+    config, errors = mopidy_config.load(
+        [], [ext.get_config_schema()], [ext.get_default_config()], overrides)
+    if errors:
+        raise RuntimeError('config errors: %r' % errors)
+
+    youtube.YoutubeDLPool.idle = []
+    backend = YouTubeBackend(config, audio=None)
+    network = Network(args.latency / 1000.0, args.page_kb,
+                      args.playlist_size, config['youtube']['search_results'])
+    youtube.API.session = youtube.scrAPI.session = network
+    wait_idle()
+    return backend, network
+
+
+# scenario name -> f(backend, n), the call to measure. Calls with different
+# n are about different videos/playlists/searches, n = 0 uses the cassettes
+# where there is one
+#
+def search(backend, n):
+    query = recorded_query if n == 0 else 'query %d' % n
+    return len(backend.library.search({'any': [query]}).tracks)
+
+
+def lookup_video(backend, n):
+    return len(backend.library.lookup('youtube:video/v.%s' % video_id(n)))
+
+
+def lookup_playlist(backend, n):
+    return len(backend.library.lookup(
+        'youtube:playlist/p.%s' % playlist_id(n + 1)))
+
+
+def lookup_playlist_recorded(backend, n):
+    return len(backend.library.lookup(
+        'youtube:playlist/p.%s' % recorded_playlist))
+
+
+def translate_uri(backend, n):
+    url = backend.playback.translate_uri('youtube:video/v.%s' % video_id(n))
+    return 1 if url else 0
+
+
+scenarios = OrderedDict([
+    ('search', search),
+    ('lookup_video', lookup_video),
+    ('lookup_playlist', lookup_playlist),
+    ('lookup_playlist_recorded', lookup_playlist_recorded),
+    ('translate_uri', translate_uri),
+])
+
+
+def latencies(times):
+    times = sorted(t * 1000 for t in times)
+    return {
+        'mean': sum(times) / len(times),
+        'p50': times[len(times) // 2],
+        'p95': times[min(len(times) - 1, int(len(times) * 0.95))],
+        'p99': times[min(len(times) - 1, int(len(times) * 0.99))],
+        'max': times[-1],
+    }
+
+
+def measure(f, backend, network, args):
+    results = {}
+
+    cold, warm = [], []
+    for n in range(args.rounds):
+        empty_caches()
+        start = time.time()
+        items = f(backend, n)
+        cold.append(time.time() - start)
+        wait_idle()
+
+        start = time.time()
+        f(backend, n)
+        warm.append(time.time() - start)
+    results['cold'] = latencies(cold)
+    results['warm'] = latencies(warm)
+    results['items'] = items
+
+    empty_caches()
+    requests = network.requests
+    calls = iter(range(args.rounds * args.clients))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                n = next(calls, None)
+            if n is None:
+                return
+            f(backend, n)
+
+    clients = [threading.Thread(target=client) for i in range(args.clients)]
+    start = time.time()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.time() - start
+    wait_idle()
+    results['throughput'] = args.rounds * args.clients / elapsed
+    results['requests'] = network.requests - requests
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except Exception:
+        return None
+
+
+def compare(results, path):
+    with io.open(path, encoding='utf-8') as f:
+        before = {
+            (r['scenario'], r['mode'], r['threads_max']): r
+            for r in json.load(f)['results']
+        }
+
+    print('\ncompared to %s (ratio, < 1 is faster)' % path)
+    print('%-26s %-8s %7s %8s %8s %10s' % (
+        'scenario', 'mode', 'threads', 'cold', 'warm', 'throughput'))
+    for r in results:
+        old = before.get((r['scenario'], r['mode'], r['threads_max']))
+        if old is None:
+            continue
+        print('%-26s %-8s %7d %8.2f %8.2f %10.2f' % (
+            r['scenario'], r['mode'], r['threads_max'],
+            r['cold']['p50'] / max(old['cold']['p50'], 1e-9),
+            r['warm']['p50'] / max(old['warm']['p50'], 1e-9),
+            old['throughput'] / max(r['throughput'], 1e-9)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', default=','.join(scenarios))
+    parser.add_argument('--modes', default='api,scraper')
+    parser.add_argument('--threads', default='1,2,4,8',
+                        help='threads_max values to run with')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=20,
+                        help='ms per HTTP response')
+    parser.add_argument('--resolve-ms', type=float, default=300)
+    parser.add_argument('--page-kb', type=int, default=2048,
+                        help='padding of the search and playlist pages')
+    parser.add_argument('--playlist-size', type=int, default=1000)
+    parser.add_argument('--search-deadline', default='',
+                        help='ms, see search_deadline in ext.conf')
+    parser.add_argument('--output', default=None,
+                        help='default: benchmark-<commit>.json')
+    parser.add_argument('--compare', default=None,
+                        help='results of an earlier run')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    YoutubeDL.resolve = args.resolve_ms / 1000.0
+    commit = git_commit()
+    tmp = tempfile.mkdtemp()
+    results = []
+
+    print('%-26s %-8s %7s %8s %8s %8s %10s %8s' % (
+        'scenario', 'mode', 'threads', 'cold p50', 'cold p95', 'warm p50',
+        'calls/s', 'requests'))
+    try:
+        with mock.patch.object(youtube.youtube_dl, 'YoutubeDL', YoutubeDL):
+            for mode in args.modes.split(','):
+                for threads in map(int, args.threads.split(',')):
+                    backend, network = make_backend(
+                        args, mode == 'api', threads, tmp)
+                    for name in args.scenarios.split(','):
+                        r = measure(scenarios[name], backend, network, args)
+                        r.update(scenario=name, mode=mode,
+                                 threads_max=threads)
+                        results.append(r)
+                        print('%-26s %-8s %7d %8.1f %8.1f %8.1f %10.2f %8d'
+                              % (name, mode, threads, r['cold']['p50'],
+                                 r['cold']['p95'], r['warm']['p50'],
+                                 r['throughput'], r['requests']))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    output = args.output or 'benchmark-%s.json' % (commit or 'unknown')
+    with io.open(output, 'w', encoding='utf-8') as f:
+        f.write(unicode(json.dumps({
+            'commit': commit,
+            'time': time.time(),
+            'python': platform.python_version(),
+            'arguments': vars(args),
+            'results': results,
+        }, indent=2, sort_keys=True)))
+    print('results written to %s' % output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark of audio_url resolution with a new youtube_dl.YoutubeDL instance
+# per url (the old code) against instances from YoutubeDLPool (see
+# mopidy_youtube/youtube.py). Prints the time per url, and the time it takes
+# just to create an instance. Run from the source directory, with
+# Mopidy-YouTube installed (or PYTHONPATH=.), eg.
+#
+#   python benchmarks/ytdl_pool.py
+#   python benchmarks/ytdl_pool.py --cassette recorded.yaml --id <video id>
+#
+# By default YoutubeDL.urlopen is replaced by one that answers with the
+# recorded watch page in tests/fixtures/pages, so extract_info runs the
+# YouTube extractor and format selection for real without touching the
+# network. With --cassette, HTTP responses are replayed from a vcr cassette
+# instead.
+#
+# Timing failed resolutions would measure the error path, so the script
+# stops with the error if a url can't be resolved.
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import mock
+
+import vcr
+
+import youtube_dl
+from youtube_dl.compat import compat_urllib_response
+
+from mopidy_youtube.youtube import YoutubeDLPool
+
+fixtures = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures')
+
+# url prefix -> recorded page served for it
+pages = {
+    'https://www.youtube.com/watch?': 'watch.html',
+}
+
+
+# replaces the network layer of youtube_dl with the recorded pages, any other
+# request fails
+#
+@contextmanager
+def recorded_pages():
+    def urlopen(self, request):
+        url = getattr(request, 'get_full_url', lambda: request)()
+        for prefix, page in pages.items():
+            if url.startswith(prefix):
+                path = os.path.join(fixtures, 'pages', page)
+                with io.open(path, 'rb') as f:
+                    body = io.BytesIO(f.read())
+                return compat_urllib_response.addinfourl(
+                    body, {'Content-Type': 'text/html; charset=utf-8'},
+                    url, 200)
+        raise youtube_dl.utils.DownloadError('no recorded page for ' + url)
+
+    with mock.patch.object(youtube_dl.YoutubeDL, 'urlopen', urlopen):
+        yield
+
+
+def resolve(ydl, id):
+    info = ydl.extract_info(
+        url='https://www.youtube.com/watch?v=%s' % id,
+        download=False)
+    return info['url']
+
+
+def fresh(id):
+    return resolve(youtube_dl.YoutubeDL(YoutubeDLPool.params), id)
+
+
+def pooled(id):
+    with YoutubeDLPool.instance() as ydl:
+        return resolve(ydl, id)
+
+
+def wall_time(f, id, responses, rounds):
+    elapsed = 0
+    for i in range(rounds):
+        with responses():
+            start = time.time()
+            try:
+                f(id)
+            except Exception as e:
+                sys.exit('%s: resolving %s failed: %s' % (f.__name__, id, e))
+            elapsed += time.time() - start
+    return elapsed / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument(
+        '--cassette', help='replay this vcr cassette, not the recorded pages')
+    parser.add_argument('--id', default='C0DPdy98e4c')
+    args = parser.parse_args()
+
+    if args.cassette:
+        def responses():
+            return vcr.use_cassette(args.cassette, record_mode='none')
+    else:
+        responses = recorded_pages
+
+    params = dict(YoutubeDLPool.params, quiet=True, no_warnings=True)
+    YoutubeDLPool.params = params
+    YoutubeDLPool.size = 1
+
+    start = time.time()
+    for i in range(args.rounds):
+        YoutubeDLPool.create()
+    create = (time.time() - start) / args.rounds
+
+    YoutubeDLPool.warm()
+    print('%-8s %12s' % ('mode', 'ms/url'))
+    for name, f in [('fresh', fresh), ('pool', pooled)]:
+        seconds = wall_time(f, args.id, responses, args.rounds)
+        print('%-8s %12.3f' % (name, seconds * 1000))
+    print('creating an instance: %.3f ms' % (create * 1000))
+
+
+if __name__ == '__main__':
+    main()
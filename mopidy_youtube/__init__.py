@@ -24,12 +24,41 @@ class Extension(ext.Extension):
     def get_config_schema(self):
         schema = super(Extension, self).get_config_schema()
         schema['search_results'] = config.Integer()
+        schema['search_deadline'] = config.Integer(
+            optional=True, minimum=0)
         schema['playlist_max_videos'] = config.Integer()
         schema['api_key'] = config.String()
         schema['threads_max'] = config.Integer()
+        schema['threads_playback'] = config.Integer(minimum=1)
+        schema['threads_lookup'] = config.Integer(minimum=1)
+        schema['threads_prefetch'] = config.Integer(minimum=1)
+        schema['resolve_ahead'] = config.Integer(minimum=0)
+        schema['resolver_processes'] = config.Integer(minimum=0)
+        schema['resolver_recycle'] = config.Integer(minimum=1)
+        schema['scraper_connections'] = config.Integer(minimum=1)
+        schema['engine'] = config.String(choices=['threads', 'tornado'])
+        schema['engine_connections'] = config.Integer(minimum=1)
+        schema['scraper_extractor'] = config.String(
+            choices=['json', 'regex'])
         schema['api_enabled'] = config.Boolean()
+        schema['api_quota'] = config.Integer(minimum=0)
+        schema['cache_ttl'] = config.Integer(minimum=0)
+        schema['cache_max_entries'] = config.Integer(minimum=0)
+        schema['cache_memory'] = config.Integer(minimum=1)
+        schema['batch_window'] = config.Integer(minimum=0)
+        schema['search_cache_ttl'] = config.Integer(minimum=0)
+        schema['search_cache_size'] = config.Integer(minimum=0)
+        schema['index_size'] = config.Integer(minimum=0)
+        schema['metrics_log_interval'] = config.Integer(minimum=0)
         return schema
 
     def setup(self, registry):
         from .backend import YouTubeBackend
+        from .frontend import YouTubeFrontend
+        from .metrics import factory
         registry.add('backend', YouTubeBackend)
+        registry.add('frontend', YouTubeFrontend)
+        registry.add('http:app', {
+            'name': self.ext_name,
+            'factory': factory,
+        })
@@ -2,17 +2,25 @@
 
 from __future__ import unicode_literals
 
+import os
 import re
 import string
+import time
 import unicodedata
-from urlparse import parse_qs, urlparse
+
+from cachetools import LRUCache
 
 from mopidy import backend
-from mopidy.models import Album, Artist, SearchResult, Track
+from mopidy.models import Album, Artist, Ref, SearchResult, Track
 
 import pykka
 
-from mopidy_youtube import logger, youtube
+from mopidy_youtube import Extension, logger, youtube
+from mopidy_youtube.cache import DiskCache
+from mopidy_youtube.engine import Engine, EngineSession
+from mopidy_youtube.extractors import extractors
+from mopidy_youtube.index import Index
+from mopidy_youtube.metrics import Metrics
 
 # A typical interaction:
 # 1. User searches for a keyword (YouTubeLibraryProvider.search)
@@ -29,17 +37,87 @@ def extract_id(uri):
     return uri.split('.')[-1]
 
 
+# The uris lookup accepts, as (kind, pattern) tuples, in the order they're
+# tried. The id is the 'id' group of the pattern. Any other uri is taken as
+# <...>.<playlist id>
+#
+uri_patterns = [
+    ('video', re.compile(r'^(?:yt|youtube):video/(?:.*\.)?(?P<id>[^.]+)$')),
+    ('playlist',
+     re.compile(r'^(?:yt|youtube):playlist/(?:.*\.)?(?P<id>[^.]+)$')),
+    ('playlist',
+     re.compile(r'youtu(?:\.be|be\.com)/.*[?&]list=(?P<id>[^&#]+)')),
+    ('video', re.compile(r'youtube\.com/.*[?&]v=(?P<id>[^&#]+)')),
+    ('video', re.compile(r'youtu\.be/(?P<id>[^?&#/]+)')),
+]
+
+
+# returns (video id, None) or (None, playlist id) for a uri, see
+# YouTubeLibraryProvider.lookup
+#
+def parse_uri(uri):
+    for kind, pattern in uri_patterns:
+        match = pattern.search(uri)
+        if match:
+            if kind == 'video':
+                return match.group('id'), None
+            return None, match.group('id')
+    return None, extract_id(uri)
+
+
+safe_chars = b'-_.() ' + string.ascii_letters + string.digits
+unsafe_bytes = b''.join(
+    chr(i) for i in range(256) if chr(i) not in safe_chars)
+spaces = re.compile(r'\s+')
+
+
 def safe_url(uri):
-    valid_chars = '-_.() %s%s' % (string.ascii_letters, string.digits)
-    safe_uri = unicodedata.normalize(
-        'NFKD',
-        unicode(uri)
-    ).encode('ASCII', 'ignore')
-    return re.sub(
-        '\s+',
-        ' ',
-        ''.join(c for c in safe_uri if c in valid_chars)
-    ).strip()
+    uri = unicode(uri)
+    try:
+        safe_uri = uri.encode('ASCII')
+    except UnicodeEncodeError:
+        safe_uri = unicodedata.normalize('NFKD', uri).encode(
+            'ASCII', 'ignore')
+    safe_uri = safe_uri.translate(None, unsafe_bytes).decode('ASCII')
+    return spaces.sub(' ', safe_uri).strip()
+
+
+# safe_url of the titles of videos/playlists: id -> (title, slug)
+slugs = LRUCache(maxsize=10000)
+
+# Artists, by channel name, shared by all tracks of a channel
+artists = LRUCache(maxsize=1000)
+
+
+# returns the uri of a video or playlist, eg. youtube:video/<title>.<id>
+#
+def entry_uri(entry, title):
+    slug = slugs.get(entry.id)
+    if slug is None or slug[0] != title:
+        slug = slugs[entry.id] = (title, safe_url(title))
+    kind = 'video' if entry.is_video else 'playlist'
+    return 'youtube:%s/%s.%s' % (kind, slug[1], entry.id)
+
+
+# returns the Track of a video/playlist (whose title and channel are
+# loaded), eg. the Album of a playlist is shared by all its tracks
+#
+def make_track(entry, album, length, track_no=None):
+    title = entry.title.get()
+    channel = entry.channel.get()
+    artist = artists.get(channel)
+    if artist is None:
+        artist = artists[channel] = Artist(name=channel)
+
+    return Track(
+        name=title.replace(';', '') if title else title,
+        comment=entry.id,
+        length=length,
+        track_no=track_no,
+        artists=[artist],
+        album=album,
+        uri=entry_uri(entry, title)
+    )
 
 
 class YouTubeBackend(pykka.ThreadingActor, backend.Backend):
@@ -52,23 +130,78 @@ class YouTubeBackend(pykka.ThreadingActor, backend.Backend):
         ytconf = config['youtube']
         youtube.API.key = ytconf['api_key']
         youtube.API.search_results = ytconf['search_results']
+        if ytconf['search_deadline'] is not None:
+            YouTubeLibraryProvider.search_deadline = \
+                ytconf['search_deadline'] / 1000.0
         youtube.Playlist.max_videos = ytconf['playlist_max_videos']
 
         youtube.ThreadPool.threads_max = ytconf['threads_max']
+        youtube.ThreadPool.limits = {
+            youtube.ThreadPool.PLAYBACK: ytconf['threads_playback'],
+            youtube.ThreadPool.LOOKUP: ytconf['threads_lookup'],
+            youtube.ThreadPool.PREFETCH: ytconf['threads_prefetch'],
+        }
         youtube.api_enabled = ytconf['api_enabled']
+        youtube.Quota.daily = ytconf['api_quota']
+
+        youtube.API.session = youtube.get_requests_session(
+            proxy_config=config['proxy'],
+            user_agent=youtube.user_agent)
+        youtube.scrAPI.connections = ytconf['scraper_connections']
+        youtube.scrAPI.extractor = extractors[ytconf['scraper_extractor']]
+        youtube.scrAPI.session = youtube.get_requests_session(
+            proxy_config=config['proxy'],
+            user_agent=youtube.user_agent,
+            pool_size=ytconf['scraper_connections'])
+
+        Engine.max_clients = ytconf['engine_connections']
+        if ytconf['engine'] == 'tornado' and Engine.start(config['proxy']):
+            youtube.API.session = youtube.scrAPI.session = EngineSession(
+                proxy_config=config['proxy'],
+                user_agent=youtube.user_agent)
+
+        # one youtube_dl instance for every thread resolving audio urls
+        youtube.YoutubeDLPool.size = ytconf['threads_playback']
+        youtube.YoutubeDLPool.cachedir = os.path.join(
+            Extension.get_cache_dir(config), 'youtube-dl')
+        youtube.ThreadPool.run(youtube.YoutubeDLPool.warm,
+                               priority=youtube.ThreadPool.PREFETCH)
+
+        youtube.ResolverProcesses.size = ytconf['resolver_processes']
+        youtube.ResolverProcesses.recycle = ytconf['resolver_recycle']
+
+        youtube.Batcher.window = ytconf['batch_window'] / 1000.0
+
+        youtube.SearchCache.ttl = ytconf['search_cache_ttl']
+        youtube.SearchCache.size = ytconf['search_cache_size']
+
+        youtube.EntityStore.max_bytes = ytconf['cache_memory'] * 1024 * 1024
+
+        DiskCache.ttl = ytconf['cache_ttl']
+        DiskCache.max_entries = ytconf['cache_max_entries']
+        DiskCache.open(
+            os.path.join(Extension.get_data_dir(config), 'metadata.db'))
+
+        Index.configure(ytconf['index_size'])
+
+        Metrics.log_interval = ytconf['metrics_log_interval']
+        Metrics.start_logging()
+
         self.uri_schemes = ['youtube', 'yt']
 
 
 class YouTubeLibraryProvider(backend.LibraryProvider):
 
-    # Called when browsing or searching the library. To avoid horrible browsing
-    # performance, and since only search makes sense for youtube anyway, we we
-    # only answer queries for the 'any' field (for instance a {'artist': 'U2'}
-    # query is ignored).
+    # Called when searching the library. Queries for the 'any' field are sent
+    # to YouTube. Queries for other fields (artist = channel, album =
+    # playlist, track_name = title) are answered from the videos and
+    # playlists seen before (see index.py), without requests to YouTube.
     #
     # For performance we only do 2 API calls before we reply, one for search
     # (youtube.Entry.search) and one to fetch video_count of all playlists
-    # (youtube.Playlist.load_info).
+    # (youtube.Playlist.load_info), if the search results don't have it. The
+    # length of videos is used if the search results have it (the scraper's
+    # do), it's 0 otherwise.
     #
     # We also start loading 2 things in the background:
     #  - info for all videos
@@ -77,62 +210,92 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
     # YouTubeLibraryProvider.lookup) will most likely be instantaneous, since
     # all info will be ready by that time.
     #
+    # With a search_deadline, the video counts that haven't arrived within
+    # that many seconds of the search results are left out of the reply.
+    # They keep loading, and are there for the next search/lookup.
+    #
+    # overridable by config (None to wait for all video counts)
+    search_deadline = None
+
+    root_directory = Ref.directory(uri=Index.root, name='YouTube')
+
+    # Called when browsing the library: recent searches, playlists and
+    # channels seen before (see index.py), without requests to YouTube
+    #
+    def browse(self, uri):
+        logger.info('youtube LibraryProvider.browse "%s"', uri)
+        return Index.browse(uri) or []
+
     def search(self, query=None, uris=None, exact=False):
+        with Metrics.timed('search_seconds'):
+            return self._search(query, exact)
+
+    def _search(self, query, exact):
         # TODO Support exact search
         logger.info('youtube LibraryProvider.search "%s"', query)
 
-        # handle only searching (queries with 'any') not browsing!
-        if not (query and 'any' in query):
+        if not query:
             return None
+        if 'any' not in query:
+            return SearchResult(
+                uri='youtube:search',
+                tracks=Index.search(query, exact)
+            )
 
         search_query = ' '.join(query['any'])
         logger.info('Searching YouTube for query "%s"', search_query)
 
+        # a new search makes the background loading of the previous one
+        # pointless
+        youtube.ThreadPool.cancel(youtube.ThreadPool.PREFETCH)
+
         try:
             entries = youtube.Entry.search(search_query)
         except Exception:
             return None
+        if entries is None:
+            return None
 
         # load playlist info (to get video_count) of all playlists together
         playlists = [e for e in entries if not e.is_video]
         youtube.Playlist.load_info(playlists)
+        if self.search_deadline is not None:
+            deadline = time.time() + self.search_deadline
 
         tracks = []
         for entry in entries:
             if entry.is_video:
-                uri_base = 'youtube:video'
                 album = 'YouTube Video'
+                length = (entry.peek('length') or 0) * 1000
             else:
-                uri_base = 'youtube:playlist'
-                album = 'YouTube Playlist (%s videos)' % \
-                        entry.video_count.get()
-
-            track_title = entry.title.get()
-
-            if ';' in track_title:
-                track_title = track_title.replace(';', '')
-
-            tracks.append(Track(
-                name=track_title,
-                comment=entry.id,
-                length=0,
-                artists=[Artist(name=entry.channel.get())],
-                album=Album(
-                    name=album,
-                    images=entry.thumbnails.get(),
-                ),
-                uri='%s/%s.%s' %
-                    (uri_base, safe_url(entry.title.get()), entry.id)
+                album = 'YouTube Playlist'
+                length = 0
+                try:
+                    if self.search_deadline is None:
+                        video_count = entry.video_count.get()
+                    else:
+                        video_count = entry.video_count.get(
+                            timeout=max(0, deadline - time.time()))
+                    album += ' (%s videos)' % video_count
+                except pykka.Timeout:
+                    Metrics.count('search_deferred_total')
+
+            tracks.append(make_track(
+                entry,
+                Album(name=album, images=entry.thumbnails.get()),
+                length,
             ))
 
         # load video info and playlist videos in the background. they should be
         # ready by the time the user adds search results to the playing queue
-        videos = [e for e in entries if e.is_video]
-        youtube.Video.load_info(videos)
+        with youtube.ThreadPool.priority(youtube.ThreadPool.PREFETCH):
+            videos = [e for e in entries if e.is_video]
+            youtube.Video.load_info(videos)
 
-        for pl in playlists:
-            pl.videos  # start loading
+            for pl in playlists:
+                pl.videos  # start loading
 
+        Index.add_search(search_query, tracks)
         return SearchResult(
             uri='youtube:search',
             tracks=tracks
@@ -149,80 +312,77 @@ class YouTubeLibraryProvider(backend.LibraryProvider):
     # If uri is a video then a single track is returned. If it's a playlist the
     # list of all videos in the playlist is returned.
     #
-    # We also start loading the audio_url of all videos in the background, to
-    # be ready for playback (see YouTubePlaybackProvider.translate_uri).
+    # Mopidy's core looks up many uris (eg. of a stored playlist) with one
+    # call per uri, handled one after the other, so their info can't be loaded
+    # in batches. The videos of a playlist are (see youtube.Batcher).
+    #
+    # The audio_url of the videos is loaded by YouTubeFrontend, once they are
+    # about to be played.
     #
     def lookup(self, uri):
         logger.info('youtube LibraryProvider.lookup "%s"', uri)
 
-        video_id = playlist_id = None
-
-        # Support adding youtu.be urls
-        #
-        if 'youtu.be/' in uri:
-            uri = uri.replace('youtu.be/', 'www.youtube.com/watch?v=')
-            
-        if 'youtube.com' in uri:
-            url = urlparse(uri.replace('yt:', '').replace('youtube:', ''))
-            req = parse_qs(url.query)
-            if 'list' in req:
-                playlist_id = req.get('list')[0]
-            else:
-                video_id = req.get('v')[0]
-
-        elif 'video/' in uri:
-            video_id = extract_id(uri)
-        else:
-            playlist_id = extract_id(uri)
+        return self._tracks(uri, self._load(uri))
 
+    # returns the Video/Playlist of 'uri', and starts loading it
+    #
+    def _load(self, uri):
+        video_id, playlist_id = parse_uri(uri)
         if video_id:
             video = youtube.Video.get(video_id)
-            video.audio_url  # start loading
-
-            track_title = video.title.get()
-
-            if ';' in track_title:
-                track_title = track_title.replace(';', '')
-
-            return [Track(
-                name=track_title,
-                comment=video.id,
-                length=video.length.get() * 1000,
-                artists=[Artist(name=video.channel.get())],
-                album=Album(
-                    name='YouTube Video',
-                    images=video.thumbnails.get(),
-                ),
-                uri='youtube:video/%s.%s' %
-                    (safe_url(video.title.get()), video.id)
-            )]
-        else:
-            playlist = youtube.Playlist.get(playlist_id)
-            if not playlist.videos.get():
+            youtube.Video.load_info([video])
+            return video
+
+        playlist = youtube.Playlist.get(playlist_id)
+        youtube.Playlist.load_info([playlist])
+        playlist.videos  # start loading
+        return playlist
+
+    def _tracks(self, uri, entry):
+        if not entry.is_video:
+            tracks = list(self._playlist_tracks(entry))
+            if not tracks:
                 logger.info('cannot load playlist "%s"', uri)
-                return []
-
+                return tracks
+            album = Album(
+                name='YouTube Playlist (%d videos)' % len(tracks),
+                images=entry.thumbnails.get(),
+            )
+            Index.add_playlist(make_track(entry, album, 0), tracks)
+            return tracks
+
+        # ignore videos for which no info was found (removed, etc)
+        if entry.length.get() is None:
+            logger.info('cannot load video "%s"', uri)
+            return []
+
+        tracks = [make_track(
+            entry,
+            Album(name='YouTube Video', images=entry.thumbnails.get()),
+            entry.length.get() * 1000,
+        )]
+        Index.add(tracks)
+        return tracks
+
+    # yields the tracks of a playlist page by page, while the next pages (and
+    # the info of their videos) are still being loaded, so that the time a
+    # lookup takes doesn't add up page after page
+    #
+    def _playlist_tracks(self, playlist):
+        album = None
+        count = 0
+        for video in playlist.iter_videos():
             # ignore videos for which no info was found (removed, etc)
-            videos = [v for v in playlist.videos.get()
-                      if v.length.get() is not None]
-
-            # load audio_url in the background to be ready for playback
-            for video in videos:
-                video.audio_url  # start loading
-
-            return [Track(
-                name=video.title.get(),
-                comment=video.id,
-                length=video.length.get() * 1000,
-                track_no=count,
-                artists=[Artist(name=video.channel.get())],
-                album=Album(
+            if video.length.get() is None:
+                continue
+
+            if album is None:
+                album = Album(
                     name=playlist.title.get(),
                     images=playlist.thumbnails.get(),
-                ),
-                uri='youtube:video/%s.%s' %
-                    (safe_url(video.title.get()), video.id)
-            ) for count, video in enumerate(videos, 1)]
+                )
+            count += 1
+            yield make_track(video, album, video.length.get() * 1000, count)
 
 
 class YouTubePlaybackProvider(backend.PlaybackProvider):
@@ -239,8 +399,11 @@ class YouTubePlaybackProvider(backend.PlaybackProvider):
             return None
 
         try:
-            id = extract_id(uri)
-            return youtube.Video.get(id).audio_url.get()
+            video = youtube.Video.get(extract_id(uri))
+            youtube.AudioUrlCache.unqueue([video])
+            with youtube.ThreadPool.priority(youtube.ThreadPool.PLAYBACK), \
+                    Metrics.timed('translate_uri_seconds'):
+                return video.audio_url.get()
         except Exception as e:
             logger.error('translate_uri error "%s"', e)
             return None
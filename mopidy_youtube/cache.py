@@ -0,0 +1,187 @@
+from __future__ import unicode_literals
+
+import json
+import sqlite3
+import threading
+import time
+
+from mopidy_youtube import logger
+
+
+# Persistent metadata cache, so that restarting Mopidy doesn't mean fetching
+# everything from YouTube again. Fields of videos and playlists (title,
+# channel, length, thumbnails, video_count) are stored in an SQLite database,
+# every field together with the time it was fetched. Fields older than 'ttl'
+# seconds are ignored. When there are more than 'max_entries' entries, the
+# least recently updated ones are evicted.
+#
+# All reads are answered from an in-memory copy of the database, which is
+# filled by a background thread started by open(), so that opening the cache
+# doesn't block the backend. Until the warm-load has finished, get() simply
+# misses. put() updates the in-memory copy and writes through to the database.
+#
+class DiskCache:
+    # overridable by config
+    ttl = 7 * 24 * 3600
+    max_entries = 10000
+
+    path = None
+    connection = None
+    data = {}       # (kind, id) -> {field: (value, timestamp)}
+    loaded = threading.Event()
+    lock = threading.Lock()     # controls access to data and connection
+
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def open(cls, path):
+        if cls.max_entries <= 0:
+            return
+
+        cls.path = path
+        thread = threading.Thread(target=cls._warm_load)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def _warm_load(cls):
+        try:
+            connection = sqlite3.connect(cls.path, check_same_thread=False)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                ' kind TEXT NOT NULL,'
+                ' id TEXT NOT NULL,'
+                ' fields TEXT NOT NULL,'
+                ' updated REAL NOT NULL,'
+                ' PRIMARY KEY (kind, id))'
+            )
+            connection.execute(
+                'DELETE FROM metadata WHERE updated < ?',
+                (time.time() - cls.ttl,)
+            )
+            connection.commit()
+            rows = connection.execute(
+                'SELECT kind, id, fields FROM metadata '
+                'ORDER BY updated DESC LIMIT ?',
+                (cls.max_entries,)
+            ).fetchall()
+        except Exception as e:
+            logger.error('youtube cache error "%s"', e)
+            return
+
+        data = {}
+        for kind, id, fields in rows:
+            try:
+                data[(kind, id)] = {
+                    k: tuple(v) for k, v in json.loads(fields).items()
+                }
+            except ValueError:
+                continue
+
+        with cls.lock:
+            data.update(cls.data)   # keep anything put() while loading
+            cls.data = data
+            cls.connection = connection
+        cls.loaded.set()
+
+        logger.info('youtube cache: loaded %d entries from %s',
+                    len(data), cls.path)
+
+    # returns a dict with the fresh fields of the given entry (possibly
+    # empty). 'ttls' can give fields a shorter ttl, {field: seconds}
+    #
+    @classmethod
+    def get(cls, kind, id, ttls={}):
+        if not cls.loaded.is_set():
+            return {}
+
+        now = time.time()
+        with cls.lock:
+            fields = cls.data.get((kind, id), {})
+            fresh = {
+                k: v for k, (v, t) in fields.items()
+                if now - t <= min(cls.ttl, ttls.get(k) or cls.ttl)
+            }
+            if fresh:
+                cls.hits += 1
+            else:
+                cls.misses += 1
+            return fresh
+
+    @classmethod
+    def stats(cls):
+        with cls.lock:
+            return {
+                'hits': cls.hits,
+                'misses': cls.misses,
+                'entries': len(cls.data),
+            }
+
+    # stores fields for a list of entries. 'entries' is a list of
+    # (id, {field: value}) tuples. All entries are written to the database
+    # in a single transaction.
+    #
+    @classmethod
+    def put(cls, kind, entries):
+        if not cls.loaded.is_set():
+            return
+
+        now = time.time()
+        rows = []
+        with cls.lock:
+            for id, values in entries:
+                if not values:
+                    continue
+                fields = cls.data.setdefault((kind, id), {})
+                fields.update({k: (v, now) for k, v in values.items()})
+                rows.append((kind, id, json.dumps(fields), now))
+
+            if not rows:
+                return
+
+            try:
+                cls.connection.executemany(
+                    'INSERT OR REPLACE INTO metadata '
+                    '(kind, id, fields, updated) VALUES (?, ?, ?, ?)',
+                    rows
+                )
+                if len(cls.data) > cls.max_entries:
+                    cls._evict()
+                cls.connection.commit()
+            except Exception as e:
+                logger.error('youtube cache error "%s"', e)
+
+    @classmethod
+    def delete(cls, kind, id):
+        if not cls.loaded.is_set():
+            return
+
+        with cls.lock:
+            if cls.data.pop((kind, id), None) is None:
+                return
+            try:
+                cls.connection.execute(
+                    'DELETE FROM metadata WHERE kind = ? AND id = ?',
+                    (kind, id)
+                )
+                cls.connection.commit()
+            except Exception as e:
+                logger.error('youtube cache error "%s"', e)
+
+    # drops the least recently updated entries, down to 90% of max_entries,
+    # so that we don't have to evict on every put(). Called with lock held.
+    #
+    @classmethod
+    def _evict(cls):
+        def updated(key):
+            return max(t for (v, t) in cls.data[key].values())
+
+        keep = int(cls.max_entries * 0.9)
+        evicted = sorted(cls.data, key=updated)[:len(cls.data) - keep]
+        for key in evicted:
+            del cls.data[key]
+        cls.connection.executemany(
+            'DELETE FROM metadata WHERE kind = ? AND id = ?',
+            evicted
+        )
@@ -0,0 +1,187 @@
+from __future__ import unicode_literals
+
+import Queue
+import json
+import threading
+import time
+import urllib
+from urlparse import urlparse
+
+from mopidy import httpclient
+
+import pykka
+
+import requests
+
+from tornado import httpclient as tornado_httpclient
+from tornado.ioloop import IOLoop
+
+from mopidy_youtube import logger
+from mopidy_youtube.metrics import Metrics
+
+
+# Optional fetch engine (see 'engine' in ext.conf), serving the requests of
+# API and scrAPI. One background thread runs a tornado IOLoop with a
+# non-blocking HTTP client, which keeps up to 'max_clients' requests in
+# flight at once, without holding a thread for every request. scrAPI needs a
+# page per video/playlist, which are all requested at once this way (see
+# EngineSession.get_many), instead of over 'scraper_connections' threads.
+#
+# Results are handed back as futures, like everything else, so the rest of
+# the code doesn't know which engine is in use. Python 2 has no asyncio, the
+# event loop is the one of tornado (which Mopidy depends on). Proxies need
+# the curl client of tornado (pycurl), without it the threads are used.
+#
+class Engine:
+    # overridable by config
+    max_clients = 100
+    request_timeout = 60
+
+    loop = None
+    client = None
+    lock = threading.Lock()     # controls starting the loop
+
+    # starts the loop thread (once). Returns false if the engine can't be
+    # used with the given proxy settings
+    #
+    @classmethod
+    def start(cls, proxy_config):
+        client_class = tornado_httpclient.AsyncHTTPClient
+        if proxy_config.get('hostname'):
+            try:
+                from tornado.curl_httpclient import CurlAsyncHTTPClient
+            except ImportError:
+                logger.warning('youtube engine: proxies need pycurl, '
+                               'using threads')
+                return False
+            client_class = CurlAsyncHTTPClient
+
+        with cls.lock:
+            if cls.loop is not None:
+                return True
+            ready = threading.Event()
+
+            def run():
+                cls.loop = IOLoop()
+                cls.loop.make_current()
+                cls.client = client_class(
+                    force_instance=True, max_clients=cls.max_clients)
+                ready.set()
+                cls.loop.start()
+
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            ready.wait()
+        return True
+
+    # sends 'request' (a tornado HTTPRequest), returns a future of the
+    # Response. 'done' is called with the future once it's set (in the loop
+    # thread)
+    #
+    @classmethod
+    def fetch(cls, request, done=None):
+        future = pykka.ThreadingFuture()
+        start = time.time()
+
+        def fetched(tornado_future):
+            try:
+                response = tornado_future.result()
+                if response.code == 599:    # no HTTP response at all
+                    raise requests.ConnectionError(unicode(response.error))
+                future.set(Response(response, time.time() - start))
+            except Exception:
+                future.set_exception()
+            if done is not None:
+                done(future)
+
+        def send():
+            cls.client.fetch(request, raise_error=False).add_done_callback(
+                fetched)
+
+        cls.loop.add_callback(send)
+        return future
+
+
+# the parts of a requests.Response that are used
+#
+class Response(object):
+    def __init__(self, response, elapsed):
+        self.url = response.effective_url
+        self.status_code = response.code
+        self.content = response.body or b''
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                '%d error for url: %s' % (self.status_code, self.url),
+                response=self)
+
+
+# Stands in for the requests.Session of API and scrAPI (see
+# youtube.get_requests_session), sending the requests through the Engine
+#
+class EngineSession(object):
+    def __init__(self, proxy_config, user_agent):
+        proxy = urlparse(httpclient.format_proxy(proxy_config) or '')
+        self.defaults = {
+            'user_agent': httpclient.format_user_agent(user_agent),
+            'proxy_host': proxy.hostname,
+            'proxy_port': proxy.port,
+            'proxy_username': proxy.username,
+            'proxy_password': proxy.password,
+            'request_timeout': Engine.request_timeout,
+        }
+
+    def request(self, url, params=None):
+        query = urllib.urlencode([
+            (k, unicode(v).encode('utf-8'))
+            for k, v in sorted((params or {}).items()) if v is not None
+        ])
+        return tornado_httpclient.HTTPRequest(
+            url + ('?' + query if query else ''), **self.defaults)
+
+    def get(self, url, params=None):
+        response = Engine.fetch(self.request(url, params)).get()
+        self.count(response)
+        return response
+
+    # requests 'url' with all of the given queries at once, and yields
+    # (query, response) tuples as soon as the responses arrive (None if the
+    # request failed)
+    #
+    def get_many(self, url, queries, endpoint):
+        done = Queue.Queue()
+        for query in queries:
+            Engine.fetch(self.request(url, query),
+                         lambda future, query=query: done.put((query, future)))
+
+        for i in range(len(queries)):
+            query, future = done.get()
+            try:
+                response = future.get()
+            except Exception as e:
+                logger.error('youtube fetch error "%s"', e)
+                Metrics.count('request_seconds_errors_total',
+                              endpoint=endpoint)
+                yield query, None
+                continue
+            Metrics.observe('request_seconds', response.elapsed,
+                            endpoint=endpoint)
+            self.count(response)
+            yield query, response
+
+    # counts responses by host and status code, like the response hook of
+    # the requests sessions
+    #
+    def count(self, response):
+        Metrics.count('responses_total', host=urlparse(response.url).netloc,
+                      status=response.status_code)
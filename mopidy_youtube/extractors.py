@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import re
+
+from mopidy_youtube.records import PlaylistData, VideoData, parse_duration
+
+
+# Extractors turn the pages scrAPI fetches from www.youtube.com into records
+# (see records.py), like API does with the results of the YouTube Data API,
+# so that the rest of the code doesn't need to know where the data came from.
+# Every extractor has the same (class)methods, which take the text of a page
+# and yield records:
+#
+#   search(text)                results page
+#   video(text, id)             watch page of video 'id'
+#   playlist(text, id)          playlist page of playlist 'id'
+#   playlistitems(text)         playlist page, videos in the playlist
+#
+# search_stream(chunks) and playlistitems_stream(chunks) do the same with the
+# page given as an iterable of text chunks, as it is downloaded, and yield
+# records as soon as they can (see JSONStream).
+#
+# scrAPI.extractor selects the extractor to use (see 'scraper_extractor' in
+# ext.conf). benchmarks/extractors.py compares their cost on recorded pages.
+
+
+# duration in seconds from hours/minutes/seconds strings (None if all of them
+# are None)
+#
+def seconds(hours, minutes, seconds):
+    if hours is None and minutes is None and seconds is None:
+        return None
+    return (int(hours or 0) * 3600 +
+            int(minutes or 0) * 60 +
+            int(seconds or 0))
+
+
+def to_int(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+# The original extractor: regular expressions over the whole page, written
+# for the older page layout (see tests/fixtures/pages/legacy). Current pages
+# are rendered from the JSON data JSONExtractor reads, and don't have that
+# markup anymore.
+#
+class RegexExtractor(object):
+
+    @classmethod
+    def search(cls, text):
+        regex = r'(?:video-count.*<b>(?:(?P<itemCount>[0-9]+)</b>)?(.|\n)*?)?<a href="/watch\?v=(?P<id>.{11})(?:&amp;list=(?P<playlist>PL.{32}))?" class=".*?" data-sessionlink=".*?"  title="(?P<title>.+?)" .+?((?:Duration: (?:(?P<durationHours>[0-9]+):)?(?P<durationMinutes>[0-9]+):(?P<durationSeconds>[0-9]{2}).</span>.*?)?<a href="(?P<uploaderUrl>/(?:user|channel)/[^"]+)"[^>]+>(?P<uploader>.*?)</a>.*?class="(yt-lockup-description|yt-uix-sessionlink)[^>]*>(?P<description>.*?))?</div>'  # noqa
+
+        for match in re.finditer(regex, text):
+            # TODO: full support for thumbnails
+            thumbnails = [
+                'https://i.ytimg.com/vi/' + match.group('id') + '/default.jpg'
+            ]
+            if match.group('playlist') is not None:
+                yield PlaylistData(
+                    id=match.group('playlist'),
+                    title=match.group('title'),
+                    channel=match.group('uploader'),
+                    thumbnails=thumbnails,
+                    video_count=to_int(match.group('itemCount')),
+                )
+            else:
+                yield VideoData(
+                    id=match.group('id'),
+                    title=match.group('title'),
+                    channel=match.group('uploader'),
+                    length=seconds(
+                        match.group('durationHours'),
+                        match.group('durationMinutes'),
+                        match.group('durationSeconds')),
+                    thumbnails=thumbnails,
+                )
+
+    @classmethod
+    def video(cls, text, id):
+        regex = r'<div id="watch7-content"(?:.|\n)*?<meta itemprop="name" content="(?P<title>.*?)(?:">)(?:.|\n)*?<meta itemprop="duration" content="(?P<duration>.*?)(?:">)(?:.|\n)*?<link itemprop="url" href="http://www.youtube.com/(?:user|channel)/(?P<channelTitle>.*?)(?:">)(?:.|\n)*?</div>'  # noqa
+
+        for match in re.finditer(regex, text):
+            yield VideoData(
+                id=id,
+                title=match.group('title'),
+                channel=match.group('channelTitle'),
+                length=parse_duration(match.group('duration')),
+            )
+
+    @classmethod
+    def playlist(cls, text, id):
+        regex = r'<div id="pl-header"(?:.|\n)*?"(?P<thumbnail>https://i\.ytimg\.com\/vi\/.{11}/).*?\.jpg(?:(.|\n))*?(?:.|\n)*?class="pl-header-title"(?:.|\n)*?\>\s*(?P<title>.*)(?:.|\n)*?<a href="/(user|channel)/(?:.|\n)*? >(?P<channelTitle>.*?)</a>(?:.|\n)*?(?P<itemCount>\d*) videos</li>'  # noqa
+
+        for match in re.finditer(regex, text):
+            yield PlaylistData(
+                id=id,
+                title=match.group('title'),
+                channel=match.group('channelTitle'),
+                thumbnails=[match.group('thumbnail') + 'default.jpg'],
+                video_count=to_int(match.group('itemCount')),
+            )
+
+    @classmethod
+    def playlistitems(cls, text):
+        regex = r'" data-title="(?P<title>.+?)".*?<a href="/watch\?v=(?P<id>.{11})\&amp;'  # noqa
+
+        for match in re.finditer(regex, text):
+            yield VideoData(id=match.group('id'), title=match.group('title'))
+
+    # regular expressions need the whole page
+
+    @classmethod
+    def search_stream(cls, chunks):
+        return cls.search(''.join(chunks))
+
+    @classmethod
+    def playlistitems_stream(cls, chunks):
+        return cls.playlistitems(''.join(chunks))
+
+
+# Extractor based on the JSON data YouTube embeds in its pages, which is what
+# the page is rendered from: 'ytInitialData' (search results, playlists) and
+# 'ytInitialPlayerResponse' (video details). The JSON is located with a plain
+# string search and parsed with a single pass of the JSON decoder, and the
+# parsed tree is walked once, so the cost is linear in the size of the page.
+# Where a few renderers are enough (playlist), only those are decoded.
+#
+# Results are found by the name of their 'renderer' anywhere in the tree,
+# rather than by their full path, which changes more often than the renderers
+# themselves.
+#
+class JSONExtractor(object):
+    decoder = json.JSONDecoder()
+    assignment = re.compile(r'\s*(?:"\])?\s*=\s*')
+
+    # returns the JSON object assigned to 'name' in the page (None if there
+    # is none), eg. var ytInitialData = {...};
+    #
+    @classmethod
+    def initial_data(cls, text, name):
+        start = 0
+        while True:
+            start = text.find(name, start)
+            if start < 0:
+                return None
+            start += len(name)
+            match = cls.assignment.match(text, start)
+            if match and text.startswith('{', match.end()):
+                try:
+                    return cls.decoder.raw_decode(text, match.end())[0]
+                except ValueError:
+                    pass
+
+    # yields (key, value) for every value of one of the given keys in the
+    # tree, without descending into the values found. Values in lists are
+    # found in the order of the list.
+    #
+    @classmethod
+    def find(cls, tree, keys):
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                children = []
+                for key, value in node.items():
+                    if key in keys:
+                        yield key, value
+                    elif isinstance(value, (dict, list)):
+                        children.append(value)
+                stack.extend(reversed(children))
+            elif isinstance(node, list):
+                stack.extend(
+                    reversed([x for x in node if isinstance(x, (dict, list))]))
+
+    # yields (key, value) for every object of one of the given keys in the
+    # text after 'name', in the order of the page, without decoding anything
+    # else: the keys are located with a string search, and only their values
+    # are decoded. Like find(), it doesn't look into the values found.
+    #
+    @classmethod
+    def renderers(cls, text, name, keys):
+        start = text.find(name)
+        if start < 0:
+            return
+        pattern = re.compile(
+            r'"(%s)"\s*:\s*\{' % '|'.join(re.escape(key) for key in keys))
+        while True:
+            match = pattern.search(text, start)
+            if match is None:
+                return
+            try:
+                value, start = cls.decoder.raw_decode(text, match.end() - 1)
+            except ValueError:
+                start = match.end()
+                continue
+            yield match.group(1), value
+
+    @classmethod
+    def text(cls, obj):
+        if not obj:
+            return None
+        if 'simpleText' in obj:
+            return obj['simpleText']
+        return ''.join(run.get('text', '') for run in obj.get('runs', []))
+
+    # '1:02:03' -> 3723
+    #
+    @classmethod
+    def duration(cls, text):
+        if not text:
+            return None
+        parts = [None] * 3 + text.split(':')
+        return seconds(*parts[-3:])
+
+    # first number in eg. '1,234 videos'
+    #
+    @classmethod
+    def count(cls, text):
+        match = re.search(r'\d[\d,.]*', text or '')
+        return int(re.sub(r'\D', '', match.group())) if match else None
+
+    # the largest thumbnail
+    #
+    @classmethod
+    def thumbnails(cls, obj):
+        thumbnails = (obj or {}).get('thumbnails') or []
+        return [thumbnails[-1]['url']] if thumbnails else []
+
+    search_keys = ('videoRenderer', 'playlistRenderer')
+    playlistitems_keys = ('playlistVideoRenderer',)
+
+    @classmethod
+    def search(cls, text):
+        data = cls.initial_data(text, 'ytInitialData')
+        for key, renderer in cls.find(data, cls.search_keys):
+            yield cls.search_item(key, renderer)
+
+    @classmethod
+    def search_stream(cls, chunks):
+        stream = JSONStream('ytInitialData', cls.search_keys)
+        for chunk in chunks:
+            for key, renderer in stream.feed(chunk):
+                yield cls.search_item(key, renderer)
+
+    @classmethod
+    def search_item(cls, key, renderer):
+        channel = cls.text(
+            renderer.get('ownerText') or
+            renderer.get('longBylineText') or
+            renderer.get('shortBylineText'))
+
+        if key == 'videoRenderer':
+            return VideoData(
+                id=renderer['videoId'],
+                title=cls.text(renderer.get('title')),
+                channel=channel,
+                length=cls.duration(cls.text(renderer.get('lengthText'))),
+                thumbnails=cls.thumbnails(renderer.get('thumbnail')),
+            )
+        thumbnails = renderer.get('thumbnails') or [{}]
+        return PlaylistData(
+            id=renderer['playlistId'],
+            title=cls.text(renderer.get('title')),
+            channel=channel,
+            thumbnails=cls.thumbnails(thumbnails[0]),
+            video_count=cls.count(renderer.get('videoCount')),
+        )
+
+    @classmethod
+    def video(cls, text, id):
+        data = cls.initial_data(text, 'ytInitialPlayerResponse')
+        details = (data or {}).get('videoDetails')
+        if not details:
+            return
+
+        yield VideoData(
+            id=id,
+            title=details.get('title'),
+            channel=details.get('author'),
+            length=to_int(details.get('lengthSeconds')),
+        )
+
+    playlist_keys = (
+        'playlistHeaderRenderer',
+        'playlistSidebarPrimaryInfoRenderer',
+        'videoOwnerRenderer',
+    )
+
+    # The header and sidebar are a small part of the page, the videos of the
+    # playlist make up most of it: only the renderers of playlist_keys are
+    # decoded, up to the first of each.
+    #
+    @classmethod
+    def playlist(cls, text, id):
+        found = {}
+        for key, value in cls.renderers(text, 'ytInitialData',
+                                        cls.playlist_keys):
+            found.setdefault(key, value)
+            if len(found) == len(cls.playlist_keys):
+                break
+        header = found.get('playlistHeaderRenderer')
+        sidebar = found.get('playlistSidebarPrimaryInfoRenderer')
+        if not header and not sidebar:
+            return
+
+        header = header or {}
+        sidebar = sidebar or {}
+        owner = header.get('ownerText') or \
+            found.get('videoOwnerRenderer', {}).get('title')
+        count = cls.text(header.get('numVideosText')) or \
+            cls.text((sidebar.get('stats') or [None])[0])
+        thumbnail = next(cls.find(sidebar or header, ('thumbnail',)), None)
+
+        yield PlaylistData(
+            id=id,
+            title=cls.text(header.get('title') or sidebar.get('title')),
+            channel=cls.text(owner),
+            thumbnails=cls.thumbnails(thumbnail and thumbnail[1]),
+            video_count=cls.count(count),
+        )
+
+    @classmethod
+    def playlistitems(cls, text):
+        data = cls.initial_data(text, 'ytInitialData')
+        for key, renderer in cls.find(data, cls.playlistitems_keys):
+            yield cls.playlistitem(renderer)
+
+    @classmethod
+    def playlistitems_stream(cls, chunks):
+        stream = JSONStream('ytInitialData', cls.playlistitems_keys)
+        for chunk in chunks:
+            for key, renderer in stream.feed(chunk):
+                yield cls.playlistitem(renderer)
+
+    @classmethod
+    def playlistitem(cls, renderer):
+        return VideoData(
+            id=renderer['videoId'],
+            title=cls.text(renderer.get('title')),
+        )
+
+
+# Incremental tokenizer for JSONExtractor. Fed a page chunk by chunk, it
+# returns the (key, value) pairs of the given renderer keys that follow the
+# assignment of 'name' (eg. ytInitialData) as soon as their value is
+# complete, without waiting for the rest of the page. Only the renderer being
+# read is kept, not the page: the text in between is skipped with a string
+# search, a renderer is read by jumping from one brace or quote to the next,
+# and parsed by the JSON decoder once its closing brace arrives.
+#
+# Like JSONExtractor.find, it doesn't look into the values it returns.
+#
+class JSONStream(object):
+    # the characters that matter outside/inside of strings
+    tokens = {
+        False: re.compile(r'[{}"]'),
+        True: re.compile(r'["\\]'),
+    }
+
+    def __init__(self, name, keys):
+        self.name = name
+        self.keys = re.compile(
+            r'"(%s)"\s*:\s*\{' % '|'.join(re.escape(key) for key in keys))
+        # enough to find a name or key split between chunks
+        self.overlap = max(len(key) for key in keys + (name,)) + 8
+
+        self.buffer = ''
+        self.started = False    # 'name' was found
+        self.key = None     # key of the renderer being read, at buffer[0]
+        self.pos = 0        # how far the renderer has been read
+        self.depth = 0
+        self.in_string = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        found = []
+        while True:
+            if self.key is None and not self.start():
+                return found
+
+            depth, in_string = self.depth, self.in_string
+            buffer, pos, end = self.buffer, self.pos, None
+            while end is None:
+                match = self.tokens[in_string].search(buffer, pos)
+                if match is None:
+                    break
+                token, pos = match.group(), match.end()
+                if token == '\\':
+                    pos += 1    # escaped character
+                elif token == '"':
+                    in_string = not in_string
+                elif token == '{':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        end = pos
+
+            if end is None:     # wait for the rest of the renderer
+                self.depth, self.in_string = depth, in_string
+                self.pos = max(pos, len(buffer))
+                return found
+
+            found.append((self.key, json.loads(buffer[:end])))
+            self.buffer = buffer[end:]
+            self.key = None
+
+    # finds the next renderer in the buffer, dropping what's in front of it
+    #
+    def start(self):
+        if not self.started:
+            i = self.buffer.find(self.name)
+            if i < 0:
+                self.buffer = self.buffer[-self.overlap:]
+                return False
+            self.started = True
+            self.buffer = self.buffer[i + len(self.name):]
+
+        match = self.keys.search(self.buffer)
+        if match is None:
+            self.buffer = self.buffer[-self.overlap:]
+            return False
+        self.key = match.group(1)
+        self.buffer = self.buffer[match.end() - 1:]
+        self.pos = 1
+        self.depth = 1
+        self.in_string = False
+        return True
+
+
+extractors = {
+    'regex': RegexExtractor,
+    'json': JSONExtractor,
+}
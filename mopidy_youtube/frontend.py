@@ -0,0 +1,70 @@
+from __future__ import unicode_literals
+
+from mopidy.core import CoreListener
+
+import pykka
+
+from mopidy_youtube import logger, youtube
+from mopidy_youtube.backend import extract_id
+
+
+# Resolves audio urls just in time. Resolving is expensive (youtube_dl), and
+# resolved urls expire after a few hours, so instead of resolving every video
+# added to the tracklist, only the 'resolve_ahead' tracks after the current
+# one are resolved (and kept fresh, see youtube.AudioUrlCache). The window
+# follows the tracklist: it moves on when a track starts playing, and tracks
+# that are removed from it are dropped, cancelling their resolution if it
+# hasn't started yet. So youtube_dl's work doesn't grow with the size of the
+# tracklist.
+#
+# The track that is played is resolved by translate_uri anyway, in case it
+# wasn't resolved ahead.
+#
+class YouTubeFrontend(pykka.ThreadingActor, CoreListener):
+    def __init__(self, config, core):
+        super(YouTubeFrontend, self).__init__()
+        self.core = core
+        self.ahead = config['youtube']['resolve_ahead']
+
+    def on_start(self):
+        self.update()
+
+    def tracklist_changed(self):
+        self.update()
+
+    def track_playback_started(self, tl_track):
+        self.update()
+
+    def options_changed(self):
+        self.update()
+
+    # resolves the videos of the next 'ahead' tracks, and drops the others
+    #
+    def update(self):
+        try:
+            videos = [youtube.Video.get(extract_id(uri))
+                      for uri in self.next_uris()
+                      if uri.startswith('youtube:video/')]
+        except Exception as e:
+            logger.error('youtube frontend error "%s"', e)
+            return
+
+        youtube.AudioUrlCache.keep(videos)
+
+    # returns the uris of the 'ahead' tracks that come after the current
+    # track (in the order of the tracklist, from the start if nothing is
+    # playing)
+    #
+    def next_uris(self):
+        if self.ahead <= 0:
+            return []
+
+        tl_tracks = self.core.tracklist.get_tl_tracks().get()
+        current = self.core.playback.get_current_tl_track().get()
+        start = 0
+        if current is not None:
+            index = self.core.tracklist.index(current).get()
+            if index is not None:
+                start = index + 1
+
+        return [t.track.uri for t in tl_tracks[start:start + self.ahead]]
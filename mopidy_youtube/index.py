@@ -0,0 +1,219 @@
+from __future__ import unicode_literals
+
+import threading
+import urllib
+from collections import OrderedDict
+
+from cachetools import LRUCache
+
+from mopidy.models import Ref
+
+
+# In-memory index of the videos and playlists the backend has returned, as
+# the Tracks that search and lookup built for them (see backend.make_track):
+# the results of recent searches, videos, playlists (and their videos, once
+# they have been looked up), and the channels of all of these.
+#
+# It answers browse() and searches for specific fields (artist = channel,
+# album = playlist, track_name = title) without requests to YouTube. It's
+# updated by every search and lookup, and forgets the least recently used
+# entries.
+#
+# Browse tree:
+#   youtube:browse                      directories below
+#   youtube:browse/searches             recent searches
+#   youtube:browse/search/<query>       results of a search
+#   youtube:browse/playlists            playlists
+#   youtube:browse/channels             channels
+#   youtube:browse/channel/<name>       videos and playlists of a channel
+#   youtube:playlist/<title>.<id>       videos of a playlist
+#
+class Index:
+    root = 'youtube:browse'
+
+    # overridable by config
+    max_videos = 10000
+
+    max_searches = 50   # recent searches kept
+
+    videos = LRUCache(maxsize=max_videos)   # id -> Track
+    playlists = LRUCache(maxsize=max_videos // 10)  # id -> [Track, videos]
+    searches = OrderedDict()    # query -> Tracks, most recent last
+    lock = threading.Lock()     # controls access to all of the above
+
+    # re-creates the index, for 'max_videos' videos (0 to disable it)
+    #
+    @classmethod
+    def configure(cls, max_videos):
+        with cls.lock:
+            cls.max_videos = max_videos
+            cls.videos = LRUCache(maxsize=max(1, max_videos))
+            cls.playlists = LRUCache(maxsize=max(1, max_videos // 10))
+            cls.searches = OrderedDict()
+
+    @staticmethod
+    def is_video(track):
+        return track.uri.startswith('youtube:video/')
+
+    # adds the tracks of videos and playlists (whose videos are kept, if
+    # known already). Called with lock held
+    #
+    @classmethod
+    def _add(cls, tracks):
+        if cls.max_videos <= 0:
+            return
+        for track in tracks:
+            if cls.is_video(track):
+                cls.videos[track.comment] = track
+            else:
+                playlist = cls.playlists.get(track.comment)
+                videos = playlist[1] if playlist else None
+                cls.playlists[track.comment] = [track, videos]
+
+    @classmethod
+    def add(cls, tracks):
+        with cls.lock:
+            cls._add(tracks)
+
+    @classmethod
+    def add_search(cls, query, tracks):
+        with cls.lock:
+            cls._add(tracks)
+            if cls.max_videos <= 0:
+                return
+            cls.searches.pop(query, None)
+            cls.searches[query] = tracks
+            while len(cls.searches) > cls.max_searches:
+                cls.searches.popitem(last=False)
+
+    # adds a playlist (its Track) with the tracks of its videos
+    #
+    @classmethod
+    def add_playlist(cls, track, videos):
+        with cls.lock:
+            cls._add([track] + videos)
+            if track.comment in cls.playlists:
+                cls.playlists[track.comment][1] = videos
+
+    @classmethod
+    def ref(cls, track):
+        if cls.is_video(track):
+            return Ref.track(uri=track.uri, name=track.name)
+        return Ref.album(uri=track.uri, name=track.name)
+
+    # returns the Refs below 'uri' (None if 'uri' isn't in the browse tree)
+    #
+    @classmethod
+    def browse(cls, uri):
+        def directory(path, name):
+            return Ref.directory(uri=cls.root + path, name=name)
+
+        if uri == cls.root:
+            return [
+                directory('/searches', 'Recent searches'),
+                directory('/playlists', 'Playlists'),
+                directory('/channels', 'Channels'),
+            ]
+
+        with cls.lock:
+            if uri == cls.root + '/searches':
+                return [directory('/search/' + quote(query), query)
+                        for query in reversed(cls.searches)]
+
+            if uri.startswith(cls.root + '/search/'):
+                tracks = cls.searches.get(unquote(uri.split('/')[-1]), [])
+                return map(cls.ref, tracks)
+
+            if uri == cls.root + '/playlists':
+                return sorted((cls.ref(track) for track, videos
+                               in cls.playlists.values()),
+                              key=lambda ref: ref.name.lower())
+
+            if uri == cls.root + '/channels':
+                return [directory('/channel/' + quote(name), name)
+                        for name in sorted(cls.channels(), key=unicode.lower)]
+
+            if uri.startswith(cls.root + '/channel/'):
+                name = unquote(uri.split('/')[-1])
+                return [cls.ref(track) for track in cls.tracks()
+                        if name in cls.artist_names(track)]
+
+            if uri.startswith('youtube:playlist/'):
+                playlist = cls.playlists.get(uri.split('.')[-1])
+                return map(cls.ref, playlist and playlist[1] or [])
+        return None
+
+    # returns the Tracks matching a Mopidy search query, eg.
+    # {'artist': ['chvrches'], 'album': ['live']}. Every value of every field
+    # has to match, a part of it (the whole of it if 'exact'), ignoring case
+    #
+    @classmethod
+    def search(cls, query, exact=False):
+        query = {
+            field: [value.lower() for value in values]
+            for field, values in query.items()
+        }
+
+        def matches(track):
+            fields = cls.fields(track)
+            for field, values in query.items():
+                found = [v.lower() for v in fields.get(field, []) if v]
+                for value in values:
+                    if not any(value == v if exact else value in v
+                               for v in found):
+                        return False
+            return True
+
+        with cls.lock:
+            return [track for track in cls.tracks() if matches(track)]
+
+    # the values of the search fields of a track. The album of a playlist is
+    # the playlist itself
+    #
+    @classmethod
+    def fields(cls, track):
+        artists = cls.artist_names(track)
+        if cls.is_video(track):
+            album = [track.album.name] if track.album else []
+            fields = {'track_name': [track.name], 'artist': artists,
+                      'album': album}
+        else:
+            fields = {'artist': artists, 'album': [track.name]}
+        fields['any'] = sum(fields.values(), [])
+        return fields
+
+    @staticmethod
+    def artist_names(track):
+        return [artist.name for artist in track.artists if artist.name]
+
+    # all Tracks: videos, the videos of playlists (which have the playlist
+    # as album), and playlists. Called with lock held
+    #
+    @classmethod
+    def tracks(cls):
+        seen = set()
+        tracks = []
+        for track in cls.videos.values() + [
+                video for playlist in cls.playlists.values()
+                for video in playlist[1] or []] + [
+                playlist[0] for playlist in cls.playlists.values()]:
+            if track not in seen:
+                seen.add(track)
+                tracks.append(track)
+        return tracks
+
+    # names of the channels of all videos and playlists. Called with lock
+    # held
+    #
+    @classmethod
+    def channels(cls):
+        return set(name for track in cls.tracks()
+                   for name in cls.artist_names(track))
+
+
+def quote(name):
+    return urllib.quote(name.encode('utf-8'), safe='')
+
+
+def unquote(name):
+    return urllib.unquote(name.encode('utf-8')).decode('utf-8')
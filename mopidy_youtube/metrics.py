@@ -0,0 +1,219 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+from contextlib import contextmanager
+
+import tornado.web
+
+from mopidy_youtube import logger
+
+
+# Counters and latency histograms of the extension, eg. how many requests
+# each endpoint of API, scrAPI and youtube_dl got, how long they took and how
+# many failed. Everything else (thread pool queues, cache hit ratios, ...) is
+# read when the metrics are exported, by the functions in 'collectors', which
+# return (name, type, labels, value) tuples.
+#
+# The metrics are exported in the Prometheus text format, at
+# http://<mopidy>/youtube/metrics (see factory), and summarized in the log
+# every 'log_interval' seconds (see start_logging).
+#
+# Metrics are identified by name and labels, eg.
+#   with Metrics.timed('request_seconds', endpoint='api.search'):
+#       ...
+#
+class Metrics:
+    prefix = 'mopidy_youtube_'
+
+    # upper bounds of the histogram buckets, in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    counters = {}   # (name, labels) -> value
+    histograms = {}     # (name, labels) -> [count per bucket.., sum, count]
+    collectors = []
+    lock = threading.Lock()     # controls access to counters and histograms
+
+    # overridable by config
+    log_interval = 0
+    logging = None  # the thread logging summaries
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    @classmethod
+    def count(cls, name, value=1, **labels):
+        key = cls._key(name, labels)
+        with cls.lock:
+            cls.counters[key] = cls.counters.get(key, 0) + value
+
+    @classmethod
+    def observe(cls, name, seconds, **labels):
+        key = cls._key(name, labels)
+        with cls.lock:
+            histogram = cls.histograms.get(key)
+            if histogram is None:
+                histogram = cls.histograms[key] = [0] * (len(cls.buckets) + 2)
+            for i, bound in enumerate(cls.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    # records the time the enclosed block takes in histogram 'name'. Blocks
+    # that raise an exception are counted in '<name>_errors_total' too, eg.
+    #   request_seconds{endpoint="api.search"}
+    #   request_seconds_errors_total{endpoint="api.search"}
+    #
+    @classmethod
+    @contextmanager
+    def timed(cls, name, **labels):
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            cls.count(name + '_errors_total', **labels)
+            raise
+        finally:
+            cls.observe(name, time.time() - start, **labels)
+
+    # returns the upper bound of the bucket holding the q-quantile of
+    # histogram 'name' (None if it's empty, inf if it's above all buckets)
+    #
+    @classmethod
+    def quantile(cls, name, q, **labels):
+        with cls.lock:
+            histogram = cls.histograms.get(cls._key(name, labels))
+            if not histogram or not histogram[-1]:
+                return None
+            seen = 0
+            for bound, count in zip(cls.buckets, histogram):
+                seen += count
+                if seen >= q * histogram[-1]:
+                    return bound
+            return float('inf')
+
+    # returns all metrics, as (name, type, labels, value) tuples. The value of
+    # a histogram is the list of its buckets, then its sum and count
+    #
+    @classmethod
+    def collect(cls):
+        with cls.lock:
+            metrics = [
+                (name, 'counter', labels, value)
+                for (name, labels), value in cls.counters.items()
+            ] + [
+                (name, 'histogram', labels, list(value))
+                for (name, labels), value in cls.histograms.items()
+            ]
+
+        for collector in cls.collectors:
+            try:
+                metrics.extend(
+                    (name, type, tuple(sorted(labels.items())), value)
+                    for name, type, labels, value in collector()
+                )
+            except Exception as e:
+                logger.error('youtube metrics error "%s"', e)
+        return sorted(metrics, key=lambda metric: metric[:3])
+
+    # returns all metrics in the Prometheus text format
+    # https://prometheus.io/docs/instrumenting/exposition_formats/
+    #
+    @classmethod
+    def prometheus(cls):
+        lines = []
+        previous = None
+        for name, type, labels, value in cls.collect():
+            name = cls.prefix + name
+            if name != previous:
+                lines.append('# TYPE %s %s' % (name, type))
+                previous = name
+
+            if type != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(labels),
+                                          _number(value)))
+                continue
+
+            cumulative = 0
+            for bound, count in zip(cls.buckets, value):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, _labels(labels + (('le', _number(bound)),)),
+                    cumulative))
+            lines.append('%s_bucket%s %d' % (
+                name, _labels(labels + (('le', '+Inf'),)), value[-1]))
+            lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                          _number(value[-2])))
+            lines.append('%s_count%s %d' % (name, _labels(labels), value[-1]))
+        return '\n'.join(lines) + '\n'
+
+    # returns a one-line summary of the metrics, for the log
+    #
+    @classmethod
+    def summary(cls):
+        metrics = cls.collect()
+        with cls.lock:
+            counters = dict(cls.counters)
+
+        parts = []
+        for name, type, labels, value in metrics:
+            if type == 'gauge':
+                parts.append('%s%s=%s' % (name, _labels(labels),
+                                          _number(value)))
+            elif type == 'histogram' and value[-1]:
+                errors = counters.get((name + '_errors_total', labels), 0)
+                p95, p99 = [cls.quantile(name, q, **dict(labels))
+                            for q in (0.95, 0.99)]
+                parts.append('%s%s %d calls, %d errors, avg %d ms, '
+                             'p95 <= %s ms, p99 <= %s ms' % (
+                                 name, _labels(labels), value[-1], errors,
+                                 value[-2] * 1000 / value[-1],
+                                 _number(p95 * 1000), _number(p99 * 1000)))
+        return '; '.join(parts) or 'nothing yet'
+
+    # logs a summary every 'log_interval' seconds, in a background thread
+    #
+    @classmethod
+    def start_logging(cls):
+        if cls.log_interval <= 0 or cls.logging is not None:
+            return
+
+        def log():
+            while True:
+                time.sleep(cls.log_interval)
+                logger.info('youtube metrics: %s', cls.summary())
+
+        cls.logging = threading.Thread(target=log)
+        cls.logging.daemon = True
+        cls.logging.start()
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, unicode(v).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return '%g' % value if isinstance(value, float) else '%d' % value
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type',
+                        'text/plain; version=0.0.4; charset=utf-8')
+        self.write(Metrics.prometheus())
+
+
+# http:app factory, see Extension.setup
+#
+def factory(config, core):
+    return [(r'/metrics', MetricsHandler)]
@@ -0,0 +1,92 @@
+from __future__ import unicode_literals
+
+import re
+from collections import namedtuple
+
+
+# Records are what API and scrAPI return: one record per video or playlist,
+# with the values Video/Playlist need (see Entry._set_api_data), converted
+# already. They are namedtuples, so they don't have a __dict__ of their own.
+# Values that aren't known are None.
+#
+#   VideoData.length            in seconds
+#   *.thumbnails                list of urls
+#   PlaylistData.video_count    number of videos in the playlist
+#
+# The items in a playlist are VideoData records as well, with only the id
+# and title set.
+
+
+# convert PT1H2M10S to 3730
+#
+def parse_duration(duration):
+    m = re.match(r'PT((?P<hours>\d+)H)?((?P<minutes>\d+)M)?'
+                 r'((?P<seconds>\d+)S)?', duration or '')
+    if not m:
+        return None
+    return (int(m.group('hours') or 0) * 3600 +
+            int(m.group('minutes') or 0) * 60 +
+            int(m.group('seconds') or 0))
+
+
+# turns a thumbnails dict of the API into a list of urls
+#
+def thumbnail_urls(thumbnails, sizes=('medium', 'high')):
+    return [
+        val['url']
+        for (key, val) in (thumbnails or {}).items()
+        if key in sizes
+    ]
+
+
+class VideoData(namedtuple('VideoData', [
+        'id', 'title', 'channel', 'length', 'thumbnails'])):
+    __slots__ = ()
+
+    # builds a record from an item of the API's search/videos/playlistItems
+    # results
+    #
+    @classmethod
+    def from_api(cls, item):
+        snippet = item.get('snippet', {})
+        if 'resourceId' in snippet:             # playlist item
+            id = snippet['resourceId']['videoId']
+        elif isinstance(item['id'], dict):      # search result
+            id = item['id']['videoId']
+        else:
+            id = item['id']
+        return cls(
+            id=id,
+            title=snippet.get('title'),
+            channel=snippet.get('channelTitle'),
+            length=parse_duration(
+                item.get('contentDetails', {}).get('duration')),
+            thumbnails=thumbnail_urls(snippet.get('thumbnails')) or None,
+        )
+
+
+VideoData.__new__.__defaults__ = (None,) * 4
+
+
+class PlaylistData(namedtuple('PlaylistData', [
+        'id', 'title', 'channel', 'thumbnails', 'video_count'])):
+    __slots__ = ()
+
+    # builds a record from an item of the API's search/playlists results
+    #
+    @classmethod
+    def from_api(cls, item):
+        snippet = item.get('snippet', {})
+        id = item['id']
+        if isinstance(id, dict):        # search result
+            id = id['playlistId']
+        return cls(
+            id=id,
+            title=snippet.get('title'),
+            channel=snippet.get('channelTitle'),
+            thumbnails=thumbnail_urls(snippet.get('thumbnails')),
+            video_count=item.get('contentDetails', {}).get('itemCount'),
+        )
+
+
+PlaylistData.__new__.__defaults__ = (None,) * 4
@@ -0,0 +1,42 @@
+from __future__ import unicode_literals
+
+import json
+import os
+import sys
+
+from mopidy_youtube.youtube import AudioUrlCache, YoutubeDLPool
+
+
+# Worker process of youtube.ResolverProcesses. Reads video ids from stdin
+# and writes the audio url of every video, with its expiry time, to stdout,
+# one JSON object per line:
+#   {"id": "C0DPdy98e4c"}  ->  {"url": "https://...", "expire": 1500000000}
+#                          or  {"error": "..."}
+# Started as
+#   python -m mopidy_youtube.resolver '{"params": {...}, "cachedir": ...}'
+# and exits at the end of its input.
+#
+def main():
+    # the answers get the original stdout, anything youtube_dl prints goes
+    # to stderr
+    out = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    options = json.loads(sys.argv[1])
+    YoutubeDLPool.params = options['params']
+    YoutubeDLPool.cachedir = options['cachedir']
+    ydl = YoutubeDLPool.create()
+
+    for line in iter(sys.stdin.readline, b''):
+        id = json.loads(line)['id']
+        try:
+            url = YoutubeDLPool.extract_url(ydl, id)
+            result = {'url': url, 'expire': AudioUrlCache.expiry(url)}
+        except Exception as e:
+            result = {'error': unicode(e)}
+        out.write(json.dumps(result).encode('utf-8') + b'\n')
+        out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,335 @@
 # -*- coding: utf-8 -*-
 
+import Queue
+import codecs
+import json
+import random
 import re
+import select
+import subprocess
+import sys
 import threading
+import time
 import traceback
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from itertools import islice
+from urlparse import parse_qs, urlparse
 
-from repoze.lru import lru_cache
+from cachetools import TTLCache
 
-import youtube_dl
+from mopidy import httpclient
 
-import json
-from itertools import islice
 import pykka
 
 import requests
 
+import youtube_dl
+
+import mopidy_youtube
 from mopidy_youtube import logger
-from mopidy import httpclient
+from mopidy_youtube.cache import DiskCache
+from mopidy_youtube.engine import EngineSession
+from mopidy_youtube.extractors import JSONExtractor
+from mopidy_youtube.metrics import Metrics
+from mopidy_youtube.records import PlaylistData, VideoData
 
 # Making HTTP requests from extensions
 # https://docs.mopidy.com/en/latest/extensiondev/#making-http-requests-from-extensions
 
-def get_requests_session(proxy_config, user_agent):
+
+#
+# pool_size is the number of connections kept alive per host, it should match
+# the number of threads making requests through the session at once.
+#
+def get_requests_session(proxy_config, user_agent, pool_size=10):
     proxy = httpclient.format_proxy(proxy_config)
     full_user_agent = httpclient.format_user_agent(user_agent)
 
     session = requests.Session()
     session.proxies.update({'http': proxy, 'https': proxy})
     session.headers.update({'user-agent': full_user_agent})
-    
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        pool_block=True,    # wait for a free connection, don't open more
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(count_response)
+
     return session
 
-# decorator for creating async properties using pykka.ThreadingFuture
-# A property 'foo' should have a future '_foo'
-# On first call we invoke func() which should create the future
+
+# counts responses by host and status code, see metrics.py
+#
+def count_response(response, *args, **kwargs):
+    Metrics.count('responses_total', host=urlparse(response.url).netloc,
+                  status=response.status_code)
+
+
+user_agent = '%s/%s' % (
+    mopidy_youtube.Extension.dist_name,
+    mopidy_youtube.Extension.version)
+
+
+# calls f(arg) for every arg in 'args', using at most 'threads' threads at
+# once, and yields (arg, result) tuples as soon as they are available (so not
+# in the order of 'args'). Used to fetch many pages concurrently.
+#
+def fan_out(f, args, threads):
+    args = list(args)
+    pending = Queue.Queue()
+    results = Queue.Queue()
+    for arg in args:
+        pending.put(arg)
+
+    def worker():
+        while True:
+            try:
+                arg = pending.get(block=False)
+            except Queue.Empty:
+                return
+            try:
+                result = f(arg)
+            except Exception as e:
+                logger.error('youtube fetch error "%s"', e)
+                result = None
+            results.put((arg, result))
+
+    for i in range(min(threads, len(args))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    for i in range(len(args)):
+        yield results.get()
+
+
+# decorator for creating async properties. A property 'foo' returns a future
+# for the field 'foo' (see Entry._future)
+# On first call we invoke func() which should start loading the field (or set
+# it right away)
 # On subsequent calls we just return the future
 #
 def async_property(func):
-    _future_name = '_' + func.__name__
+    name = func.__name__
 
     def wrapper(self):
-        if _future_name not in self.__dict__:
-            apply(func, (self,))   # should create the future
-        return self.__dict__[_future_name]
+        future = self._future(name)
+        if future is None:
+            apply(func, (self,))   # should start loading the field
+            future = self._future(name)
+        ThreadPool.claim(future)    # someone is interested, see ThreadPool
+        return future
 
     return property(wrapper)
 
 
+# future of a field that is being loaded. Any number of threads may wait for
+# it at once: the value of a plain pykka.ThreadingFuture is handed to the
+# first thread waiting only, others waiting at the same time (eg. two lookups
+# of the same playlist) would wait forever
+#
+class Pending(pykka.ThreadingFuture):
+    def __init__(self):
+        super(Pending, self).__init__()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def get(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise pykka.Timeout('%s seconds' % timeout)
+        with self._lock:
+            return super(Pending, self).get(timeout=0)
+
+    def set(self, value=None):
+        super(Pending, self).set(value)
+        self._done.set()
+
+    def set_exception(self, exc_info=None):
+        super(Pending, self).set_exception(exc_info)
+        self._done.set()
+
+
+# future of a field that has been loaded already. Loaded values are kept in
+# plain fields, and a Loaded future is created on demand, so that cached
+# objects don't carry a pykka.ThreadingFuture (with its queue and locks) for
+# every field
+#
+class Loaded(pykka.Future):
+    def __init__(self, value):
+        super(Loaded, self).__init__()
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+
+# In-memory store of the Video and Playlist objects, behind Entry.get.
+#
+# Every kind has an identity map of weak references, so that there is only
+# one object per video/playlist for as long as it's referenced anywhere (eg.
+# from the videos of a playlist), and data loaded through one reference is
+# seen by all. Strong references to the most recently used objects are kept
+# in an LRU list, bounded by the estimated memory use of the objects (see
+# sizeof) rather than their number. Objects that drop out of the LRU list
+# are gone once nothing else references them.
+#
+# Loaded fields can expire, after ttls[field] seconds: the next get() drops
+# them, and they are loaded again when they are needed. invalidate() drops
+# fields (or everything) of an object explicitly.
+#
+# stats() returns the occupancy and the counters of the store.
+#
+class EntityStore:
+    # overridable by config
+    max_bytes = 16 * 1024 * 1024
+
+    # seconds after which a loaded field is loaded again (never if missing)
+    ttls = {
+        'video_count': 3600,
+        'videos': 3600,
+    }
+
+    lru = OrderedDict()     # (kind, id) -> [obj, size], oldest first
+    alive = {}      # kind -> WeakValueDictionary(id -> obj)
+    stamps = weakref.WeakKeyDictionary()    # obj -> {field: load time}
+    size = 0        # estimated bytes of the objects in lru
+    lock = threading.RLock()    # controls access to all of the above
+
+    hits = 0
+    misses = 0
+    revived = 0     # objects found after they dropped out of lru
+    evictions = 0
+    expired = 0     # fields dropped because of their ttl
+
+    @classmethod
+    def get(cls, entry_cls, id):
+        key = (entry_cls.kind, id)
+        with cls.lock:
+            alive = cls.alive.setdefault(
+                entry_cls.kind, weakref.WeakValueDictionary())
+            if key in cls.lru:
+                cls.hits += 1
+                obj = cls.lru[key][0]
+                cls.lru[key] = cls.lru.pop(key)     # most recently used
+            else:
+                obj = alive.get(id)
+                if obj is not None:
+                    cls.revived += 1
+                else:
+                    cls.misses += 1
+                    obj = alive[id] = entry_cls()
+                    obj.id = id
+                cls.lru[key] = [obj, 0]
+                cls._account(obj)
+
+            cls._expire(obj)
+        return obj
+
+    # called when 'fields' of 'objects' have been loaded
+    #
+    @classmethod
+    def loaded(cls, objects, fields):
+        now = time.time()
+        with cls.lock:
+            for obj in objects:
+                stamps = cls.stamps.setdefault(obj, {})
+                stamps.update((k, now) for k in fields)
+                cls._account(obj)
+
+    # drops the given fields (all loaded fields if None) of an object, so
+    # that they are loaded again, from YouTube (not from DiskCache)
+    #
+    @classmethod
+    def invalidate(cls, entry_cls, id, fields=None):
+        with cls.lock:
+            obj = cls.alive.get(entry_cls.kind, {}).get(id)
+            if obj is not None:
+                cls._drop(obj, fields)
+        DiskCache.delete(entry_cls.kind, id)
+
+    @classmethod
+    def stats(cls):
+        with cls.lock:
+            return {
+                'entries': len(cls.lru),
+                'bytes': cls.size,
+                'max_bytes': cls.max_bytes,
+                'hits': cls.hits,
+                'misses': cls.misses,
+                'revived': cls.revived,
+                'evictions': cls.evictions,
+                'expired': cls.expired,
+            }
+
+    # drops fields that are older than their ttl. Called with lock held.
+    #
+    @classmethod
+    def _expire(cls, obj):
+        stamps = cls.stamps.get(obj)
+        if not stamps:
+            return
+
+        now = time.time()
+        expired = [
+            k for k, t in stamps.items()
+            if cls.ttls.get(k) is not None and now - t > cls.ttls[k]
+        ]
+        if expired:
+            cls.expired += len(expired)
+            cls._drop(obj, expired)
+
+    # drops loaded fields of 'obj'. Fields that are still being loaded are
+    # left alone. Called with lock held.
+    #
+    @classmethod
+    def _drop(cls, obj, fields):
+        stamps = cls.stamps.get(obj, {})
+        for k in obj.fields if fields is None else fields:
+            obj._unset(k)
+            stamps.pop(k, None)
+        cls._account(obj)
+
+    # updates the size of 'obj' (if it's in lru), and evicts the least
+    # recently used objects while over budget. Called with lock held.
+    #
+    @classmethod
+    def _account(cls, obj):
+        entry = cls.lru.get((obj.kind, obj.id))
+        if entry is None or entry[0] is not obj:
+            return
+
+        size = cls.sizeof(obj)
+        cls.size += size - entry[1]
+        entry[1] = size
+
+        while cls.size > cls.max_bytes and len(cls.lru) > 1:
+            key, (evicted, size) = cls.lru.popitem(last=False)
+            cls.size -= size
+            cls.evictions += 1
+
+    # estimated memory used by 'obj' and its loaded values (objects in
+    # lists, like the videos of a playlist, are counted on their own)
+    #
+    @classmethod
+    def sizeof(cls, obj):
+        size = sys.getsizeof(obj)
+        for name in obj.slots():
+            value = getattr(obj, name, None)
+            if value is None:
+                continue
+            size += sys.getsizeof(value)
+            if isinstance(value, (list, tuple)):
+                size += sum(sys.getsizeof(x) for x in value
+                            if isinstance(x, basestring))
+        return size
+
+
 # The Video / Playlist classes can be used to load YouTube data. If
 # 'api_enabled' is true (and a valid api_key supplied), most data are loaded
 # using the (very much faster) YouTube Data API. If 'api_enabled' is false, most
@@ -75,75 +359,117 @@ api_enabled = False
 #
 # Entry is a base class of Video and Playlist
 #
+# The value of a field 'foo' is kept in the slot '_foo' once it's loaded.
+# While it's being loaded, the future that will be set is in _pending['foo']
+# (_pending is None when nothing is being loaded).
+#
 class Entry(object):
-    cache_max_len = 400
+    __slots__ = ('id', '_pending', '__weakref__', '_title', '_channel')
+
+    lock = threading.RLock()    # controls access to _pending and the fields
+
+    def __init__(self):
+        self._pending = None
 
     # Use Video.get(id), Playlist.get(id), instead of Video(id), Playlist(id),
-    # to fetch a cached object, if available
+    # to fetch a cached object, if available (see EntityStore)
     #
     @classmethod
-    @lru_cache(maxsize=cache_max_len)
     def get(cls, id):
-        obj = cls()
-        obj.id = id
-        return obj
+        return EntityStore.get(cls, id)
 
-    # Search for both videos and playlists using a single API call. Fetches
-    # only title, thumbnails, channel (extra queries are needed for length and
-    # video_count)
+    # Search for both videos and playlists using a single API call. Sets all
+    # fields the results have, so that they don't need to be loaded again:
+    # title, channel, thumbnails, and length/video_count if the results have
+    # them (scrAPI's do, the API's need extra queries for them)
     #
     @classmethod
     def search(cls, q):
         def create_object(item):
-            if item['id']['kind'] == 'youtube#video':
-                obj = Video.get(item['id']['videoId'])
-                ## check if ['contentDetails'] exists in item and if so, ask for length
-                # if 'contentDetails' in item:
-                #     obj._set_api_data(['title', 'channel', 'length'], item)
-                # else:
-                #     obj._set_api_data(['title', 'channel'], item)
-                obj._set_api_data(['title', 'channel'], item)
+            if isinstance(item, VideoData):
+                obj = Video.get(item.id)
             else:
-                obj = Playlist.get(item['id']['playlistId'])
-                ## check if ['contentDetails'] exists in item and if so, ask for video_count
-                # if 'contentDetails' in item:
-                #     obj._set_api_data(['title', 'channel', 'thumbnails', 'video_count'], item)
-                # else:
-                #     obj._set_api_data(['title', 'channel', 'thumbnails'], item)
-                obj._set_api_data(['title', 'channel', 'thumbnails'], item)
+                obj = Playlist.get(item.id)
+            obj._set_api_data(obj._search_fields(item), item)
             return obj
 
+        def store(objects):
+            for cls in (Video, Playlist):
+                cls._store(
+                    [x for x in objects if isinstance(x, cls)],
+                    cls.search_fields + cls.search_extra_fields
+                )
+
         try:
-            if api_enabled:
-                data = API.search(q)
-            else:
-                data = scrAPI.search(q)
+            data = SearchCache.search(
+                q, lambda q: fetch(API.search, scrAPI.search, q))
         except Exception as e:
             logger.error('search error "%s"', e)
             return None
             
         try:
-            mapped_return = map(create_object, data['items'])
+            mapped_return = map(create_object, data)
         except Exception as e:
             logger.error('map error "%s"', e)
             return None
-            
+
+        store(mapped_return)
         return mapped_return 
 
+    # returns the fields a search result sets: search_fields, and those of
+    # search_extra_fields the result 'item' has a value for
+    #
+    @classmethod
+    def _search_fields(cls, item):
+        return cls.search_fields + [
+            k for k in cls.search_extra_fields
+            if getattr(item, k) not in (None, [])
+        ]
+
     # Adds futures for the given fields to all objects in list, unless they
-    # already exist. Returns objects for which at least one future was added
+    # are loaded or being loaded already. Returns objects for which at least
+    # one future was added
     #
     @classmethod
     def _add_futures(cls, list, fields):
-        def add(obj):
-            added = False
-            for k in fields:
-                if '_'+k not in obj.__dict__:
-                    obj.__dict__['_'+k] = pykka.ThreadingFuture()
-                    added = True
-            return added
+        return filter(lambda obj: obj._pend(fields), list)
 
-        return filter(add, list)
+    # returns the pending futures of the given fields of all objects in list
+    #
+    @classmethod
+    def _futures(cls, list, fields):
+        futures = []
+        for obj in list:
+            pending = obj._pending or {}
+            futures += [pending[k] for k in fields if k in pending]
+        return futures
+
+    # sets the given 'fields' of the objects in 'list' that are found in the
+    # disk cache. Returns objects for which at least one field is still
+    # missing, and needs to be loaded
+    #
+    @classmethod
+    def _load_cached(cls, list, fields):
+        def load(obj):
+            missing = [k for k in fields if not obj._is_loaded(k)]
+            data = DiskCache.get(cls.kind, obj.id, EntityStore.ttls)
+            cached = [k for k in missing if k in data]
+            obj._set_cache_data(cached, data)
+            EntityStore.loaded([obj], cached)
+            return len(cached) < len(missing)
+
+        return filter(load, list)
+
+    # writes the loaded 'fields' of the objects in 'list' through to the disk
+    # cache
+    #
+    @classmethod
+    def _store(cls, list, fields):
+        EntityStore.loaded(list, fields)
+        DiskCache.put(
+            cls.kind,
+            [(x.id, x._loaded_fields(fields)) for x in list]
+        )
 
     # common Video/Playlist properties go to the base class
     #
@@ -155,75 +481,137 @@ class Entry(object):
     def channel(self):
         self.load_info([self])
 
-    # sets the given 'fields' of 'self', based on the 'item'
-    # data retrieved through the API
+    # returns the names of all slots of the object
+    #
+    @classmethod
+    def slots(cls):
+        return [name for c in cls.__mro__
+                for name in getattr(c, '__slots__', ())
+                if not name.startswith('__')]
+
+    # returns a future for field 'k': the pending future if it's being
+    # loaded, a Loaded future if it's loaded, None otherwise
+    #
+    def _future(self, k):
+        with Entry.lock:
+            if self._pending and k in self._pending:
+                return self._pending[k]
+            try:
+                return Loaded(getattr(self, '_' + k))
+            except AttributeError:
+                return None
+
+    def _is_loaded(self, k):
+        return hasattr(self, '_' + k)
+
+    # returns the value of field 'k' if it's loaded, 'default' otherwise,
+    # without loading it
+    #
+    def peek(self, k, default=None):
+        return getattr(self, '_' + k, default)
+
+    # adds pending futures for the given fields, unless they are loaded or
+    # being loaded already. Returns the fields for which a future was added
+    #
+    def _pend(self, fields):
+        added = []
+        with Entry.lock:
+            for k in fields:
+                if self._is_loaded(k) or k in (self._pending or ()):
+                    continue
+                if self._pending is None:
+                    self._pending = {}
+                self._pending[k] = Pending()
+                added.append(k)
+        return added
+
+    # sets field 'k' (unless it's loaded already, or 'replace' is true), and
+    # the pending future of the field
+    #
+    def _set(self, k, value, replace=False):
+        with Entry.lock:
+            if self._is_loaded(k) and not replace:
+                return
+            setattr(self, '_' + k, value)
+            future = None
+            if self._pending:
+                future = self._pending.pop(k, None)
+                if not self._pending:
+                    self._pending = None
+        if future is not None:
+            future.set(value)
+
+    # forgets the loaded value of field 'k', so that it's loaded again
+    #
+    def _unset(self, k):
+        with Entry.lock:
+            if self._is_loaded(k):
+                delattr(self, '_' + k)
+
+    # sets the given 'fields' of 'self', based on the 'item' record
+    # retrieved through API/scrAPI
     #
     def _set_api_data(self, fields, item):
         for k in fields:
-            _k = '_' + k
-            future = self.__dict__.get(_k)
-            if not future:
-                future = self.__dict__[_k] = pykka.ThreadingFuture()
-
-            if not future._queue.empty():  # hack, no public is_set()
+            if self._is_loaded(k):
                 continue
 
             if not item:
                 val = None
-            elif k == 'title':
-                val = item['snippet']['title']
-            elif k == 'channel':
-                val = item['snippet']['channelTitle']
-            elif k == 'length':
-                # convert PT1H2M10S to 3730
-                m = re.search('PT((?P<hours>\d+)H)?' +
-                              '((?P<minutes>\d+)M)?' +
-                              '((?P<seconds>\d+)S)?',
-                              item['contentDetails']['duration'])
-                val = (int(m.group('hours') or 0) * 3600 +
-                       int(m.group('minutes') or 0) * 60 +
-                       int(m.group('seconds') or 0))
             elif k == 'video_count':
-                val = min(item['contentDetails']['itemCount'], self.max_videos)
-            elif k == 'thumbnails':
-                val = [
-                    val['url']
-                    for (key, val) in item['snippet']['thumbnails'].items()
-                    if key in ['medium', 'high']
-                ]
+                val = item.video_count
+                if val is not None:
+                    val = min(val, self.max_videos)
+            else:
+                val = getattr(item, k)
+
+            self._set(k, val)
+
+    # sets the given 'fields' of 'self' to the values in 'data' (as loaded
+    # from the disk cache)
+    #
+    def _set_cache_data(self, fields, data):
+        for k in fields:
+            self._set(k, data[k])
 
-            future.set(val)
+    # returns a dict with the values of the given 'fields' that have been
+    # loaded already (missing videos/playlists have None values, which are
+    # left out)
+    #
+    def _loaded_fields(self, fields):
+        values = {}
+        for k in fields:
+            val = getattr(self, '_' + k, None)
+            if val is not None:
+                values[k] = val
+        return values
 
 
 class Video(Entry):
+    __slots__ = ('_length', '_thumbnails', '_audio_url', '_audio_url_expire')
+
+    kind = 'video'
+    fields = ('title', 'channel', 'length', 'thumbnails', 'audio_url')
+    info_fields = ['title', 'length', 'channel']
+    search_fields = ['title', 'channel']
+    search_extra_fields = ['length', 'thumbnails']
 
     # loads title, length, channel of multiple videos using one API call for
-    # every 50 videos. API calls are split in separate threads.
+    # every 50 videos (see Batcher). API calls are split in separate threads.
     #
     @classmethod
     def load_info(cls, list):
-        fields = ['title', 'length', 'channel']
-        list = cls._add_futures(list, fields)
-
-        def job(sublist):
-            try:
-                if api_enabled:
-                    data = API.list_videos([x.id for x in sublist])
-                else:
-                    data = scrAPI.list_videos([x.id for x in sublist])
-                dict = {item['id']: item for item in data['items']}
-            except Exception as e:
-                logger.error('list_videos error "%s"', e)
-                dict = {}
-
-            for video in sublist:
-                video._set_api_data(fields, dict.get(video.id))
+        list = cls._add_futures(list, cls.info_fields)
+        list = cls._load_cached(list, cls.info_fields)
+        Batcher.load(cls, list)
 
-        # 50 items at a time, make sure order is deterministic so that HTTP
-        # requests are replayable in tests
-        for i in range(0, len(list), 50):
-            sublist = list[i:i+50]
-            ThreadPool.run(job, (sublist,))
+    # returns (or yields) the records of the videos with the given ids,
+    # called by Batcher
+    #
+    @classmethod
+    def _list(cls, ids):
+        # with scrAPI, items are yielded as the pages arrive
+        return fetch(API.list_videos, scrAPI.iter_videos, ids)
 
     @async_property
     def length(self):
@@ -232,47 +620,57 @@ class Video(Entry):
     @async_property
     def thumbnails(self):
         # make it "async" for uniformity with Playlist.thumbnails
-        self._thumbnails = pykka.ThreadingFuture()
-        self._thumbnails.set([
+        self._set('thumbnails', [
             'https://i.ytimg.com/vi/%s/%s.jpg' % (self.id, type)
             for type in ['mqdefault', 'hqdefault']
         ])
 
     # audio_url is the only property retrived using youtube_dl, it's much more
-    # expensive than the rest
+    # expensive than the rest. Resolved urls expire after a few hours, a stale
+    # url is resolved again (see AudioUrlCache)
     #
-    @async_property
+    @property
     def audio_url(self):
-        self._audio_url = pykka.ThreadingFuture()
-
-        def job():
-            try:
-                info = youtube_dl.YoutubeDL(
-                    {'format': 'm4a/vorbis/bestaudio/best'}
-                ).extract_info(
-                    url = "https://www.youtube.com/watch?v=%s" % self.id,
-                    download = False,
-                    ie_key=None, 
-                    extra_info={}, 
-                    process=True, 
-                    force_generic_extractor=False
-                )
-            except Exception as e:
-                logger.error('audio_url error "%s"', e)
-                self._audio_url.set(None)
-                return
+        with Entry.lock:
+            if AudioUrlCache.is_stale(self):
+                self._unset('audio_url')
+            added = self._pend(['audio_url'])
+            future = self._future('audio_url')
+        if added:
+            ThreadPool.run(self._resolve_audio_url, (future,),
+                           futures=(future,))
+        ThreadPool.claim(future)
+        return future
+
+    # resolves audio_url again in the background. The current url is returned
+    # by audio_url until the new one arrives
+    #
+    def refresh_audio_url(self):
+        ThreadPool.run(self._resolve_audio_url, (pykka.ThreadingFuture(),))
+
+    def _resolve_audio_url(self, future):
+        if ResolverProcesses.size > 0:
+            resolver = ResolverProcesses
+        else:
+            resolver = YoutubeDLPool
+        try:
+            with Metrics.timed('request_seconds',
+                               endpoint='youtube_dl.extract_info'):
+                url, expire = resolver.resolve(self.id)
+        except Exception as e:
+            logger.error('audio_url error "%s"', e)
+            url = expire = None
 
-            # return aac stream (.m4a) cause gstreamer 0.10 has issues with ogg
-            # containing opus format!
-            #  test id: cF9z1b5HL7M, playback gives error:
-            #   Could not find a audio/x-unknown decoder to handle media.
-            #   You might be able to fix this by running: gst-installer
-            #   "gstreamer|0.10|mopidy|audio/x-unknown
-            #   decoder|decoder-audio/x-unknown, codec-id=(string)A_OPUS"
-            #
-            self._audio_url.set(info['url'])
+        if url is None and future is not self._future('audio_url'):
+            # failed refresh, keep the current url for as long as it's valid
+            AudioUrlCache.refreshed(self, False)
+            return
 
-        ThreadPool.run(job)
+        with Entry.lock:
+            self._audio_url_expire = expire
+            self._set('audio_url', url, replace=True)
+        AudioUrlCache.refreshed(self, url is not None)
+        EntityStore.loaded([self], [])  # size has changed
 
     @property
     def is_video(self):
@@ -280,43 +678,52 @@ class Video(Entry):
 
 
 class Playlist(Entry):
+    __slots__ = ('_video_count', '_thumbnails', '_videos',
+                 '_videos_loaded', '_videos_arrived')
+
+    kind = 'playlist'
+    fields = ('title', 'channel', 'video_count', 'thumbnails', 'videos')
+
     # overridable by config
     max_videos = 60     # max number of videos per playlist
 
+    info_fields = ['title', 'video_count', 'thumbnails', 'channel']
+    search_fields = ['title', 'channel', 'thumbnails']
+    search_extra_fields = ['video_count']
+
     # loads title, thumbnails, video_count, channel of multiple playlists using
-    # one API call for every 50 lists. API calls are split in separate threads.
+    # one API call for every 50 lists (see Batcher). API calls are split in
+    # separate threads.
     #
     @classmethod
     def load_info(cls, list):
-        fields = ['title', 'video_count', 'thumbnails', 'channel']
-        list = cls._add_futures(list, fields)
+        list = cls._add_futures(list, cls.info_fields)
+        list = cls._load_cached(list, cls.info_fields)
+        Batcher.load(cls, list)
 
-        def job(sublist):
-            try:
-                if api_enabled:
-                    data = API.list_playlists([x.id for x in sublist])
-                else:
-                    data = scrAPI.list_playlists([x.id for x in sublist])
-                dict = {item['id']: item for item in data['items']}
-            except:
-                dict = {}
-
-            for pl in sublist:
-                pl._set_api_data(fields, dict.get(pl.id))
-
-        # 50 items at a time, make sure order is deterministic so that HTTP
-        # requests are replayable in tests
-        for i in range(0, len(list), 50):
-            sublist = list[i:i+50]
-            ThreadPool.run(job, (sublist,))
+    # returns (or yields) the records of the playlists with the given ids,
+    # called by Batcher
+    #
+    @classmethod
+    def _list(cls, ids):
+        # with scrAPI, items are yielded as the pages arrive
+        return fetch(API.list_playlists, scrAPI.iter_playlists, ids)
 
     # loads the list of videos of a playlist using one API call for every 50
     # fetched videos. For every page fetched, Video.load_info is called to
-    # start loading video info in a separate thread.
+    # start loading video info in a separate thread, so the info of one page
+    # is loaded while the next page is requested.
+    #
+    # The videos future is set when all pages have arrived. iter_videos()
+    # yields the videos page by page instead, as soon as each page arrives.
     #
     @async_property
     def videos(self):
-        self._videos = pykka.ThreadingFuture()
+        with Entry.lock:
+            if not self._pend(['videos']):
+                return
+            loaded = self._videos_loaded = []  # videos of the arrived pages
+            arrived = self._videos_arrived = threading.Condition()
 
         def job():
             all_videos = []
@@ -324,27 +731,63 @@ class Playlist(Entry):
             while page is not None and len(all_videos) < self.max_videos:
                 try:
                     max_results = min(self.max_videos - len(all_videos), 50)
-                    if api_enabled:
-                        data = API.list_playlistitems(self.id, page, max_results)
+                    if page:    # next page of the API
+                        items, page = API.list_playlistitems(
+                            self.id, page, max_results)
                     else:
-                        data = scrAPI.list_playlistitems(self.id, page, max_results)
+                        items, page = fetch(
+                            API.list_playlistitems, scrAPI.list_playlistitems,
+                            self.id, page, max_results)
                 except:
                     break
-                page = data.get('nextPageToken') or None
 
                 myvideos = []
-                for item in data['items']:
-                    video = Video.get(item['snippet']['resourceId']['videoId'])
+                for item in items:
+                    video = Video.get(item.id)
                     video._set_api_data(['title'], item)
                     myvideos.append(video)
                 all_videos += myvideos
+                Video._store(myvideos, ['title'])
 
                 # start loading video info for this batch in the background
                 Video.load_info(myvideos)
 
-            self._videos.set(all_videos)
+                with arrived:
+                    loaded.extend(myvideos)
+                    arrived.notify_all()
+
+            with arrived:
+                self._set('videos', all_videos)
+                arrived.notify_all()
+            with Entry.lock:
+                self._videos_loaded = self._videos_arrived = None
+            EntityStore.loaded([self], ['videos'])
 
-        ThreadPool.run(job)
+        ThreadPool.run(job, futures=self._futures([self], ['videos']))
+
+    # yields the videos of the playlist as their pages arrive
+    #
+    def iter_videos(self):
+        videos = self.videos    # start loading (or claim)
+        with Entry.lock:
+            loaded = getattr(self, '_videos_loaded', None)
+            arrived = getattr(self, '_videos_arrived', None)
+        if arrived is None:     # loaded already
+            for video in videos.get() or []:
+                yield video
+            return
+
+        i = 0
+        while True:
+            with arrived:
+                while i == len(loaded) and not self._is_loaded('videos'):
+                    arrived.wait()
+                page = loaded[i:]
+            if not page:
+                return
+            for video in page:
+                yield video
+            i += len(page)
 
     @async_property
     def video_count(self):
@@ -359,22 +802,722 @@ class Playlist(Entry):
         return False
 
 
+# youtube_dl.YoutubeDL instances for resolving audio urls. Creating an
+# instance sets up all extractors, a cookie jar and an HTTP opener, which
+# costs more than some resolutions themselves, so instances are kept and
+# reused. An instance is only used by one thread at a time: instance() takes
+# an idle one (or creates one) and puts it back afterwards. At most 'size'
+# idle instances are kept.
+#
+# The YouTube extractor caches the player JavaScript and the signature
+# functions derived from it (which change only when YouTube releases a new
+# player) per instance. All instances of the pool share these caches, and the
+# on-disk signature cache of youtube_dl goes to 'cachedir'.
+#
+class YoutubeDLPool:
+    params = {'format': 'm4a/vorbis/bestaudio/best'}
+
+    # overridable by config
+    size = 2
+    cachedir = None     # None for the default of youtube_dl
+
+    idle = []
+    code_cache = {}     # player id -> player JavaScript
+    player_cache = {}   # (player url, signature length) -> function
+    lock = threading.Lock()     # controls access to idle
+
+    @classmethod
+    def create(cls):
+        params = dict(cls.params)
+        if cls.cachedir is not None:
+            params['cachedir'] = cls.cachedir
+        ydl = youtube_dl.YoutubeDL(params)
+
+        ie = ydl.get_info_extractor('Youtube')
+        ie._code_cache = cls.code_cache
+        ie._player_cache = cls.player_cache
+        return ydl
+
+    # creates idle instances up to 'size', in advance of the first
+    # resolution
+    #
+    @classmethod
+    def warm(cls):
+        while len(cls.idle) < cls.size:
+            ydl = cls.create()
+            with cls.lock:
+                cls.idle.append(ydl)
+
+    # eg
+    #   with YoutubeDLPool.instance() as ydl:
+    #       ydl.extract_info(...)
+    #
+    @classmethod
+    @contextmanager
+    def instance(cls):
+        with cls.lock:
+            ydl = cls.idle.pop() if cls.idle else None
+        if ydl is None:
+            ydl = cls.create()
+        try:
+            yield ydl
+        finally:
+            with cls.lock:
+                if len(cls.idle) < cls.size:
+                    cls.idle.append(ydl)
+
+    # returns the audio url of video 'id', and the time it expires
+    #
+    @classmethod
+    def resolve(cls, id):
+        with cls.instance() as ydl:
+            url = cls.extract_url(ydl, id)
+        return url, AudioUrlCache.expiry(url)
+
+    @staticmethod
+    def extract_url(ydl, id):
+        info = ydl.extract_info(
+            url="https://www.youtube.com/watch?v=%s" % id,
+            download=False,
+            ie_key=None,
+            extra_info={},
+            process=True,
+            force_generic_extractor=False
+        )
+        # return aac stream (.m4a) cause gstreamer 0.10 has issues with
+        # ogg containing opus format!
+        #  test id: cF9z1b5HL7M, playback gives error:
+        #   Could not find a audio/x-unknown decoder to handle media.
+        #   You might be able to fix this by running: gst-installer
+        #   "gstreamer|0.10|mopidy|audio/x-unknown
+        #   decoder|decoder-audio/x-unknown, codec-id=(string)A_OPUS"
+        #
+        return info['url']
+
+
+# Worker processes resolving audio urls (see resolver.py), so that the CPU
+# heavy parts of youtube_dl (signature deciphering, JavaScript interpretation,
+# format selection) don't hold the GIL that Mopidy's core and frontends need.
+# A process resolves one url at a time, and hands back only the url and its
+# expiry time. At most 'size' processes run at once. They are started on
+# demand, kept in between, and replaced after 'recycle' urls, so that the
+# memory youtube_dl accumulates is given back. Processes are started afresh,
+# not forked from this (multi-threaded) process.
+#
+# If a process can't be used (it died, didn't answer within 'timeout'
+# seconds, ...) the url is resolved in the calling thread instead.
+#
+class ResolverProcesses:
+    # overridable by config, 0 to resolve in threads (see YoutubeDLPool)
+    size = 0
+    recycle = 100
+
+    timeout = 60
+    idle = []           # [process, number of urls resolved]
+    slots = None        # semaphore of 'size' processes, created on first use
+    lock = threading.Lock()     # controls access to idle and slots
+
+    @classmethod
+    def spawn(cls):
+        options = json.dumps({
+            'params': YoutubeDLPool.params,
+            'cachedir': YoutubeDLPool.cachedir,
+        })
+        return subprocess.Popen(
+            [sys.executable, '-m', 'mopidy_youtube.resolver', options],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+
+    @classmethod
+    def resolve(cls, id):
+        with cls.lock:
+            if cls.slots is None:
+                cls.slots = threading.Semaphore(cls.size)
+
+        with cls.slots:
+            with cls.lock:
+                worker = cls.idle.pop() if cls.idle else None
+            if worker is None:
+                worker = [cls.spawn(), 0]
+            process = worker[0]
+
+            try:
+                process.stdin.write(json.dumps({'id': id}) + '\n')
+                process.stdin.flush()
+                ready = select.select([process.stdout], [], [], cls.timeout)
+                line = process.stdout.readline() if ready[0] else ''
+            except (IOError, OSError):
+                line = ''
+
+            if not line:
+                cls.stop(process, kill=True)
+                logger.warning('youtube resolver process failed, resolving '
+                               '%s in this process', id)
+                return YoutubeDLPool.resolve(id)
+
+            worker[1] += 1
+            if worker[1] < cls.recycle:
+                with cls.lock:
+                    cls.idle.append(worker)
+            else:
+                cls.stop(process)
+
+        result = json.loads(line)
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        return result['url'], result['expire']
+
+    # stops 'process', which exits at the end of its input
+    #
+    @staticmethod
+    def stop(process, kill=False):
+        try:
+            process.stdin.close()
+            if kill and process.poll() is None:
+                process.kill()
+        except (IOError, OSError):
+            pass
+        process.wait()
+
+
+# Single-flight loading of video/playlist info, shared by all callers.
+# Video.load_info and Playlist.load_info don't fetch anything themselves, they
+# hand the objects that need info to Batcher.load. An id that is already
+# being fetched (or about to be) isn't requested again, the object just waits
+# for that fetch, even if it's a different object for the same video (eg.
+# when an object was created by Video() rather than Video.get()).
+#
+# New ids are collected for 'window' seconds, so that ids requested by
+# different callers at about the same time (search and lookup racing, several
+# clients looking up the same playlist) are merged into batches of up to
+# 'size' ids, one API request each. A full batch is sent right away.
+#
+# A batch is a ThreadPool job with the highest priority of its callers, and
+# the futures of every object waiting for it are linked to it, so claiming
+# any of them promotes the whole batch (see ThreadPool).
+#
+# The window adds at most a few milliseconds to a lone request, and saves a
+# request (and API quota) for every caller that joins a batch under load.
+# stats() tells how well that works: the number of batches sent, the number
+# of ids in them, how many were full, and how many objects joined an id that
+# was already on its way.
+#
+class Batcher:
+    size = 50           # max ids per API request
+
+    # overridable by config
+    window = 0.005      # seconds to wait for more ids
+
+    waiting = {}        # (kind, id) -> [job, objects waiting for the id]
+    queued = {}         # kind -> ids not sent yet
+    priorities = {}     # kind -> highest priority of the queued ids
+    timers = {}         # kind -> threading.Timer that sends the queued ids
+    lock = threading.Lock()     # controls access to all of the above
+
+    batches = 0
+    ids = 0
+    full = 0            # batches of 'size' ids
+    joined = 0          # objects that didn't need a request of their own
+
+    # starts loading the info_fields of 'objects', instances of 'entry_cls'
+    #
+    @classmethod
+    def load(cls, entry_cls, objects):
+        kind = entry_cls.kind
+        with cls.lock:
+            queued = cls.queued.setdefault(kind, [])
+            for obj in objects:
+                key = (kind, obj.id)
+                if key in cls.waiting:
+                    job, waiters = cls.waiting[key]
+                    waiters.append(obj)
+                    cls.joined += 1
+                    if job is not None:
+                        for future in entry_cls._futures(
+                                [obj], entry_cls.info_fields):
+                            future.job = job
+                else:
+                    cls.waiting[key] = [None, [obj]]
+                    queued.append(obj.id)
+
+            if not queued:
+                return
+
+            priority = ThreadPool.current_priority()
+            cls.priorities[kind] = min(
+                cls.priorities.get(kind, priority), priority)
+
+            while len(queued) >= cls.size:
+                ids = queued[:cls.size]
+                del queued[:cls.size]
+                cls._send(entry_cls, ids)
+
+            if queued and cls.window <= 0:
+                ids = queued[:]
+                del queued[:]
+                cls._send(entry_cls, ids)
+
+            # the next batch starts over, at the priority of its own callers
+            if not queued:
+                del cls.priorities[kind]
+            elif kind not in cls.timers:
+                timer = threading.Timer(cls.window, cls._flush, (entry_cls,))
+                timer.daemon = True
+                cls.timers[kind] = timer
+                timer.start()
+
+    # sends whatever ids are queued, when the window has passed
+    #
+    @classmethod
+    def _flush(cls, entry_cls):
+        kind = entry_cls.kind
+        with cls.lock:
+            del cls.timers[kind]
+            queued = cls.queued.get(kind, [])
+            try:
+                for i in range(0, len(queued), cls.size):
+                    cls._send(entry_cls, queued[i:i+cls.size])
+            finally:
+                # a failed batch must not keep its ids queued forever
+                del queued[:]
+                cls.priorities.pop(kind, None)
+
+    # queues the job fetching 'ids', leaving out those that nobody waits for
+    # anymore. Called with lock held.
+    #
+    @classmethod
+    def _send(cls, entry_cls, ids):
+        kind = entry_cls.kind
+        ids = [id for id in ids if (kind, id) in cls.waiting]
+        if not ids:
+            return
+
+        futures = []
+        for id in ids:
+            futures += entry_cls._futures(
+                cls.waiting[(kind, id)][1], entry_cls.info_fields)
+
+        priority = cls.priorities[kind]
+        job = ThreadPool.run(cls._fetch, (entry_cls, ids),
+                             priority=priority, futures=futures)
+        for id in ids:
+            cls.waiting[(kind, id)][0] = job
+
+        cls.batches += 1
+        cls.ids += len(ids)
+        if len(ids) == cls.size:
+            cls.full += 1
+        logger.debug('youtube: %s batch of %d ids (%.1f on average)',
+                     kind, len(ids), float(cls.ids) / cls.batches)
+
+    @classmethod
+    def stats(cls):
+        with cls.lock:
+            return {
+                'batches': cls.batches,
+                'ids': cls.ids,
+                'full': cls.full,
+                'joined': cls.joined,
+                'average': float(cls.ids) / cls.batches if cls.batches else 0,
+            }
+
+    @classmethod
+    def _fetch(cls, entry_cls, ids):
+        kind = entry_cls.kind
+        fields = entry_cls.info_fields
+        loaded = []
+        batch = set(ids)
+
+        # an id is done once: if it's requested again while this batch is
+        # still running, the new request waits for a batch of its own
+        def done(id, item):
+            if id not in batch:
+                return  # not asked for, or delivered already
+            batch.discard(id)
+            with cls.lock:
+                job, objects = cls.waiting.pop((kind, id), (None, []))
+            for obj in objects:
+                obj._set_api_data(fields, item)
+            loaded.extend(objects)
+
+        try:
+            for item in entry_cls._list(ids):
+                done(item.id, item)
+        except Exception as e:
+            logger.error('youtube %s info error "%s"', kind, e)
+
+        for id in ids:
+            done(id, None)  # not found (a no-op for delivered ids)
+        entry_cls._store(loaded, fields)
+
+
+# Stream urls returned by youtube_dl are signed, and stop working after a few
+# hours. The expiry time is part of the url, in the 'expire' query parameter
+# (or an /expire/<time>/ path segment for manifest urls), and is stored with
+# the resolved url (Video._audio_url_expire). A url that is about to expire is
+# stale, and Video.audio_url resolves it again instead of handing it to
+# GStreamer.
+#
+# Queued videos (the next few tracks of the tracklist, see YouTubeFrontend)
+# are kept fresh by a background thread, which re-resolves their urls shortly
+# before they expire, so that playback never has to wait for youtube_dl. Like
+# the ThreadPool threads, the refresher thread only lives while there are
+# queued videos.
+#
+class AudioUrlCache:
+    refresh_margin = 900    # re-resolve queued urls 15 minutes before expiry
+    stale_margin = 60       # don't hand out urls that expire within a minute
+    lifetime = 6 * 3600     # if a url has no expiry time
+
+    queued = {}             # video id -> Video
+    refreshing = set()      # ids of videos being re-resolved
+    lock = threading.Lock()     # controls access to queued and refreshing
+    wakeup = threading.Condition(lock)
+    refresher = None
+
+    # returns the time the given stream url expires
+    #
+    @classmethod
+    def expiry(cls, url):
+        if url is None:
+            return None
+
+        url = urlparse(url)
+        expire = parse_qs(url.query).get('expire')
+        if expire:
+            expire = expire[0]
+        else:
+            m = re.search('/expire/(\d+)', url.path)
+            expire = m and m.group(1)
+
+        try:
+            return int(expire)
+        except (TypeError, ValueError):
+            return time.time() + cls.lifetime
+
+    @classmethod
+    def is_stale(cls, video):
+        expire = getattr(video, '_audio_url_expire', None)
+        return expire is not None and time.time() > expire - cls.stale_margin
+
+    # starts resolving audio_url of the given videos, and keeps them fresh
+    # until they are unqueued
+    #
+    @classmethod
+    def queue(cls, videos):
+        for video in videos:
+            video.audio_url     # start loading
+
+        with cls.lock:
+            cls.queued.update((video.id, video) for video in videos)
+            if cls.refresher is None:
+                cls.refresher = threading.Thread(target=cls._refresh)
+                cls.refresher.daemon = True
+                cls.refresher.start()
+            cls.wakeup.notify()
+
+    @classmethod
+    def unqueue(cls, videos):
+        with cls.lock:
+            for video in videos:
+                cls.queued.pop(video.id, None)
+            cls.wakeup.notify()
+
+    # makes 'videos' the queued videos (see YouTubeFrontend): starts
+    # resolving the new ones, and unqueues the others, cancelling their
+    # resolution if it hasn't started yet
+    #
+    @classmethod
+    def keep(cls, videos):
+        ids = set(video.id for video in videos)
+        with cls.lock:
+            dropped = [v for id, v in cls.queued.items() if id not in ids]
+        cls.unqueue(dropped)
+
+        for video in dropped:
+            future = video._future('audio_url')
+            if future is not None:
+                ThreadPool.discard(future)
+        cls.queue(videos)
+
+    # called by Video._resolve_audio_url when a url has been (re-)resolved.
+    # Videos that can't be resolved anymore are unqueued, otherwise the
+    # refresher would try again and again.
+    #
+    @classmethod
+    def refreshed(cls, video, ok):
+        with cls.lock:
+            cls.refreshing.discard(video.id)
+            if not ok:
+                cls.queued.pop(video.id, None)
+            cls.wakeup.notify()
+
+    @classmethod
+    def _refresh(cls):
+        with cls.lock:
+            while cls.queued:
+                now = time.time()
+                timeout = cls.refresh_margin
+                for id, video in cls.queued.items():
+                    expire = getattr(video, '_audio_url_expire', None)
+                    if expire is None or id in cls.refreshing:
+                        continue    # not resolved yet / being re-resolved
+                    refresh_at = expire - cls.refresh_margin
+                    if refresh_at <= now:
+                        cls.refreshing.add(id)
+                        video.refresh_audio_url()
+                    else:
+                        timeout = min(timeout, refresh_at - now)
+                cls.wakeup.wait(timeout)
+
+            cls.refresher = None
+
+
+# Cache of search results (the records returned by API.search/scrAPI.search)
+# in front of Entry.search. MPD clients tend to send the same search several
+# times in a row (while typing, when refreshing), which would cost a request
+# to YouTube (and API quota) every time.
+#
+# Queries are normalized before they are looked up, so that queries which
+# differ only in case, whitespace or Unicode representation share an entry.
+# Entries expire after 'ttl' seconds, and at most 'size' of them are kept
+# (least recently used are dropped first).
+#
+# Identical searches that arrive while the first one is still in progress
+# don't start a request of their own, they wait for the first one and share
+# its result (or its error). Failed searches are not cached.
+#
+class SearchCache:
+    # overridable by config
+    ttl = 300
+    size = 100
+
+    cache = None            # created on first use, with ttl/size above
+    pending = {}            # key -> [event, result, exc_info]
+    lock = threading.Lock()     # controls access to cache, pending, counters
+
+    hits = 0
+    misses = 0
+    coalesced = 0           # misses that waited for a search in progress
+
+    @classmethod
+    def key(cls, q):
+        if isinstance(q, bytes):
+            q = q.decode('utf-8', 'replace')
+        q = unicodedata.normalize('NFKC', q)
+        return ' '.join(q.lower().split())
+
+    # returns the result of fetch(q), from the cache if possible
+    #
+    @classmethod
+    def search(cls, q, fetch):
+        key = cls.key(q)
+        with cls.lock:
+            if cls.cache is None:
+                cls.cache = TTLCache(
+                    maxsize=max(cls.size, 1), ttl=max(cls.ttl, 0))
+            result = cls.cache.get(key)
+            if result is not None:
+                cls.hits += 1
+                return result
+
+            cls.misses += 1
+            call = cls.pending.get(key)
+            if call is None:
+                call = cls.pending[key] = [threading.Event(), None, None]
+                owner = True
+            else:
+                cls.coalesced += 1
+                owner = False
+
+        if not owner:
+            call[0].wait()
+            if call[2]:
+                raise call[2][0], call[2][1], call[2][2]
+            return call[1]
+
+        try:
+            call[1] = fetch(q)
+        except Exception:
+            call[2] = sys.exc_info()
+            raise
+        finally:
+            with cls.lock:
+                del cls.pending[key]
+                if call[2] is None and cls.size > 0 and cls.ttl > 0:
+                    cls.cache[key] = call[1]
+            call[0].set()
+        return call[1]
+
+    @classmethod
+    def stats(cls):
+        with cls.lock:
+            return {
+                'hits': cls.hits,
+                'misses': cls.misses,
+                'coalesced': cls.coalesced,
+                'entries': len(cls.cache) if cls.cache is not None else 0,
+            }
+
+
+# raised by API when it's out of quota, or backing off. The data are loaded
+# with scrAPI instead (see fetch)
+#
+class QuotaExceeded(Exception):
+    pass
+
+
+# Quota of the YouTube Data API. Every request costs units (search 100,
+# videos/playlists/playlistItems 1), and there are 'daily' units per day
+# (https://developers.google.com/youtube/v3/determine_quota_cost). The units
+# are kept in a token bucket holding up to 'daily' units, which refills at
+# 'daily' units per 24 hours, so a day's quota can be spent at once but not
+# more. A request that the bucket can't pay for isn't sent.
+#
+# When YouTube says the quota is exceeded anyway (shared key, ...) the API
+# isn't used until the quota is reset, at midnight Pacific Time. When it
+# rate limits us (429, 403 rateLimitExceeded) or has errors (5xx), the API
+# isn't used for a jittered, exponentially growing time, which goes back to
+# zero after the first successful request. Meanwhile, data are loaded with
+# scrAPI (see fetch), so that searches keep working.
+#
+class Quota:
+    costs = {'search': 100}     # other endpoints cost 1
+
+    # overridable by config, 0 to not count units
+    daily = 10000
+
+    backoff_base = 1.0      # seconds
+    backoff_max = 300.0
+    exhausted_reasons = ('quotaExceeded', 'dailyLimitExceeded')
+    throttled_reasons = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+    tokens = None           # units left, None until the first request
+    updated = 0             # when tokens were last refilled
+    failures = 0            # throttled requests since the last success
+    blocked_until = 0       # the API isn't used before this time
+    lock = threading.Lock()     # controls access to all of the above
+
+    # takes the units 'endpoint' costs from the bucket, raises QuotaExceeded
+    # if the API may not be used now
+    #
+    @classmethod
+    def take(cls, endpoint):
+        cost = cls.costs.get(endpoint, 1)
+        now = time.time()
+        with cls.lock:
+            if now < cls.blocked_until:
+                raise QuotaExceeded('backing off')
+            if cls.daily <= 0:
+                return
+
+            if cls.tokens is None:
+                cls.tokens = cls.daily
+            else:
+                cls.tokens = min(cls.daily, cls.tokens +
+                                 (now - cls.updated) * cls.daily / 86400.0)
+            cls.updated = now
+            if cls.tokens < cost:
+                raise QuotaExceeded('%d units left' % cls.tokens)
+            cls.tokens -= cost
+
+    @classmethod
+    def succeeded(cls):
+        with cls.lock:
+            cls.failures = 0
+
+    # called for a response that says the API may not be used for a while
+    #
+    @classmethod
+    def throttle(cls, status, reason):
+        now = time.time()
+        with cls.lock:
+            if reason in cls.exhausted_reasons:
+                cls.tokens = 0
+                cls.blocked_until = cls.reset_time(now)
+            else:
+                cls.failures += 1
+                delay = min(cls.backoff_max,
+                            cls.backoff_base * 2 ** (cls.failures - 1))
+                cls.blocked_until = now + random.uniform(delay / 2, delay)
+            blocked = cls.blocked_until - now
+
+        Metrics.count('api_throttled_total', status=status, reason=reason)
+        logger.warning('YouTube API %s (%s), using the scraper for %d s',
+                       status, reason, blocked)
+
+    # the next midnight Pacific Time (ignoring daylight saving time), when
+    # the quota is reset
+    #
+    @staticmethod
+    def reset_time(now):
+        day = 86400
+        offset = 8 * 3600
+        return (now - offset) // day * day + day + offset
+
+    # returns the reason of an error response, eg. 'quotaExceeded'
+    #
+    @staticmethod
+    def reason(result):
+        try:
+            return result.json()['error']['errors'][0]['reason']
+        except Exception:
+            return None
+
+    # gauges for metrics.py
+    #
+    @classmethod
+    def metrics(cls):
+        with cls.lock:
+            if cls.tokens is not None:
+                yield 'api_quota_units', 'gauge', {}, int(cls.tokens)
+            yield 'api_blocked_seconds', 'gauge', {}, \
+                max(0, cls.blocked_until - time.time())
+
+
+# returns api(*args) if the API is enabled and may be used, scraper(*args)
+# otherwise, eg.
+#   fetch(API.list_videos, scrAPI.iter_videos, ids)
+#
+def fetch(api, scraper, *args):
+    if api_enabled:
+        try:
+            return api(*args)
+        except QuotaExceeded:
+            Metrics.count('api_fallbacks_total', endpoint=api.__name__)
+    return scraper(*args)
+
+
 # Direct access to YouTube Data API
 # https://developers.google.com/youtube/v3/docs/
 #
 class API:
     endpoint = 'https://www.googleapis.com/youtube/v3/'
-    session = get_requests_session(
-        proxy_config=config['proxy'],
-        user_agent='%s/%s' % (
-            mopidy_youtube.Extension.dist_name,
-            mopidy_youtube.Extension.version)
-        )
+
+    # overridable by config (with proxy settings)
+    session = get_requests_session(proxy_config={}, user_agent=user_agent)
 
     # overridable by config
     search_results = 15
     key = 'none'
 
+    # sends a request to 'endpoint' (if the quota allows it), returns the
+    # decoded response
+    #
+    @classmethod
+    def _get(cls, endpoint, query):
+        Quota.take(endpoint)
+        with Metrics.timed('request_seconds', endpoint='api.' + endpoint):
+            result = cls.session.get(cls.endpoint + endpoint, params=query)
+
+        reason = Quota.reason(result) if result.status_code >= 400 else None
+        if result.status_code == 429 or result.status_code >= 500 or \
+                reason in Quota.exhausted_reasons + Quota.throttled_reasons:
+            Quota.throttle(result.status_code, reason)
+            raise QuotaExceeded(reason or result.status_code)
+        result.raise_for_status()
+        Quota.succeeded()
+        return result.json()
+
     # search for both videos and playlists using a single API call
     # https://developers.google.com/youtube/v3/docs/search
     #
@@ -388,8 +1531,13 @@ class API:
             'q': q,
             'key': API.key
         }
-        result = API.session.get(API.endpoint+'search', params=query)
-        return result.json()
+        data = cls._get('search', query)
+        return [
+            VideoData.from_api(item)
+            if item['id']['kind'] == 'youtube#video'
+            else PlaylistData.from_api(item)
+            for item in data['items']
+        ]
 
     # list videos
     # https://developers.google.com/youtube/v3/docs/videos/list
@@ -402,8 +1550,8 @@ class API:
             'id': ','.join(ids),
             'key': API.key
         }
-        result = API.session.get(API.endpoint+'videos', params=query)
-        return result.json()
+        data = cls._get('videos', query)
+        return map(VideoData.from_api, data['items'])
 
     # list playlists
     # https://developers.google.com/youtube/v3/docs/playlists/list
@@ -416,8 +1564,8 @@ class API:
             'id': ','.join(ids),
             'key': API.key
         }
-        result = API.session.get(API.endpoint+'playlists', params=query)
-        return result.json()
+        data = cls._get('playlists', query)
+        return map(PlaylistData.from_api, data['items'])
 
     # list playlist items
     # https://developers.google.com/youtube/v3/docs/playlistItems/list
@@ -432,20 +1580,26 @@ class API:
             'key': API.key,
             'pageToken': page,
         }
-        result = API.session.get(API.endpoint+'playlistItems', params=query)
-        return result.json()
+        data = cls._get('playlistItems', query)
+        items = map(VideoData.from_api, data['items'])
+        return items, data.get('nextPageToken') or None
 
 # Indirect access to YouTube data, without API
 #
 class scrAPI:
     endpoint = 'https://www.youtube.com/'
 
+    # overridable by config (with proxy settings). scrAPI needs one page per
+    # video/playlist, which are fetched over this many connections at once
+    connections = 8
     session = get_requests_session(
-        proxy_config=config['proxy'],
-        user_agent='%s/%s' % (
-            mopidy_youtube.Extension.dist_name,
-            mopidy_youtube.Extension.version)
-        )
+        proxy_config={}, user_agent=user_agent, pool_size=connections)
+
+    # overridable by config, see extractors.py
+    extractor = JSONExtractor
+
+    # bytes read from the network at once by _stream
+    chunk_size = 16384
 
     # search for videos and playlists
     #
@@ -457,122 +1611,113 @@ class scrAPI:
             'search_query': q.replace(' ','+')
         }
 
-        result = scrAPI.session.get(scrAPI.endpoint+'results', params=query)
-        regex = r'(?:video-count.*<b>(?:(?P<itemCount>[0-9]+)</b>)?(.|\n)*?)?<a href="/watch\?v=(?P<id>.{11})(?:&amp;list=(?P<playlist>PL.{32}))?" class=".*?" data-sessionlink=".*?"  title="(?P<title>.+?)" .+?((?:Duration: (?:(?P<durationHours>[0-9]+):)?(?P<durationMinutes>[0-9]+):(?P<durationSeconds>[0-9]{2}).</span>.*?)?<a href="(?P<uploaderUrl>/(?:user|channel)/[^"]+)"[^>]+>(?P<uploader>.*?)</a>.*?class="(yt-lockup-description|yt-uix-sessionlink)[^>]*>(?P<description>.*?))?</div>'
-        items = []
-
-        for match in re.finditer(regex, result.text):
-            duration = ''
-            if match.group('durationHours') != None:
-                duration += match.group('durationHours')+'H'
-            if match.group('durationMinutes') != None:
-                duration += match.group('durationMinutes')+'M'
-            if match.group('durationSeconds') != None:
-                duration += match.group('durationSeconds')+'S'
-            if match.group('playlist') != None:
-                item = {
-                    'id': {
-                      'kind': 'youtube#playlist',
-                      'playlistId': match.group('playlist')
-                    },
-                }
-            else:
-                item = {
-                    'id': {
-                      'kind': 'youtube#video',
-                      'videoId': match.group('id')
-                    },
-                }
-            if duration != '':
-                item.update ({
-                    'contentDetails': {
-                        'duration': 'PT'+duration,
-                    },
-                })
-            if match.group('itemCount') != None:
-                item.update ({
-                    'contentDetails': {
-                        'itemCount': match.group('itemCount'),
-                    },
-                })
-            item.update ({
-                'snippet': {
-                      'title': match.group('title'),
-                      # TODO: full support for thumbnails
-                      'thumbnails': {
-                          'default': {
-                              'url': 'https://i.ytimg.com/vi/'+match.group('id')+'/default.jpg',
-                              'width': 120,
-                              'height': 90,
-                          },
-                      },
-                      'channelTitle': match.group('uploader'),
-                },
-            })
-            items.append(item)
-        return json.loads(json.dumps({'items': items}, sort_keys=False, indent=1))
+        return cls._stream_items(cls.extractor.search_stream, 'results',
+                                 query, API.search_results)
+
+    # returns the first 'count' records extractor method 'f' finds in a page,
+    # which is parsed while it's downloaded, and no longer read once they
+    # are found
+    #
+    @classmethod
+    def _stream_items(cls, f, path, query, count):
+        chunks = cls._stream(path, query)
+        try:
+            return list(islice(f(chunks), count))
+        finally:
+            chunks.close()
+
+    # yields the text of a page in chunks, as it arrives. request_seconds is
+    # the time until the headers arrived, the bytes read are counted in
+    # scraper_bytes_total. The fetch engine (see engine.py) doesn't stream,
+    # the whole page is a single chunk
+    #
+    @classmethod
+    def _stream(cls, path, query):
+        url = scrAPI.endpoint + path
+        endpoint = 'scrapi.' + path
+
+        if isinstance(scrAPI.session, EngineSession):
+            with Metrics.timed('request_seconds', endpoint=endpoint):
+                result = scrAPI.session.get(url, params=query)
+            yield result.text
+            return
+
+        with Metrics.timed('request_seconds', endpoint=endpoint):
+            result = scrAPI.session.get(url, params=query, stream=True)
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        try:
+            for chunk in result.iter_content(cls.chunk_size):
+                Metrics.count('scraper_bytes_total', len(chunk),
+                              endpoint=endpoint)
+                yield decoder.decode(chunk)
+            yield decoder.decode(b'', True)
+        finally:
+            result.close()
 
     # list videos
     # 
     @classmethod
     def list_videos(cls, ids):
+        return list(cls.iter_videos(ids))
 
-        regex = r'<div id="watch7-content"(?:.|\n)*?<meta itemprop="name" content="(?P<title>.*?)(?:">)(?:.|\n)*?<meta itemprop="duration" content="(?P<duration>.*?)(?:">)(?:.|\n)*?<link itemprop="url" href="http://www.youtube.com/(?:user|channel)/(?P<channelTitle>.*?)(?:">)(?:.|\n)*?</div>'
-        items = []
-        
-        for id in ids:
-            query = {
-                'v': id,
-            }
-            result = scrAPI.session.get(scrAPI.endpoint+'watch', params=query)
-            for match in re.finditer(regex, result.text):
-                item = {
-                    'id': id,
-                    'snippet': {
-                        'title': match.group('title'),
-                        'channelTitle': match.group('channelTitle'),
-                    },
-                    'contentDetails': {
-                        'duration': match.group('duration'),
-                    }
-                }
-                items.append(item)
-        return json.loads(json.dumps({'items': items}, sort_keys=False, indent=1))
+    # yields the items of list_videos as soon as their pages arrive
+    #
+    @classmethod
+    def iter_videos(cls, ids):
+        for id, text in cls._pages('watch', 'v', ids):
+            for item in cls._extract(cls.extractor.video, text, id):
+                yield item
+
+    # yields (id, page text) for the pages of the given ids, as soon as they
+    # arrive (None if a page couldn't be fetched). Pages are fetched
+    # concurrently, over at most 'connections' connections, or all at once
+    # if the session is the fetch engine (see engine.py)
+    #
+    @classmethod
+    def _pages(cls, path, param, ids):
+        url = scrAPI.endpoint + path
+        endpoint = 'scrapi.' + path
+
+        if isinstance(scrAPI.session, EngineSession):
+            queries = [{param: id} for id in ids]
+            for query, result in scrAPI.session.get_many(
+                    url, queries, endpoint):
+                yield query[param], result.text if result else None
+            return
+
+        def get(id):
+            with Metrics.timed('request_seconds', endpoint=endpoint):
+                return scrAPI.session.get(url, params={param: id}).text
+
+        for id, text in fan_out(get, ids, cls.connections):
+            yield id, text
+
+    # returns the records extractor method 'f' finds in the page of 'id'
+    #
+    @classmethod
+    def _extract(cls, f, text, id):
+        if text is None:
+            return []
+        try:
+            return list(f(text, id))
+        except Exception as e:
+            logger.error('youtube fetch error "%s"', e)
+            return []
 
     # list playlists
     # 
     @classmethod
     def list_playlists(cls, ids):
+        return list(cls.iter_playlists(ids))
 
-        regex = r'<div id="pl-header"(?:.|\n)*?"(?P<thumbnail>https://i\.ytimg\.com\/vi\/.{11}/).*?\.jpg(?:(.|\n))*?(?:.|\n)*?class="pl-header-title"(?:.|\n)*?\>\s*(?P<title>.*)(?:.|\n)*?<a href="/(user|channel)/(?:.|\n)*? >(?P<channelTitle>.*?)</a>(?:.|\n)*?(?P<itemCount>\d*) videos</li>'
-        items = []
+    # yields the items of list_playlists as soon as their pages arrive
+    #
+    @classmethod
+    def iter_playlists(cls, ids):
+        for id, text in cls._pages('playlist', 'list', ids):
+            for item in cls._extract(cls.extractor.playlist, text, id):
+                yield item
 
-        for id in ids:
-            query = {
-                'list': id,
-            }
-            result = scrAPI.session.get(scrAPI.endpoint+'playlist', params=query)
-            for match in re.finditer(regex, result.text):
-                item = {
-                    'id': id,
-                    'snippet': {
-                        'title': match.group('title'),
-                        'channelTitle': match.group('channelTitle'),
-                        'thumbnails': {
-                            'default': {
-                                'url': match.group('thumbnail')+'default.jpg',
-                                'width': 120,
-                                'height': 90,
-                            },
-                        },
-                    },
-                    'contentDetails': {
-                        'itemCount': match.group('itemCount'),
-                    }
-                }
-                items.append(item)
-        return json.loads(json.dumps({'items': items}, sort_keys=False, indent=1))
-        
     # list playlist items
     # 
     @classmethod
@@ -582,56 +1727,130 @@ class scrAPI:
             'list': id
         }
 
-        result = scrAPI.session.get(scrAPI.endpoint+'playlist', params=query)
-        regex = r'" data-title="(?P<title>.+?)".*?<a href="/watch\?v=(?P<id>.{11})\&amp;'
-        items = []
-
-        for match in islice(re.finditer(regex, result.text), max_results):
-            item = {
-                'snippet': {
-                    'resourceId': {
-                        'videoId': match.group('id'),
-                        },
-                    'title' : match.group('title'),
-                },
-            }
-            items.append(item)
-        return json.loads(json.dumps({'nextPageToken': None, 'items': items}, sort_keys=False, indent=1))
+        items = cls._stream_items(cls.extractor.playlistitems_stream,
+                                  'playlist', query, max_results)
+        return items, None  # no paging, all items are on a single page
+
+
+# A job submitted to the ThreadPool
+#
+class Job(object):
+    QUEUED, RUNNING, DONE, CANCELLED = range(4)
+
+    def __init__(self, f, args, priority):
+        self.f = f
+        self.args = args
+        self.priority = priority
+        self.state = Job.QUEUED
+        self.queued = None  # when it was queued, for the job_wait metric
+        self.claimed = False    # someone waits for its futures
+
 
 # simple 'dynamic' thread pool. Threads are created when new jobs arrive, stay
 # active for as long as there are active jobs, and get destroyed afterwards
 # (so that there are no long-term threads staying active)
 #
+# Jobs are queued in three priority classes, so that resolving the url of the
+# track that is about to play doesn't wait behind the background loading
+# started by search. Jobs run in FIFO order within a class, and every class has
+# a limit of threads that may work on it at once, so that eg. prefetch jobs
+# can't occupy all threads. Jobs get the priority of the thread submitting them
+# (see ThreadPool.priority), so jobs started by a prefetch job are prefetch
+# jobs too.
+#
+# Futures passed to run() are linked to their job, and accessing such a future
+# through a property (see async_property) claims it: the job is moved up to
+# the priority of the caller. Queued prefetch jobs of a search are cancelled
+# when the next search arrives. A cancelled job leaves its futures unset, and
+# is only queued again if one of them is claimed, so nobody waits forever for
+# a cancelled job.
+#
 class ThreadPool:
+    PLAYBACK = 0    # resolving audio_url for playback
+    LOOKUP = 1      # loading data the user is waiting for
+    PREFETCH = 2    # loading data in the background, in case it's needed
+    names = {PLAYBACK: 'playback', LOOKUP: 'lookup', PREFETCH: 'prefetch'}
+
+    # overridable by config
     threads_max = 2
+    limits = {PLAYBACK: 2, LOOKUP: 2, PREFETCH: 1}
+
     threads_active = 0
-    jobs = []
+    running = {PLAYBACK: 0, LOOKUP: 0, PREFETCH: 0}
+    jobs = {PLAYBACK: deque(), LOOKUP: deque(), PREFETCH: deque()}
     lock = threading.Lock()     # controls access to threads_active and jobs
 
+    local = threading.local()   # priority of the current thread
+
+    @classmethod
+    def current_priority(cls):
+        return getattr(cls.local, 'priority', cls.LOOKUP)
+
+    # runs the enclosed block with the given priority, eg
+    #   with ThreadPool.priority(ThreadPool.PREFETCH):
+    #       Video.load_info(videos)
+    #
+    @classmethod
+    @contextmanager
+    def priority(cls, priority):
+        previous = cls.current_priority()
+        cls.local.priority = priority
+        try:
+            yield
+        finally:
+            cls.local.priority = previous
+
+    # returns the next job to run, ie. the oldest job of the highest priority
+    # class that isn't at its limit. Called with lock held.
+    #
+    @classmethod
+    def _next_job(cls):
+        for priority in sorted(cls.jobs):
+            if cls.jobs[priority] and \
+                    cls.running[priority] < cls.limits[priority]:
+                job = cls.jobs[priority].popleft()
+                job.state = Job.RUNNING
+                cls.running[priority] += 1
+                return job
+        return None
+
     @classmethod
     def worker(cls):
         while True:
             cls.lock.acquire()
-            if len(cls.jobs):
-                f, args = cls.jobs.pop()
-            else:
-                # no more jobs, exit thread
+            job = cls._next_job()
+            if job is None:
+                # no more jobs (that we may run), exit thread
                 cls.threads_active -= 1
                 cls.lock.release()
                 break
             cls.lock.release()
 
+            name = cls.names[job.priority]
+            start = time.time()
+            Metrics.observe('job_wait_seconds', start - job.queued,
+                            priority=name)
+            cls.local.priority = job.priority
             try:
-                apply(f, args)
+                apply(job.f, job.args)
             except Exception as e:
                 logger.error('youtube thread error: %s\n%s',
                              e, traceback.format_exc())
+            Metrics.count('thread_busy_seconds_total', time.time() - start,
+                          priority=name)
 
-    @classmethod
-    def run(cls, f, args=()):
-        cls.lock.acquire()
+            cls.lock.acquire()
+            job.state = Job.DONE
+            cls.running[job.priority] -= 1
+            cls.lock.release()
 
-        cls.jobs.append((f, args))
+    # queues 'job', and starts a new thread if allowed. Called with lock held.
+    #
+    @classmethod
+    def _queue(cls, job):
+        job.state = Job.QUEUED
+        job.queued = time.time()
+        cls.jobs[job.priority].append(job)
 
         if cls.threads_active < cls.threads_max:
             thread = threading.Thread(target=cls.worker)
@@ -639,4 +1858,105 @@ class ThreadPool:
             thread.start()
             cls.threads_active += 1
 
+    @classmethod
+    def run(cls, f, args=(), priority=None, futures=()):
+        if priority is None:
+            priority = cls.current_priority()
+        job = Job(f, args, priority)
+        for future in futures:
+            future.job = job
+
+        cls.lock.acquire()
+        cls._queue(job)
         cls.lock.release()
+        return job
+
+    # called when someone is about to wait for 'future', promotes the job
+    # that will set it, or queues it again if it was cancelled
+    #
+    @classmethod
+    def claim(cls, future):
+        job = getattr(future, 'job', None)
+        if job is None or job.state in (Job.RUNNING, Job.DONE):
+            return
+
+        priority = min(cls.current_priority(), cls.LOOKUP)
+        with cls.lock:
+            job.claimed = True
+            if job.state == Job.CANCELLED:
+                job.priority = priority
+                cls._queue(job)
+            elif job.state == Job.QUEUED and job.priority > priority:
+                cls.jobs[job.priority].remove(job)
+                job.priority = priority
+                cls._queue(job)
+
+    # cancels the job that will set 'future', if it hasn't started yet and
+    # nobody has claimed it (they would wait forever). As with cancel(),
+    # claiming the future queues it again
+    #
+    @classmethod
+    def discard(cls, future):
+        job = getattr(future, 'job', None)
+        if job is None:
+            return
+
+        with cls.lock:
+            if job.state == Job.QUEUED and not job.claimed:
+                cls.jobs[job.priority].remove(job)
+                job.state = Job.CANCELLED
+
+    # cancels all queued jobs of the given priority class
+    #
+    @classmethod
+    def cancel(cls, priority):
+        with cls.lock:
+            for job in cls.jobs[priority]:
+                job.state = Job.CANCELLED
+            if cls.jobs[priority]:
+                logger.debug('youtube: cancelled %d jobs',
+                             len(cls.jobs[priority]))
+            cls.jobs[priority].clear()
+
+    # gauges of the queues and threads, see metrics.py
+    #
+    @classmethod
+    def metrics(cls):
+        with cls.lock:
+            yield 'threads_active', 'gauge', {}, cls.threads_active
+            yield 'threads_max', 'gauge', {}, cls.threads_max
+            for priority, name in cls.names.items():
+                labels = {'priority': name}
+                yield 'jobs_queued', 'gauge', labels, len(cls.jobs[priority])
+                yield 'jobs_running', 'gauge', labels, cls.running[priority]
+
+
+# hits and misses of the caches, see metrics.py
+#
+def cache_metrics():
+    search = SearchCache.stats()
+    entities = EntityStore.stats()
+    disk = DiskCache.stats()
+    batches = Batcher.stats()
+    for cache, hits, misses in [
+            ('search', search['hits'] + search['coalesced'], search['misses']),
+            ('entities', entities['hits'] + entities['revived'],
+             entities['misses']),
+            ('disk', disk['hits'], disk['misses'])]:
+        labels = {'cache': cache}
+        yield 'cache_hits_total', 'counter', labels, hits
+        yield 'cache_misses_total', 'counter', labels, misses
+        yield 'cache_hit_ratio', 'gauge', labels, \
+            float(hits) / (hits + misses) if hits + misses else 0.0
+    yield 'cache_entries', 'gauge', {'cache': 'search'}, search['entries']
+    yield 'cache_entries', 'gauge', {'cache': 'entities'}, entities['entries']
+    yield 'cache_entries', 'gauge', {'cache': 'disk'}, disk['entries']
+    yield 'cache_bytes', 'gauge', {'cache': 'entities'}, entities['bytes']
+    yield 'cache_evictions_total', 'counter', {'cache': 'entities'}, \
+        entities['evictions']
+    yield 'batches_total', 'counter', {}, batches['batches']
+    yield 'batched_ids_total', 'counter', {}, batches['ids']
+
+
+Metrics.collectors.extend([ThreadPool.metrics, cache_metrics,
+                           Quota.metrics])
@@ -1,16 +1,25 @@
 from __future__ import unicode_literals
 
+import Queue
 import os.path
+import subprocess
+import sys
+import threading
+import time
 
 import mock
 
 import pafy
 
+import pykka
+
 import pytest
 
 import vcr
 
+from mopidy_youtube import backend
 from mopidy_youtube import youtube
+from mopidy_youtube.backend import YouTubeLibraryProvider
 
 
 @pytest.yield_fixture
@@ -90,3 +99,691 @@ def test_audio_url_fail(pafy_mock):
     video = youtube.Video.get('unknown')
 
     assert not video.audio_url.get()
+
+
+@pytest.yield_fixture
+def youtube_dl_mock(monkeypatch):
+    monkeypatch.setattr(youtube.YoutubeDLPool, 'idle', [])
+    patcher = mock.patch.object(youtube, 'youtube_dl')
+    yield patcher.start()
+    patcher.stop()
+
+
+def test_youtube_dl_instances_are_reused(youtube_dl_mock):
+    youtube_dl_mock.YoutubeDL.side_effect = lambda params: mock.Mock()
+
+    with youtube.YoutubeDLPool.instance() as first:
+        with youtube.YoutubeDLPool.instance() as second:
+            assert first is not second  # one instance per thread at a time
+    with youtube.YoutubeDLPool.instance() as third:
+        pass
+
+    assert third in (first, second)
+    assert youtube_dl_mock.YoutubeDL.call_count == 2
+    ie = third.get_info_extractor.return_value
+    assert ie._player_cache is youtube.YoutubeDLPool.player_cache
+
+
+def test_audio_url_expiry():
+    expiry = youtube.AudioUrlCache.expiry
+
+    assert expiry('https://r1.googlevideo.com/videoplayback?'
+                  'expire=1500000000&id=o-abc') == 1500000000
+    assert expiry('https://manifest.googlevideo.com/api/manifest/dash/'
+                  'expire/1500000000/id/o-abc') == 1500000000
+    assert expiry('http://example.com/') > time.time()
+    assert expiry(None) is None
+
+
+def test_stale_audio_url_is_resolved_again(youtube_dl_mock):
+    extract_info = youtube_dl_mock.YoutubeDL.return_value.extract_info
+    extract_info.return_value = {
+        'url': 'http://example.com/?expire=%d' % (time.time() + 10)
+    }
+
+    video = youtube.Video.get('stale_audio')
+    assert video.audio_url.get(timeout=1)
+
+    extract_info.return_value = {'url': 'http://example.com/fresh'}
+
+    assert video.audio_url.get(timeout=1) == 'http://example.com/fresh'
+    assert extract_info.call_count == 2
+
+
+def test_queued_audio_url_is_refreshed(youtube_dl_mock):
+    extract_info = youtube_dl_mock.YoutubeDL.return_value.extract_info
+    extract_info.return_value = {
+        'url': 'http://example.com/?expire=%d' % (time.time() + 600)
+    }
+
+    video = youtube.Video.get('queued_audio')
+    youtube.AudioUrlCache.queue([video])
+    old_url = video.audio_url.get(timeout=1)
+
+    extract_info.return_value = {'url': 'http://example.com/fresh'}
+    for i in range(20):
+        if video.audio_url.get(timeout=1) != old_url:
+            break
+        time.sleep(0.1)
+
+    assert video.audio_url.get(timeout=1) == 'http://example.com/fresh'
+
+    youtube.AudioUrlCache.unqueue([video])
+
+
+# answers like mopidy_youtube.resolver, without youtube_dl
+resolver_script = '''
+import json, sys
+for line in iter(sys.stdin.readline, ''):
+    id = json.loads(line)['id']
+    if id == 'broken':
+        result = {'error': 'no video'}
+    else:
+        result = {'url': 'http://example.com/' + id, 'expire': 1}
+    sys.stdout.write(json.dumps(result) + '\\n')
+    sys.stdout.flush()
+'''
+
+
+@pytest.yield_fixture
+def resolver_processes(monkeypatch):
+    spawned = []
+
+    def spawn():
+        spawned.append(subprocess.Popen(
+            [sys.executable, '-c', resolver_script],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+        return spawned[-1]
+
+    monkeypatch.setattr(youtube.ResolverProcesses, 'size', 1)
+    monkeypatch.setattr(youtube.ResolverProcesses, 'recycle', 2)
+    monkeypatch.setattr(youtube.ResolverProcesses, 'idle', [])
+    monkeypatch.setattr(youtube.ResolverProcesses, 'slots', None)
+    monkeypatch.setattr(youtube.ResolverProcesses, 'spawn',
+                        staticmethod(spawn))
+    yield spawned
+    for process, count in youtube.ResolverProcesses.idle:
+        youtube.ResolverProcesses.stop(process)
+
+
+def test_resolver_processes_are_recycled(resolver_processes):
+    for id in ['a', 'b', 'c']:
+        assert youtube.ResolverProcesses.resolve(id) == (
+            'http://example.com/' + id, 1)
+
+    assert len(resolver_processes) == 2
+    assert resolver_processes[0].poll() == 0
+
+
+def test_resolver_process_errors(resolver_processes, youtube_dl_mock):
+    with pytest.raises(RuntimeError):
+        youtube.ResolverProcesses.resolve('broken')
+
+    # a process that died is replaced by resolving in this process
+    extract_info = youtube_dl_mock.YoutubeDL.return_value.extract_info
+    extract_info.return_value = {'url': 'http://example.com/local'}
+    resolver_processes[0].kill()
+    resolver_processes[0].wait()
+
+    url, expire = youtube.ResolverProcesses.resolve('dead')
+    assert url == 'http://example.com/local'
+
+
+@pytest.yield_fixture
+def blocked_pool(monkeypatch):
+    monkeypatch.setattr(youtube.ThreadPool, 'threads_max', 1)
+    event = threading.Event()
+    youtube.ThreadPool.run(event.wait)
+    yield event
+    event.set()
+
+
+def test_thread_pool_priorities(blocked_pool):
+    pool = youtube.ThreadPool
+    order = []
+    done = threading.Event()
+
+    pool.run(order.append, ('prefetch',), priority=pool.PREFETCH)
+    pool.run(order.append, ('lookup 1',), priority=pool.LOOKUP)
+    pool.run(order.append, ('playback',), priority=pool.PLAYBACK)
+    pool.run(order.append, ('lookup 2',), priority=pool.LOOKUP)
+    pool.run(done.set, priority=pool.PREFETCH)
+    blocked_pool.set()
+
+    assert done.wait(1)
+    assert order == ['playback', 'lookup 1', 'lookup 2', 'prefetch']
+
+
+def test_thread_pool_cancel_and_claim(blocked_pool):
+    pool = youtube.ThreadPool
+    future = pykka.ThreadingFuture()
+
+    pool.run(future.set, ('loaded',), priority=pool.PREFETCH,
+             futures=(future,))
+    pool.cancel(pool.PREFETCH)
+    blocked_pool.set()
+
+    with pytest.raises(pykka.Timeout):
+        future.get(timeout=0.2)
+
+    pool.claim(future)  # someone needs it after all
+
+    assert future.get(timeout=1) == 'loaded'
+
+
+def test_thread_pool_discard_leaves_claimed_jobs(blocked_pool):
+    pool = youtube.ThreadPool
+    future = pykka.ThreadingFuture()
+
+    pool.run(future.set, ('resolved',), futures=(future,))
+    pool.claim(future)      # eg. translate_uri, waiting for the audio url
+    pool.discard(future)    # the tracklist changed meanwhile
+    blocked_pool.set()
+
+    assert future.get(timeout=1) == 'resolved'
+
+
+def test_fan_out():
+    results = youtube.fan_out(lambda x: x * 2, range(10), 3)
+
+    assert sorted(results) == [(x, x * 2) for x in range(10)]
+
+
+def test_scrapi_list_videos_concurrently(monkeypatch):
+    page = ('<script>var ytInitialPlayerResponse = {"videoDetails": '
+            '{"title": "%s", "author": "chan", "lengthSeconds": "62"}};'
+            '</script>')
+    in_flight = []
+    all_started = threading.Event()
+
+    def get(url, params):
+        in_flight.append(params['v'])
+        if len(in_flight) == 3:
+            all_started.set()
+        all_started.wait(1)
+        return mock.Mock(text=page % ('title of ' + params['v']))
+
+    session = mock.Mock()
+    session.get.side_effect = get
+    monkeypatch.setattr(youtube.scrAPI, 'session', session)
+    monkeypatch.setattr(youtube.scrAPI, 'connections', 3)
+
+    items = list(youtube.scrAPI.iter_videos(['a', 'b', 'c']))
+
+    assert all_started.is_set()     # all three pages were requested at once
+    assert sorted(item.title for item in items) == \
+        ['title of a', 'title of b', 'title of c']
+
+
+def test_scrapi_search_stops_reading(monkeypatch):
+    renderer = '{"videoRenderer": {"videoId": "v%02d", "title": ' \
+        '{"simpleText": "\\u00e9 \\"%d\\" {"}}},'
+    page = b'<script>var ytInitialData = {"contents": [' + b''.join(
+        (renderer % (i, i)).encode('utf-8') for i in range(50)) + b']};'
+    chunks = [page[i:i + 10] for i in range(0, len(page), 10)]
+    read = []
+
+    def iter_content(chunk_size):
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    response = mock.Mock()
+    response.iter_content.side_effect = iter_content
+    session = mock.Mock()
+    session.get.return_value = response
+    monkeypatch.setattr(youtube.scrAPI, 'session', session)
+    monkeypatch.setattr(youtube.API, 'search_results', 3)
+
+    items = youtube.scrAPI.search('query')
+
+    assert [item.id for item in items] == ['v00', 'v01', 'v02']
+    assert items[2].title == '\u00e9 "2" {'
+    assert len(read) < len(chunks) / 10
+    assert session.get.call_args[1]['stream']
+    response.close.assert_called_once_with()
+
+
+@pytest.yield_fixture
+def search_cache(monkeypatch):
+    monkeypatch.setattr(youtube.SearchCache, 'cache', None)
+    monkeypatch.setattr(youtube.SearchCache, 'pending', {})
+    for counter in ('hits', 'misses', 'coalesced'):
+        monkeypatch.setattr(youtube.SearchCache, counter, 0)
+    yield youtube.SearchCache
+
+
+def test_cached_search_normalizes_queries(search_cache):
+    fetch = mock.Mock(return_value=['result'])
+
+    assert search_cache.search('Tito  Puente', fetch) == ['result']
+    assert search_cache.search(' tito puente\t', fetch) == ['result']
+    assert search_cache.search('\uff34ito puente', fetch) == ['result']
+    assert search_cache.search('tito puente 2', fetch) == ['result']
+
+    assert fetch.call_count == 2
+    assert search_cache.stats() == {
+        'hits': 2, 'misses': 2, 'coalesced': 0, 'entries': 2}
+
+
+def test_cached_search_expires(search_cache, monkeypatch):
+    monkeypatch.setattr(youtube.SearchCache, 'ttl', 0)
+    fetch = mock.Mock(return_value=['result'])
+
+    search_cache.search('chvrches', fetch)
+    search_cache.search('chvrches', fetch)
+
+    assert fetch.call_count == 2
+
+
+def test_cached_search_coalesces_concurrent_searches(search_cache):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch(q):
+        calls.append(q)
+        started.set()
+        release.wait(1)
+        return ['result']
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(search_cache.search('abc', fetch)))
+        for i in range(3)
+    ]
+    threads[0].start()
+    started.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    while search_cache.coalesced < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(1)
+
+    assert calls == ['abc']
+    assert results == [['result']] * 3
+
+
+def test_cached_search_does_not_keep_errors(search_cache):
+    fetch = mock.Mock(side_effect=[IOError('offline'), ['result']])
+
+    with pytest.raises(IOError):
+        search_cache.search('abc', fetch)
+
+    assert search_cache.search('abc', fetch) == ['result']
+
+
+@pytest.yield_fixture
+def list_videos(monkeypatch):
+    monkeypatch.setattr(youtube, 'api_enabled', True)
+    calls = []
+
+    def list_videos(ids):
+        calls.append(ids)
+        return [youtube.VideoData(id=id, title='title of ' + id, length=62)
+                for id in ids]
+
+    monkeypatch.setattr(youtube.API, 'list_videos', staticmethod(list_videos))
+    yield calls
+
+
+def test_load_info_single_flight(list_videos):
+    # different objects for the same video, eg. after an lru_cache eviction
+    first, second = youtube.Video(), youtube.Video()
+    first.id = second.id = 'sfl4ght0001'
+
+    youtube.Video.load_info([first])
+    youtube.Video.load_info([second])
+
+    assert first.title.get(timeout=1) == 'title of sfl4ght0001'
+    assert second.length.get(timeout=1) == 62
+    assert list_videos == [['sfl4ght0001']]
+
+
+def test_entry_search_sets_all_fields(list_videos, search_cache,
+                                      monkeypatch):
+    results = [
+        youtube.VideoData(id='srch4ll0001', title='a', length=62),
+        youtube.VideoData(id='srch4ll0002', title='b'),
+        youtube.PlaylistData(id='PLsrch4ll', title='c', video_count=7),
+    ]
+    monkeypatch.setattr(youtube.API, 'search', staticmethod(lambda q: results))
+
+    entries = youtube.Entry.search('all fields')
+    youtube.Video.load_info(entries[:2])
+
+    assert entries[0].peek('length') == 62
+    assert entries[1].length.get(timeout=1) == 62
+    assert entries[2].peek('video_count') == 7
+    assert list_videos == [['srch4ll0002']]     # only the one without length
+
+
+def test_load_info_merges_callers_into_batches(list_videos, monkeypatch):
+    monkeypatch.setattr(youtube.Batcher, 'window', 0.1)
+    videos = [youtube.Video.get('batch%06d' % i) for i in range(60)]
+
+    youtube.Video.load_info(videos[:30])
+    youtube.Video.load_info(videos[20:])
+
+    assert videos[-1].title.get(timeout=1) == 'title of batch000059'
+    assert [len(ids) for ids in list_videos] == [50, 10]
+
+
+def test_batcher_stats(list_videos, monkeypatch):
+    for counter in ('batches', 'ids', 'full', 'joined'):
+        monkeypatch.setattr(youtube.Batcher, counter, 0)
+    monkeypatch.setattr(youtube.Batcher, 'window', 0.1)
+    videos = [youtube.Video.get('stats%06d' % i) for i in range(55)]
+    other = youtube.Video()
+    other.id = videos[-1].id
+
+    youtube.Video.load_info(videos)
+    youtube.Video.load_info([other])
+
+    assert other.title.get(timeout=1) == 'title of stats000054'
+    assert youtube.Batcher.stats() == {
+        'batches': 2, 'ids': 55, 'full': 1, 'joined': 1, 'average': 27.5}
+
+
+def test_batch_priority_is_not_kept(monkeypatch):
+    monkeypatch.setattr(youtube, 'api_enabled', True)
+    monkeypatch.setattr(youtube.Batcher, 'window', 0)
+    pool = youtube.ThreadPool
+    priorities = Queue.Queue()
+
+    def list_videos(ids):
+        priorities.put(pool.current_priority())
+        return [youtube.VideoData(id=id, title='title of ' + id)
+                for id in ids]
+
+    monkeypatch.setattr(youtube.API, 'list_videos', staticmethod(list_videos))
+
+    # waiting on priorities rather than on the videos, claiming a video
+    # would promote its batch
+    with pool.priority(pool.LOOKUP):
+        youtube.Video.load_info([youtube.Video.get('batchprio01')])
+    assert priorities.get(timeout=1) == pool.LOOKUP
+    with pool.priority(pool.PREFETCH):
+        youtube.Video.load_info([youtube.Video.get('batchprio02')])
+    assert priorities.get(timeout=1) == pool.PREFETCH
+
+
+def test_batcher_id_requested_again_while_fetching(monkeypatch):
+    monkeypatch.setattr(youtube, 'api_enabled', True)
+    monkeypatch.setattr(youtube.Batcher, 'window', 0)
+    first, again = youtube.Video(), youtube.Video()
+    first.id = again.id = 'refetch0001'
+    calls = []
+    first_done = threading.Event()
+
+    def list_videos(ids):
+        calls.append(ids)
+        if len(calls) > 1:
+            first_done.wait(1)  # the second batch ends after the first
+        for id in ids:
+            yield youtube.VideoData(id=id, title='title of ' + id,
+                                    length=len(calls))
+            if len(calls) == 1:
+                # eg. after EntityStore.invalidate
+                youtube.Video.load_info([again])
+
+    store = youtube.Video._store
+
+    def store_and_signal(loaded, fields):
+        store(loaded, fields)
+        first_done.set()
+
+    monkeypatch.setattr(youtube.API, 'list_videos', staticmethod(list_videos))
+    monkeypatch.setattr(youtube.Video, '_store',
+                        staticmethod(store_and_signal))
+
+    youtube.Video.load_info([first])
+
+    assert first.length.get(timeout=1) == 1
+    assert again.length.get(timeout=1) == 2
+    later = youtube.Video.get('refetch0002')
+    youtube.Video.load_info([later])
+    assert later.title.get(timeout=1) == 'title of refetch0002'
+
+
+def test_playlist_videos_arrive_page_by_page(monkeypatch):
+    monkeypatch.setattr(youtube, 'api_enabled', True)
+    release = threading.Event()
+
+    def list_playlistitems(id, page, max_results):
+        if page:
+            release.wait(1)
+            return [youtube.VideoData(id='page2video1')], None
+        return [youtube.VideoData(id='page1video1'),
+                youtube.VideoData(id='page1video2')], 'page2'
+
+    monkeypatch.setattr(youtube.API, 'list_playlistitems',
+                        staticmethod(list_playlistitems))
+    monkeypatch.setattr(youtube.Video, 'load_info', classmethod(
+        lambda cls, videos: None))
+    playlist = youtube.Playlist.get('PLstreaming')
+
+    videos = playlist.iter_videos()
+    first_page = [next(videos).id, next(videos).id]
+    assert not release.is_set()     # second page is still loading
+    release.set()
+
+    assert first_page == ['page1video1', 'page1video2']
+    assert [video.id for video in videos] == ['page2video1']
+    assert len(playlist.videos.get(timeout=1)) == 3
+
+
+@pytest.yield_fixture
+def entity_store(monkeypatch):
+    store = youtube.EntityStore
+    monkeypatch.setattr(store, 'lru', youtube.OrderedDict())
+    monkeypatch.setattr(store, 'alive', {})
+    monkeypatch.setattr(store, 'stamps', youtube.weakref.WeakKeyDictionary())
+    for counter in ('size', 'hits', 'misses', 'revived', 'evictions',
+                    'expired'):
+        monkeypatch.setattr(store, counter, 0)
+    yield store
+
+
+def test_entity_store_identity(entity_store, monkeypatch):
+    video = youtube.Video.get('store000001')
+    assert youtube.Video.get('store000001') is video
+    assert youtube.Playlist.get('store000001') is not video
+
+    # over budget: only the most recently used object is kept, but an object
+    # that is still referenced is the same object when it's needed again
+    monkeypatch.setattr(entity_store, 'max_bytes', 1)
+    youtube.Video.get('store000002')
+    assert entity_store.stats()['entries'] == 1
+    assert youtube.Video.get('store000001') is video
+
+    stats = entity_store.stats()
+    assert (stats['hits'], stats['misses'], stats['revived']) == (1, 3, 1)
+    assert stats['evictions'] == 3
+    assert 0 < stats['bytes'] < 2000
+
+
+def test_entity_store_expires_fields(entity_store, monkeypatch):
+    monkeypatch.setattr(entity_store, 'ttls', {'title': -1})
+    video = youtube.Video.get('store000003')
+    video._set_api_data(['title', 'length'], youtube.VideoData(
+        id='store000003', title='a title', length=10))
+    entity_store.loaded([video], ['title', 'length'])
+
+    assert youtube.Video.get('store000003') is video
+    assert not video._is_loaded('title')
+    assert video.length.get(timeout=1) == 10
+    assert entity_store.stats()['expired'] == 1
+
+
+def test_entity_store_invalidate(entity_store):
+    video = youtube.Video.get('store000004')
+    video._set_api_data(['title', 'length'], youtube.VideoData(
+        id='store000004', title='a title', length=10))
+
+    entity_store.invalidate(youtube.Video, 'store000004', ['title'])
+    assert not video._is_loaded('title')
+    assert video._is_loaded('length')
+
+    entity_store.invalidate(youtube.Video, 'store000004')
+    assert not video._is_loaded('length')
+
+
+def test_loaded_entities_keep_plain_values(list_videos):
+    video = youtube.Video()
+    video.id = 'slots000001'
+    assert not hasattr(video, '__dict__')
+
+    youtube.Video.load_info([video])
+    assert video._pending['title'] is video.title    # being loaded
+
+    assert video.title.get(timeout=1) == 'title of slots000001'
+    assert video._pending is None
+    assert video._title == 'title of slots000001'
+    assert isinstance(video.length, youtube.Loaded)
+
+
+def test_pending_field_has_many_waiters():
+    video = youtube.Video()
+    video.id = 'waiters0001'
+    video._pend(['title'])
+    future = video._future('title')
+    titles = []
+
+    waiters = [
+        threading.Thread(target=lambda: titles.append(future.get(timeout=1)))
+        for i in range(3)
+    ]
+    for waiter in waiters:
+        waiter.start()
+    video._set('title', 'a title')
+    for waiter in waiters:
+        waiter.join()
+
+    assert titles == ['a title'] * 3
+
+
+@pytest.yield_fixture
+def quota(monkeypatch):
+    monkeypatch.setattr(youtube, 'api_enabled', True)
+    for name, value in [('daily', 250), ('tokens', None), ('updated', 0),
+                        ('failures', 0), ('blocked_until', 0)]:
+        monkeypatch.setattr(youtube.Quota, name, value)
+    session = mock.Mock()
+    session.get.return_value.status_code = 200
+    session.get.return_value.json.return_value = {'items': []}
+    monkeypatch.setattr(youtube.API, 'session', session)
+    monkeypatch.setattr(youtube.scrAPI, 'search', staticmethod(
+        lambda q: ['scraped']))
+    yield session.get.return_value
+
+
+def search_api_or_scraper():
+    return youtube.fetch(youtube.API.search, youtube.scrAPI.search, 'q')
+
+
+def test_api_quota_falls_back_to_scraper(quota):
+    assert search_api_or_scraper() == []
+    assert search_api_or_scraper() == []
+    assert search_api_or_scraper() == ['scraped']  # search costs 100 units
+
+    assert youtube.API.list_videos(['quota000001']) == []   # costs 1
+
+
+def test_api_quota_exceeded(quota):
+    quota.status_code = 403
+    quota.json.return_value = {
+        'error': {'errors': [{'reason': 'quotaExceeded'}]}}
+
+    assert search_api_or_scraper() == ['scraped']
+    assert youtube.Quota.blocked_until == \
+        youtube.Quota.reset_time(time.time())
+    assert youtube.Quota.reset_time(0) == 8 * 3600  # midnight PST
+
+    quota.status_code = 200
+    assert search_api_or_scraper() == ['scraped']   # until the reset
+
+
+def test_api_backoff(quota, monkeypatch):
+    monkeypatch.setattr(youtube.Quota, 'daily', 0)  # not counting units
+    quota.status_code = 429
+    with mock.patch.object(youtube.random, 'uniform',
+                           side_effect=lambda low, high: high):
+        search_api_or_scraper()
+        assert youtube.Quota.blocked_until - time.time() == \
+            pytest.approx(1, abs=0.1)
+        monkeypatch.setattr(youtube.Quota, 'blocked_until', 0)
+        search_api_or_scraper()
+        assert youtube.Quota.blocked_until - time.time() == \
+            pytest.approx(2, abs=0.1)
+
+    monkeypatch.setattr(youtube.Quota, 'blocked_until', 0)
+    quota.status_code = 200
+    assert search_api_or_scraper() == []
+    assert youtube.Quota.failures == 0
+
+
+def test_library_search_deadline(monkeypatch):
+    playlist = youtube.Playlist.get('PLdeadline')
+    playlist._set_api_data(['title', 'channel', 'thumbnails'],
+                           youtube.PlaylistData(id='PLdeadline', title='pl'))
+    monkeypatch.setattr(youtube.Entry, 'search',
+                        staticmethod(lambda q: [playlist]))
+    # video counts that never arrive
+    monkeypatch.setattr(youtube.Playlist, 'load_info', staticmethod(
+        lambda playlists: [p._pend(['video_count']) for p in playlists]))
+    monkeypatch.setattr(youtube.Playlist, 'videos', None)
+    monkeypatch.setattr(YouTubeLibraryProvider, 'search_deadline', 0.05)
+    library = YouTubeLibraryProvider(backend=mock.Mock())
+
+    start = time.time()
+    [track] = library.search({'any': ['deadline']}).tracks
+
+    assert time.time() - start < 1
+    assert track.album.name == 'YouTube Playlist'
+
+    playlist._set('video_count', 12)    # arrives late, for the next search
+    [track] = library.search({'any': ['deadline']}).tracks
+
+    assert track.album.name == 'YouTube Playlist (12 videos)'
+
+
+def test_library_lookup(list_videos):
+    library = YouTubeLibraryProvider(backend=mock.Mock())
+
+    [track] = library.lookup('yt:https://youtu.be/lookup00001')
+
+    assert track.uri == 'youtube:video/title of lookup00001.lookup00001'
+    assert track.length == 62000
+    assert list_videos == [['lookup00001']]
+
+
+@pytest.mark.parametrize('uri, ids', [
+    ('youtube:video/a.title.C0DPdy98e4c', ('C0DPdy98e4c', None)),
+    ('youtube:video/about youtube.com.C0DPdy98e4c', ('C0DPdy98e4c', None)),
+    ('youtube:playlist/a title.PLxyz', (None, 'PLxyz')),
+    ('yt:https://www.youtube.com/watch?v=C0DPdy98e4c&t=3',
+     ('C0DPdy98e4c', None)),
+    ('yt:https://www.youtube.com/watch?v=C0DPdy98e4c&list=PLxyz',
+     (None, 'PLxyz')),
+    ('yt:http://youtu.be/C0DPdy98e4c', ('C0DPdy98e4c', None)),
+])
+def test_parse_uri(uri, ids):
+    assert backend.parse_uri(uri) == ids
+
+
+def test_make_track_shares_slugs_and_artists():
+    video = youtube.Video.get('mktrack0001')
+    video._set_api_data(['title', 'channel'], youtube.VideoData(
+        id='mktrack0001', title='T\u00eftle;  (live)', channel='mktrack'))
+
+    first = backend.make_track(video, None, 1000)
+    second = backend.make_track(video, None, 1000, track_no=2)
+
+    assert first.name == 'T\u00eftle  (live)'
+    assert first.uri == 'youtube:video/Title (live).mktrack0001'
+    assert first.artists == second.artists
+    assert list(first.artists)[0] is list(second.artists)[0]
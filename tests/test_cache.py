@@ -0,0 +1,72 @@
+from __future__ import unicode_literals
+
+import pytest
+
+from mopidy_youtube import youtube
+from mopidy_youtube.cache import DiskCache
+
+
+@pytest.yield_fixture
+def disk_cache(tmpdir):
+    DiskCache.data = {}
+    DiskCache.loaded.clear()
+    DiskCache.open(str(tmpdir.join('metadata.db')))
+    DiskCache.loaded.wait(5)
+    yield DiskCache
+    DiskCache.loaded.clear()
+    DiskCache.connection.close()
+    DiskCache.connection = None
+    DiskCache.data = {}
+
+
+def test_put_get(disk_cache):
+    disk_cache.put('video', [('TU3b1qyEGsE', {'title': 'a title'})])
+    disk_cache.put('video', [('TU3b1qyEGsE', {'length': 400})])
+
+    assert disk_cache.get('video', 'TU3b1qyEGsE') == {
+        'title': 'a title',
+        'length': 400,
+    }
+    assert disk_cache.get('playlist', 'TU3b1qyEGsE') == {}
+
+
+def test_survives_restart(disk_cache):
+    disk_cache.put('playlist', [('PLxyz', {'thumbnails': ['a', 'b']})])
+
+    disk_cache.loaded.clear()
+    disk_cache.data = {}
+    disk_cache.open(disk_cache.path)
+    disk_cache.loaded.wait(5)
+
+    assert disk_cache.get('playlist', 'PLxyz') == {'thumbnails': ['a', 'b']}
+
+
+def test_expired_fields_are_ignored(disk_cache, monkeypatch):
+    disk_cache.put('video', [('TU3b1qyEGsE', {'title': 'a title'})])
+    monkeypatch.setattr(DiskCache, 'ttl', -1)
+
+    assert disk_cache.get('video', 'TU3b1qyEGsE') == {}
+
+
+def test_evicts_oldest(disk_cache, monkeypatch):
+    monkeypatch.setattr(DiskCache, 'max_entries', 10)
+    for i in range(11):
+        disk_cache.put('video', [('id%d' % i, {'title': 'title %d' % i})])
+
+    assert len(disk_cache.data) == 9
+    assert disk_cache.get('video', 'id0') == {}
+    assert disk_cache.get('video', 'id10') == {'title': 'title 10'}
+
+
+def test_load_info_from_cache(disk_cache):
+    disk_cache.put('video', [('C0DPdy98e4c', {
+        'title': 'a title',
+        'channel': 'a channel',
+        'length': 400,
+    })])
+
+    # no HTTP request is made, so no cassette is needed
+    video = youtube.Video.get('C0DPdy98e4c')
+
+    assert video.length.get(timeout=1) == 400
+    assert video.title.get(timeout=1) == 'a title'
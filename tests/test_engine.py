@@ -0,0 +1,83 @@
+from __future__ import unicode_literals
+
+import BaseHTTPServer
+import threading
+import time
+from urlparse import parse_qs, urlparse
+
+import pytest
+
+import requests
+
+from mopidy_youtube.engine import Engine, EngineSession
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        time.sleep(float(query.get('delay', [0])[0]))
+        status = int(query.get('status', [200])[0])
+        body = ('{"v": "%s", "agent": "%s"}' % (
+            query.get('v', [''])[0], self.headers['user-agent'])).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.yield_fixture(scope='module')
+def server():
+    BaseHTTPServer.HTTPServer.request_queue_size = 50
+    httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    # one thread per request, so that slow requests overlap
+    httpd.process_request = lambda request, address: threading.Thread(
+        target=BaseHTTPServer.HTTPServer.process_request,
+        args=(httpd, request, address)).start()
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    assert Engine.start({})
+    yield 'http://127.0.0.1:%d/' % httpd.server_address[1]
+    httpd.shutdown()
+
+
+@pytest.fixture
+def session():
+    return EngineSession(proxy_config={}, user_agent='Mopidy-YouTube/test')
+
+
+def test_get(server, session):
+    response = session.get(server + 'watch', params={'v': 'abc'})
+
+    assert response.status_code == 200
+    assert response.json()['v'] == 'abc'
+    assert response.json()['agent'].startswith('Mopidy-YouTube/test')
+
+
+def test_get_error_status(server, session):
+    response = session.get(server + 'watch', params={'status': 404})
+
+    assert response.status_code == 404
+    with pytest.raises(requests.HTTPError):
+        response.raise_for_status()
+
+
+def test_get_many_in_flight_at_once(server, session):
+    queries = [{'v': 'id%d' % i, 'delay': 0.5} for i in range(20)]
+
+    start = time.time()
+    results = list(session.get_many(server + 'watch', queries, 'test'))
+
+    assert time.time() - start < 5  # not one after the other
+    assert sorted(response.json()['v'] for query, response in results) == \
+        sorted(query['v'] for query in queries)
+
+
+def test_get_many_failed_request(session):
+    results = list(session.get_many('http://127.0.0.1:1/', [{'v': 'a'}],
+                                    'test'))
+
+    assert results == [({'v': 'a'}, None)]
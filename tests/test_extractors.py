@@ -0,0 +1,132 @@
+from __future__ import unicode_literals
+
+import io
+import os.path
+
+import pytest
+
+from mopidy_youtube.extractors import JSONExtractor, RegexExtractor
+from mopidy_youtube.records import PlaylistData, VideoData
+
+
+def read_page(name):
+    path = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages', name)
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture(scope='module')
+def search_page():
+    return read_page('search.html')
+
+
+@pytest.fixture(scope='module')
+def playlist_page():
+    return read_page('playlist.html')
+
+
+def test_json_search(search_page):
+    items = list(JSONExtractor.search(search_page))
+
+    assert len(items) == 20
+    assert isinstance(items[0], VideoData)
+    assert items[0].id == 'jr1vkFu5h-d'
+    assert items[0].title == 'CHVRCHES - The Mother We Share'
+    assert items[0].channel == 'CHVRCHES'
+    assert items[0].length == 400
+    assert len(items[0].thumbnails) == 1
+
+    assert isinstance(items[3], PlaylistData)
+    assert items[3].video_count == 1108
+
+
+def test_json_video():
+    items = list(JSONExtractor.video(read_page('watch.html'), 'C0DPdy98e4c'))
+
+    assert items == [VideoData(
+        id='C0DPdy98e4c',
+        title='TEST VIDEO',
+        channel='Jimmy Jones',
+        length=5,
+    )]
+
+
+def test_json_playlist(playlist_page):
+    items = list(JSONExtractor.playlist(playlist_page, 'PLxyz'))
+
+    assert len(items) == 1
+    assert items[0].id == 'PLxyz'
+    assert items[0].title == 'CHVRCHES - Live Sessions'
+    assert items[0].channel == 'Mopidy'
+    assert items[0].video_count == 100
+
+
+def test_json_playlistitems(playlist_page):
+    items = list(JSONExtractor.playlistitems(playlist_page))
+
+    assert len(items) == 100
+    assert items[0] == VideoData(
+        id='rkWBj3jokJX', title='CHVRCHES - The Mother We Share #0')
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_json_stream(search_page, playlist_page, size):
+    def chunks(text):
+        return (text[i:i + size] for i in range(0, len(text), size))
+
+    assert list(JSONExtractor.search_stream(chunks(search_page))) == \
+        list(JSONExtractor.search(search_page))
+    assert list(JSONExtractor.playlistitems_stream(chunks(playlist_page))) \
+        == list(JSONExtractor.playlistitems(playlist_page))
+
+
+def test_json_renderers():
+    page = ('<script>"a": {"b": 0}; var ytInitialData = {"x": "\\"a\\": {", '
+            '"a": {"a": {"b": 1}}, "c": [{"a": {"b": 2}}]};</script>')
+
+    assert list(JSONExtractor.renderers(page, 'ytInitialData', ('a',))) == [
+        ('a', {'a': {'b': 1}}), ('a', {'b': 2})]
+
+
+def test_json_without_data():
+    assert list(JSONExtractor.search('<html>ytInitialData.foo</html>')) == []
+    assert list(JSONExtractor.video('<html></html>', 'C0DPdy98e4c')) == []
+
+
+def test_regex_video():
+    page = ('<div id="watch7-content">\n'
+            '<meta itemprop="name" content="a title">\n'
+            '<meta itemprop="duration" content="PT1M2S">\n'
+            '<link itemprop="url" href="http://www.youtube.com/user/chan">\n'
+            '</div>')
+
+    items = list(RegexExtractor.video(page, 'C0DPdy98e4c'))
+
+    assert items[0].title == 'a title'
+    assert items[0].length == 62
+
+
+def test_regex_search():
+    items = list(RegexExtractor.search(read_page('legacy/search.html')))
+
+    assert [item.id for item in items] == \
+        [item.id for item in JSONExtractor.search(read_page('search.html'))]
+    assert items[0].title == 'CHVRCHES - The Mother We Share'
+    assert items[0].channel == 'CHVRCHES'
+    assert items[0].length == 400
+    assert isinstance(items[3], PlaylistData)
+    assert items[3].video_count == 1108
+
+
+def test_regex_playlist():
+    page = read_page('legacy/playlist.html')
+
+    [playlist] = RegexExtractor.playlist(page, 'PLxyz')
+    items = list(RegexExtractor.playlistitems(page))
+
+    assert playlist.title == 'CHVRCHES - Live Sessions'
+    assert playlist.channel == 'Mopidy'
+    assert playlist.video_count == 100
+    assert len(items) == 100
+    assert items[0] == VideoData(
+        id='rkWBj3jokJX', title='CHVRCHES - The Mother We Share #0')
@@ -0,0 +1,85 @@
+from __future__ import unicode_literals
+
+import mock
+
+from mopidy.models import TlTrack, Track
+
+import pykka
+
+import pytest
+
+from mopidy_youtube import youtube
+from mopidy_youtube.frontend import YouTubeFrontend
+
+
+def resolved(value):
+    future = pykka.ThreadingFuture()
+    future.set(value)
+    return future
+
+
+@pytest.yield_fixture
+def core():
+    core = mock.Mock()
+    tl_tracks = [
+        TlTrack(tlid, Track(uri=uri)) for tlid, uri in enumerate([
+            'youtube:video/a.ahead000001',
+            'youtube:video/b.ahead000002',
+            'local:track:c.mp3',
+            'youtube:video/d.ahead000004',
+            'youtube:video/e.ahead000005',
+        ], 1)
+    ]
+    core.tracklist.get_tl_tracks.return_value = resolved(tl_tracks)
+    core.tracklist.index.side_effect = lambda tl_track: \
+        resolved(tl_tracks.index(tl_track))
+    core.playback.get_current_tl_track.return_value = resolved(None)
+    core.tl_tracks = tl_tracks
+    yield core
+
+
+@pytest.yield_fixture
+def keep():
+    with mock.patch.object(youtube.AudioUrlCache, 'keep') as keep:
+        yield keep
+
+
+def kept_ids(keep):
+    return [video.id for video in keep.call_args[0][0]]
+
+
+def test_resolves_tracks_ahead(core, keep):
+    frontend = YouTubeFrontend({'youtube': {'resolve_ahead': 2}}, core)
+
+    frontend.tracklist_changed()
+    assert kept_ids(keep) == ['ahead000001', 'ahead000002']
+
+    # the window moves on while playing, other backends' tracks are skipped
+    current = core.tl_tracks[1]
+    core.playback.get_current_tl_track.return_value = resolved(current)
+    frontend.track_playback_started(current)
+    assert kept_ids(keep) == ['ahead000004']
+
+
+def test_resolve_ahead_disabled(core, keep):
+    frontend = YouTubeFrontend({'youtube': {'resolve_ahead': 0}}, core)
+
+    frontend.tracklist_changed()
+
+    assert kept_ids(keep) == []
+
+
+def test_keep_drops_removed_videos(monkeypatch):
+    monkeypatch.setattr(youtube.AudioUrlCache, 'queued', {})
+    monkeypatch.setattr(youtube.AudioUrlCache, 'queue', classmethod(
+        lambda cls, videos: cls.queued.update((v.id, v) for v in videos)))
+    first, second = youtube.Video(), youtube.Video()
+    first.id, second.id = 'keep0000001', 'keep0000002'
+    first._pend(['audio_url'])
+
+    with mock.patch.object(youtube.ThreadPool, 'discard') as discard:
+        youtube.AudioUrlCache.keep([first])
+        youtube.AudioUrlCache.keep([second])
+
+    assert list(youtube.AudioUrlCache.queued) == ['keep0000002']
+    discard.assert_called_once_with(first._pending['audio_url'])
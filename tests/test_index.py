@@ -0,0 +1,88 @@
+from __future__ import unicode_literals
+
+import mock
+
+from mopidy.models import Album, Artist, Ref, Track
+
+import pytest
+
+from mopidy_youtube.backend import YouTubeLibraryProvider
+from mopidy_youtube.index import Index
+
+
+def track(kind, id, name, channel, album=None):
+    return Track(
+        name=name,
+        comment=id,
+        artists=[Artist(name=channel)],
+        album=Album(name=album) if album else None,
+        uri='youtube:%s/%s.%s' % (kind, name, id),
+    )
+
+
+video = track('video', 'C0DPdy98e4c', 'Leave a Trace', 'CHVRCHES')
+playlist = track('playlist', 'PLxyz', 'Live Sessions', 'Mopidy')
+in_playlist = track('video', 'jr1vkFu5h-d', 'The Mother We Share',
+                    'CHVRCHES', album='Live Sessions')
+
+
+@pytest.yield_fixture
+def index():
+    max_videos = Index.max_videos
+    Index.configure(100)
+    Index.add_search('chvrches / live', [video, playlist])
+    Index.add_playlist(playlist, [in_playlist])
+    yield Index
+    Index.configure(max_videos)
+
+
+def test_browse(index):
+    assert len(index.browse('youtube:browse')) == 3
+    assert index.browse('youtube:browse/searches') == [Ref.directory(
+        uri='youtube:browse/search/chvrches%20%2F%20live',
+        name='chvrches / live')]
+    assert index.browse('youtube:browse/search/chvrches%20%2F%20live') == [
+        Ref.track(uri=video.uri, name=video.name),
+        Ref.album(uri=playlist.uri, name=playlist.name),
+    ]
+    assert index.browse('youtube:browse/channels') == [
+        Ref.directory(uri='youtube:browse/channel/CHVRCHES', name='CHVRCHES'),
+        Ref.directory(uri='youtube:browse/channel/Mopidy', name='Mopidy'),
+    ]
+    assert {ref.name for ref in index.browse(
+        'youtube:browse/channel/CHVRCHES')} == {
+            'Leave a Trace', 'The Mother We Share'}
+    assert [ref.name for ref in index.browse(playlist.uri)] == [
+        'The Mother We Share']
+    assert index.browse('youtube:video/foo') is None
+
+
+def test_search(index):
+    assert set(index.search({'artist': ['chvrches']})) == \
+        {video, in_playlist}
+    assert set(index.search({'album': ['live']})) == {in_playlist, playlist}
+    assert index.search({'artist': ['mopidy'], 'album': ['sessions']}) == \
+        [playlist]
+    assert index.search({'track_name': ['mother']}) == [in_playlist]
+    assert index.search({'artist': ['chvrch']}, exact=True) == []
+
+
+def test_disabled(index):
+    index.configure(0)
+    index.add_search('query', [video])
+
+    assert index.browse('youtube:browse/searches') == []
+    assert index.search({'artist': ['chvrches']}) == []
+
+
+def test_library_provider(index):
+    library = YouTubeLibraryProvider(backend=mock.Mock())
+
+    with mock.patch('mopidy_youtube.youtube.Entry.search') as search:
+        result = library.search({'artist': ['mopidy']})
+
+    assert result.tracks == (playlist,)
+    assert not search.called
+    assert library.root_directory.uri == 'youtube:browse'
+    assert library.browse('youtube:browse/playlists') == [
+        Ref.album(uri=playlist.uri, name=playlist.name)]
@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+import mock
+
+import pytest
+
+from mopidy_youtube import youtube
+from mopidy_youtube.metrics import Metrics, factory
+
+
+@pytest.yield_fixture
+def metrics(monkeypatch):
+    monkeypatch.setattr(Metrics, 'counters', {})
+    monkeypatch.setattr(Metrics, 'histograms', {})
+    monkeypatch.setattr(Metrics, 'collectors', [])
+    yield Metrics
+
+
+def test_timed_counts_calls_and_errors(metrics):
+    with mock.patch('time.time', side_effect=[10.0, 10.2, 20.0, 23.0]):
+        with metrics.timed('request_seconds', endpoint='api.search'):
+            pass
+        with pytest.raises(ValueError):
+            with metrics.timed('request_seconds', endpoint='api.search'):
+                raise ValueError()
+
+    text = metrics.prometheus()
+
+    assert '# TYPE mopidy_youtube_request_seconds histogram' in text
+    assert 'mopidy_youtube_request_seconds_bucket' \
+        '{endpoint="api.search",le="0.25"} 1' in text
+    assert 'mopidy_youtube_request_seconds_bucket' \
+        '{endpoint="api.search",le="+Inf"} 2' in text
+    assert 'mopidy_youtube_request_seconds_count' \
+        '{endpoint="api.search"} 2' in text
+    assert 'mopidy_youtube_request_seconds_errors_total' \
+        '{endpoint="api.search"} 1' in text
+    assert metrics.quantile('request_seconds', 0.5,
+                            endpoint='api.search') == 0.25
+    assert metrics.quantile('request_seconds', 0.95,
+                            endpoint='api.search') == 5
+
+
+def test_collectors(metrics, monkeypatch):
+    monkeypatch.setattr(youtube.ThreadPool, 'jobs', {
+        youtube.ThreadPool.PLAYBACK: [],
+        youtube.ThreadPool.LOOKUP: [],
+        youtube.ThreadPool.PREFETCH: ['job', 'job'],
+    })
+    metrics.collectors.append(youtube.ThreadPool.metrics)
+    metrics.collectors.append(lambda: [('broken', 'gauge', {}, 1 / 0)])
+
+    text = metrics.prometheus()
+
+    assert 'mopidy_youtube_jobs_queued{priority="prefetch"} 2' in text
+    assert 'mopidy_youtube_jobs_queued{priority="playback"} 0' in text
+    assert 'jobs_queued{priority="prefetch"}=2' in metrics.summary()
+    assert 'broken' not in text
+
+
+def test_cache_metrics(metrics, monkeypatch):
+    monkeypatch.setattr(youtube.SearchCache, 'hits', 3)
+    monkeypatch.setattr(youtube.SearchCache, 'coalesced', 0)
+    monkeypatch.setattr(youtube.SearchCache, 'misses', 1)
+    metrics.collectors.append(youtube.cache_metrics)
+
+    text = metrics.prometheus()
+
+    assert 'mopidy_youtube_cache_hits_total{cache="search"} 3' in text
+    assert 'mopidy_youtube_cache_hit_ratio{cache="search"} 0.75' in text
+
+
+def test_http_app():
+    [(path, handler)] = factory({}, None)
+
+    assert path == r'/metrics'
+    assert handler.__name__ == 'MetricsHandler'
@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+from mopidy_youtube.records import PlaylistData, VideoData, parse_duration
+
+
+def test_parse_duration():
+    assert parse_duration('PT1H2M10S') == 3730
+    assert parse_duration('PT4M') == 240
+    assert parse_duration(None) is None
+
+
+def test_video_from_api():
+    video = VideoData.from_api({
+        'id': 'TU3b1qyEGsE',
+        'snippet': {
+            'title': 'a title',
+            'channelTitle': 'a channel',
+        },
+        'contentDetails': {
+            'duration': 'PT6M40S',
+        },
+    })
+
+    assert video == VideoData('TU3b1qyEGsE', 'a title', 'a channel', 400)
+
+
+def test_playlist_item_from_api():
+    video = VideoData.from_api({
+        'snippet': {
+            'title': 'a title',
+            'resourceId': {'videoId': 'TU3b1qyEGsE'},
+        },
+    })
+
+    assert video == VideoData(id='TU3b1qyEGsE', title='a title')
+
+
+def test_playlist_from_api():
+    playlist = PlaylistData.from_api({
+        'id': {'kind': 'youtube#playlist', 'playlistId': 'PLxyz'},
+        'snippet': {
+            'title': 'a title',
+            'channelTitle': 'a channel',
+            'thumbnails': {
+                'default': {'url': 'default.jpg'},
+                'medium': {'url': 'medium.jpg'},
+            },
+        },
+        'contentDetails': {
+            'itemCount': 60,
+        },
+    })
+
+    assert playlist == PlaylistData(
+        'PLxyz', 'a title', 'a channel', ['medium.jpg'], 60)